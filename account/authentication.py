@@ -0,0 +1,92 @@
+"""
+TokenAuthentication с кэшем token -> user.
+
+Стандартный TokenAuthentication делает SELECT authtoken_token JOIN auth_user
+на каждый запрос. Здесь результат кэшируется на TOKEN_CACHE['TIMEOUT'] секунд
+в кэше из settings.CACHES, общем для воркеров. Сброс по сигналам
+(account/signals.py): удаление токена (в том числе logout) и любое сохранение
+юзера (деактивация, смена данных).
+
+В кэше лежат только поля из USER_FIELDS, без хэша пароля и прочих данных юзера:
+из них собирается User как из .only() - остальные поля догружаются по pk при обращении.
+
+BACKEND 'lru' (в памяти процесса) сигнал сбрасывает только в том воркере,
+который обработал logout - остальные пускают отозванный токен, пока запись
+не истечет, поэтому для него TTL не больше LOCAL_TIMEOUT секунд.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from main.cache import CacheStats, make_backend
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'django',
+    'ALIAS': 'shared',
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 300,
+    'LOCAL_TIMEOUT': 5,
+}
+# что нужно аутентификации и проверкам прав (is_active, IsAdminUser);
+# в порядке полей модели - Model.from_db раскладывает значения по нему
+USER_FIELDS = ('id', 'username', 'is_staff', 'is_active')
+
+
+class TokenCache:
+
+    def __init__(self, config=None):
+        config = {**DEFAULTS, **(config or {})}
+        if config['BACKEND'] == 'lru':
+            config['TIMEOUT'] = min(config['TIMEOUT'], config['LOCAL_TIMEOUT'])
+        self.enabled = config['ENABLED']
+        self.lookups = CacheStats()
+        self.backend = make_backend(config, 'TOKEN_CACHE')
+
+    @staticmethod
+    def key(token_key):
+        return f'token:{token_key}'
+
+    def get(self, token_key):
+        if not self.enabled:
+            return None
+        values = self.backend.get(self.key(token_key))
+        if values is None:
+            self.lookups.incr('misses')
+            return None
+        self.lookups.incr('hits')
+        # новые объекты на каждый запрос: LRUCache отдает один и тот же кортеж всем потокам
+        user = User.from_db(None, USER_FIELDS, values)
+        token = Token.from_db(None, ('key', 'user_id'), (token_key, user.pk))
+        token.user = user
+        return token
+
+    def set(self, token):
+        if self.enabled:
+            self.backend.set(self.key(token.key), tuple(getattr(token.user, name) for name in USER_FIELDS))
+
+    def invalidate(self, token_keys):
+        for token_key in token_keys:
+            self.backend.delete(self.key(token_key))
+
+    def stats(self):
+        return {
+            'lookups': self.lookups.as_dict(),
+            'backend': {**self.backend.stats.as_dict(), 'size': len(self.backend)},
+        }
+
+
+token_cache = TokenCache(getattr(settings, 'TOKEN_CACHE', None))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in замена rest_framework.authentication.TokenAuthentication."""
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is not None:
+            return token.user, token
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(token)
+        return user, token
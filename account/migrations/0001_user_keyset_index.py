@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # индекс для keyset пагинации UserListView по (date_joined, id)
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS auth_user_keyset_idx ON auth_user (date_joined, id);',
+            'DROP INDEX IF EXISTS auth_user_keyset_idx;',
+        ),
+    ]
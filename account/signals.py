@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    # logout (CustomLoguotView) удаляет токен, сюда же - каскад при удалении юзера
+    token_cache.invalidate([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # деактивация и любые изменения юзера; токен не зависит от пароля, а login сохраняет только last_login
+    if created or (update_fields is not None and set(update_fields) <= {'last_login', 'password'}):
+        return
+    token_cache.invalidate(Token.objects.filter(user=instance).values_list('key', flat=True))
@@ -1,6 +1,10 @@
 from django.shortcuts import render
 from rest_auth.views import LogoutView, LoginView
 from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .authentication import token_cache
 
 
 class CustomLoguotView(LogoutView):
@@ -8,4 +12,11 @@ class CustomLoguotView(LogoutView):
 
 
 class CustomLoginView(LoginView):
-    permission_classes = (permissions.AllowAny, )
\ No newline at end of file
+    permission_classes = (permissions.AllowAny, )
+
+# api/v1/accounts/token-cache-stats/
+class TokenCacheStatsView(APIView):
+    permission_classes = (permissions.IsAdminUser, )
+
+    def get(self, request):
+        return Response(token_cache.stats())
@@ -0,0 +1,54 @@
+"""
+PostgreSQL backend с пулом соединений (pool.py).
+
+    DATABASES['default'] = {
+        'ENGINE': 'blogApi.backends.postgresql_pool',
+        ...,
+        'POOL': {'MIN_SIZE': 2, 'MAX_SIZE': 20},
+    }
+
+CONN_MAX_AGE оставить 0: соединение "закрывается" в конце запроса,
+то есть возвращается в пул, а не держится за потоком.
+"""
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.base import Database
+
+from .pool import close_pools, get_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # свободные соединения пула к тестовой базе не дадут ее удалить
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        key = (self.alias, conn_params.get('database'), repr(sorted(conn_params.items())))
+        self.pool = get_pool(key, self.settings_dict.get('POOL'), lambda: Database.connect(**conn_params))
+        connection = self.pool.getconn()
+        # как в base.DatabaseWrapper.get_new_connection, но для соединения из пула
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        # внутри atomic Django оставляет ссылку на соединение - в пул его отдавать нельзя
+        discard = self.in_atomic_block or (self.errors_occurred and not self.is_usable())
+        with self.wrap_database_errors:
+            self.pool.putconn(self.connection, discard=discard)
@@ -0,0 +1,265 @@
+"""
+Пул соединений для backend'а blogApi.backends.postgresql_pool.
+
+Django закрывает соединение в конце каждого запроса (CONN_MAX_AGE = 0) -
+backend вместо закрытия возвращает его сюда, следующий запрос берет готовое.
+Потокобезопасен: WSGI потоки и поток sync_to_async под ASGI берут соединения
+из одного пула процесса. После fork (gunicorn --preload) пул создается заново.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.db.backends.postgresql.base import Database
+
+logger = logging.getLogger('main.sql')
+
+DEFAULTS = {
+    'MIN_SIZE': 1,            # столько простаивающих соединений не закрываем
+    'MAX_SIZE': 10,           # больше не открываем, остальные ждут
+    'TIMEOUT': 10,            # сколько ждать свободное соединение, сек
+    'MAX_IDLE': 300,          # простаивающие дольше закрываются (сверх MIN_SIZE)
+    'MAX_LIFETIME': 3600,     # соединения старше пересоздаются
+    'HEALTH_CHECK_AFTER': 30, # SELECT 1 при выдаче, если соединение простаивало дольше
+}
+
+
+class PoolTimeout(Database.OperationalError):
+    """Нет свободного соединения за TIMEOUT. Django оборачивает его в django.db.OperationalError."""
+
+
+class PoolClosed(Database.InterfaceError):
+    pass
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.checkouts = self.waits = self.timeouts = 0
+        self.created = self.failed_checks = self.evicted = self.recycled = self.discarded = 0
+        self.wait_total = self.wait_max = 0.0
+
+    def as_dict(self):
+        return {
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'wait_ms_total': round(self.wait_total * 1000, 2),
+            'wait_ms_max': round(self.wait_max * 1000, 2),
+            'wait_ms_avg': round(self.wait_total * 1000 / self.waits, 2) if self.waits else 0.0,
+            'timeouts': self.timeouts,
+            'created': self.created,
+            'failed_checks': self.failed_checks,
+            'evicted': self.evicted,
+            'recycled': self.recycled,
+            'discarded': self.discarded,
+        }
+
+
+class ConnectionPool:
+    """
+    connect() - фабрика новых соединений (psycopg2 connection или совместимый объект).
+    Свободные соединения - стек: берется самое свежее, старые дольше простаивают и вытесняются.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10, max_idle=300, max_lifetime=3600,
+                 health_check_after=30):
+        self.connect = connect
+        self.min_size, self.max_size = min_size, max_size
+        self.timeout, self.max_idle, self.max_lifetime = timeout, max_idle, max_lifetime
+        self.health_check_after = health_check_after
+        self.cond = threading.Condition()
+        self.idle = []      # [(connection, вернули в пул)]
+        self.born = {}      # id(connection) -> создано
+        self.size = 0       # открытых: свободные + выданные
+        self.closed = False  # после close() выданные соединения закрываются при возврате
+        self.stats = PoolStats()
+
+    def getconn(self):
+        started = time.monotonic()
+        while True:
+            connection, expired = self._take(started)
+            self._close_all(expired)
+            if connection is None:
+                return self._create()
+            if self._healthy(*connection):
+                return connection[0]
+            with self.cond:
+                self.stats.failed_checks += 1
+            self._discard(connection[0])
+
+    def _take(self, started):
+        """(свободное соединение или None - открыть новое, вытесненные из простоя)."""
+        waited = False
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise PoolClosed('Connection pool is closed')
+                expired = self._evict_idle()
+                if self.idle:
+                    connection = self.idle.pop()
+                elif self.size < self.max_size:
+                    self.size += 1
+                    connection = None
+                else:
+                    remaining = started + self.timeout - time.monotonic()
+                    if remaining <= 0:
+                        self.stats.timeouts += 1
+                        logger.warning('connection pool exhausted: %s in use, waited %.1fs',
+                                       self.size, self.timeout)
+                        raise PoolTimeout(f'No free connection in pool of {self.max_size} '
+                                          f'after {self.timeout}s')
+                    waited = True
+                    self.cond.wait(remaining)
+                    continue
+                self.stats.checkouts += 1
+                if waited:
+                    wait = time.monotonic() - started
+                    self.stats.waits += 1
+                    self.stats.wait_total += wait
+                    self.stats.wait_max = max(self.stats.wait_max, wait)
+                return connection, expired
+
+    def _create(self):
+        try:
+            connection = self.connect()
+        except Exception:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.born[id(connection)] = time.monotonic()
+            self.stats.created += 1
+        return connection
+
+    def _healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    def putconn(self, connection, discard=False):
+        """Вернуть соединение. Незавершенная транзакция откатывается, сломанное - закрывается."""
+        now = time.monotonic()
+        if not discard and not connection.closed and now - self.born.get(id(connection), now) > self.max_lifetime:
+            with self.cond:
+                self.stats.recycled += 1
+            discard = True
+        if not discard and not connection.closed:
+            try:
+                # у psycopg2 0 - TRANSACTION_STATUS_IDLE, 4 - UNKNOWN (соединение потеряно)
+                status = connection.get_transaction_status()
+                if status == 4:
+                    discard = True
+                elif status != 0:
+                    connection.rollback()
+            except Exception:
+                discard = True
+        if discard or connection.closed:
+            self._discard(connection)
+            return
+        with self.cond:
+            # пул закрыли, пока соединение было выдано
+            closed = self.closed
+            if not closed:
+                self.idle.append((connection, now))
+                expired = self._evict_idle()
+                self.cond.notify()
+        if closed:
+            self._discard(connection)
+        else:
+            self._close_all(expired)
+
+    def _discard(self, connection):
+        with self.cond:
+            self.size -= 1
+            self.born.pop(id(connection), None)
+            self.stats.discarded += 1
+            self.cond.notify()
+        self._close_all([connection])
+
+    def _evict_idle(self):
+        """Под self.cond. Снимает со стека простаивающие дольше MAX_IDLE, оставляя MIN_SIZE."""
+        deadline = time.monotonic() - self.max_idle
+        expired = []
+        # самые старые - в начале стека
+        while self.idle and self.size > self.min_size and self.idle[0][1] < deadline:
+            connection, _ = self.idle.pop(0)
+            self.size -= 1
+            self.born.pop(id(connection), None)
+            self.stats.evicted += 1
+            expired.append(connection)
+        return expired
+
+    @staticmethod
+    def _close_all(connections):
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def close(self):
+        """Закрыть свободные соединения; выданные закроются при возврате, новых пул не выдает."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+            for connection, _ in idle:
+                self.born.pop(id(connection), None)
+        self._close_all(connection for connection, _ in idle)
+
+    def snapshot(self):
+        with self.cond:
+            in_use = self.size - len(self.idle)
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'saturation': round(in_use / self.max_size, 4),
+                **self.stats.as_dict(),
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, config, connect):
+    """Пул процесса по ключу (алиас + параметры подключения)."""
+    pid = os.getpid()
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.pid != pid or pool.closed:
+            # после fork соединения родителя не трогаем - сокет общий
+            config = {**DEFAULTS, **(config or {})}
+            pool = ConnectionPool(
+                connect, config['MIN_SIZE'], config['MAX_SIZE'], config['TIMEOUT'], config['MAX_IDLE'],
+                config['MAX_LIFETIME'], config['HEALTH_CHECK_AFTER'],
+            )
+            pool.pid = pid
+            _pools[key] = pool
+        return pool
+
+
+def close_pools(alias=None):
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if alias is None or key[0] == alias]
+    for pool in pools:
+        pool.close()
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = list(_pools.items())
+    return [{'alias': key[0], 'database': key[1], **pool.snapshot()} for key, pool in pools]
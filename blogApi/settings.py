@@ -50,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.QueryInstrumentationMiddleware',
+    'main.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,15 +85,38 @@ WSGI_APPLICATION = 'blogApi.wsgi.application'
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # postgresql + пул соединений (blogApi/backends/postgresql_pool), CONN_MAX_AGE оставить 0
+        'ENGINE': 'blogApi.backends.postgresql_pool',
         'NAME': 'blog_api',
         'USER': 'hello',
         'PASSWORD': '1',
         'HOST': 'localhost',
         'PORT': 5432,
+        'POOL': {
+            'MIN_SIZE': 2,
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 20)),  # на процесс: воркеры * MAX_SIZE < max_connections
+            'TIMEOUT': 10,
+            'MAX_IDLE': 300,
+            'MAX_LIFETIME': 3600,
+            'HEALTH_CHECK_AFTER': 30,
+        },
     }
  }
 
+# Реплики только для чтения (main/replicas.py): DATABASE_REPLICA_HOSTS=host1,host2.
+# Локально проверить можно с DATABASE_REPLICA_HOSTS=localhost - второй алиас на ту же базу.
+for number, host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['main.replicas.ReplicaRouter']
+
+DATABASE_REPLICAS = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'PIN_SECONDS': 5,           # сколько после записи клиент читает только с primary
+    'COOKIE_NAME': 'primary_until',
+    'CACHE_ALIAS': 'shared',    # закрепление по Authorization - общий для воркеров кэш
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -145,7 +170,115 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'account.authentication.CachedTokenAuthentication',
     ],
 
 }
+
+
+# Кэш ответов PostViewSet (main/cache.py)
+# BACKEND: 'django' - кэш ALIAS из CACHES (общий для воркеров), 'lru' - в памяти процесса:
+# только для одного воркера, сигналы сбрасывают его лишь в своем процессе
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'posts': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var/cache/posts'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # общий для всех воркеров хоста; на нескольких хостах - Redis/Memcached
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var/cache/shared'),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+POST_CACHE = {
+    'ENABLED': True,
+    'BACKEND': os.environ.get('POST_CACHE_BACKEND', 'django'),
+    'ALIAS': 'posts',
+    'MAX_ENTRIES': 2048,
+    'TIMEOUT': 300,
+}
+
+# token -> user для account.authentication.CachedTokenAuthentication;
+# BACKEND 'django' - общий для всех воркеров кэш из CACHES[ALIAS]: logout и деактивация
+# сбрасывают его сразу для всех. 'lru' - в памяти процесса, сигнал сбрасывает только
+# свой воркер, поэтому запись там живет не дольше LOCAL_TIMEOUT секунд
+TOKEN_CACHE = {
+    'ENABLED': True,
+    'BACKEND': os.environ.get('TOKEN_CACHE_BACKEND', 'django'),
+    'ALIAS': 'shared',
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 300,
+}
+
+# рейтинг /api/v1/posts/trending/ (main/trending.py); после смены весов - manage.py rebuild_trending
+TRENDING = {
+    'WEIGHTS': {'like': 1, 'comment': 2, 'favorite': 3},
+    'HALF_LIFE_HOURS': 24,
+    'TOP_K': 20,
+    'MAX_TOP_K': 100,
+}
+
+# write-behind лайков и избранного (main/writebehind.py): реакции копятся в локальном
+# SQLite-буфере и пачками сбрасываются в базу фоновым потоком или manage.py flush_reactions
+REACTION_BUFFER = {
+    'ENABLED': os.environ.get('REACTION_BUFFER', 'off') == 'on',
+    'PATH': os.path.join(BASE_DIR, 'var/reactions.sqlite3'),
+    'FLUSH_INTERVAL': 1.0,
+    'BATCH_SIZE': 5000,
+}
+
+# SQL на каждый запрос (main/middleware.py): Server-Timing + лог main.sql
+# (WARNING - только медленные запросы и N+1). Включается QUERY_INSTRUMENTATION=on
+QUERY_INSTRUMENTATION = {
+    'ENABLED': os.environ.get('QUERY_INSTRUMENTATION', 'off') == 'on',
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_QUERIES': 3,
+    'DETECT_N_PLUS_ONE': True,
+    'N_PLUS_ONE_THRESHOLD': 10,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'main.sql': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
+# Уменьшенные копии картинок (main/images.py), генерируются в фоне
+IMAGE_VARIANTS = {
+    'thumbnail': {'size': (320, 320), 'format': 'JPEG', 'quality': 80},
+    'medium': {'size': (1024, 1024), 'format': 'JPEG', 'quality': 85},
+    'webp': {'size': (1024, 1024), 'format': 'WEBP', 'quality': 80},
+}
+IMAGE_WORKERS = 2
+
+# Потоковая загрузка картинок (main/uploads.py)
+IMAGE_UPLOAD = {
+    'CHUNK_SIZE': 64 * 1024,
+    'MAX_BUFFER': 4 * 1024 * 1024,
+    'MAX_FILE_SIZE': 20 * 1024 * 1024,
+    'MAX_PIXELS': 50_000_000,
+    'IDLE_TIMEOUT': 30,
+    'WAIT_TIMEOUT': 60,
+}
+
+# Сколько последних комментариев встраивать в GET /posts/<id>/
+POST_DETAIL_COMMENTS = 10
+
+# Сколько последних избранных встраивать в GET /accounts/<id>/
+USER_DETAIL_FAVORITES = 10
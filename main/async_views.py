@@ -0,0 +1,139 @@
+"""
+Async версии горячих GET эндпоинтов (работают под blogApi/asgi.py).
+
+DRF 3.13 синхронный, поэтому здесь обычные Django async views: данные берутся
+через async ORM (aget/acount/async for), а в JSON превращаются теми же
+сериализаторами, что и в PostViewSet - после загрузки они в БД не ходят.
+Готовые варианты картинок (main/images.py) загружаются заранее через sync_to_async.
+Ответы совпадают с синхронными, кроме пагинации: списки постов - всегда keyset.
+Кэш ответов (main/cache.py) здесь не используется.
+
+    /api/v1/async/posts/                 ~ /api/v1/posts/?pagination=cursor
+    /api/v1/async/posts/<id>/            ~ /api/v1/posts/<id>/
+    /api/v1/async/posts/<id>/comments/   ~ /api/v1/posts/<id>/comments/
+    /api/v1/async/categories/            ~ /api/v1/categories/
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Subquery
+from django.http import JsonResponse
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException, AuthenticationFailed, MethodNotAllowed, NotFound
+from rest_framework.request import Request
+
+from account.authentication import token_cache
+
+from . import images, serializers
+from .models import Category, Comment, Like, Post
+from .pagination import KeysetPagination, PostCommentPagination
+
+
+async def authenticate(request):
+    """CachedTokenAuthentication для async views: тот же заголовок Authorization: Token <key>."""
+    header = request.headers.get('Authorization', '').split()
+    if not header or header[0].lower() != 'token':
+        return AnonymousUser()
+    if len(header) != 2:
+        raise AuthenticationFailed('Invalid token header.')
+    token = token_cache.get(header[1])
+    if token is None:
+        try:
+            token = await Token.objects.select_related('user').aget(key=header[1])
+        except Token.DoesNotExist:
+            raise AuthenticationFailed('Invalid token.')
+        token_cache.set(token)
+    if not token.user.is_active:
+        raise AuthenticationFailed('User inactive or deleted.')
+    return token.user
+
+
+def async_api_view(view):
+    """GET-only обертка: DRF Request для query_params, ошибки DRF -> JSON, как в синхронных view."""
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            if request.method != 'GET':
+                raise MethodNotAllowed(request.method)
+            drf_request = Request(request)
+            drf_request.user = await authenticate(request)
+            data = await view(drf_request, *args, **kwargs)
+            return JsonResponse(data, safe=False, json_dumps_params={'ensure_ascii': False})
+        except APIException as exc:
+            return JsonResponse({'detail': exc.detail}, status=exc.status_code)
+
+    return wrapper
+
+
+async def get_post(queryset, pk):
+    try:
+        return await queryset.aget(pk=pk)
+    except Post.DoesNotExist:
+        raise NotFound()
+
+
+@async_api_view
+async def post_list(request):
+    queryset = serializers.PostFeedSerializer.narrow(Post.objects.feed(request.user), request)
+    params = request.query_params
+    try:
+        if params.get('category'):
+            queryset = queryset.filter(category_id=int(params['category']))
+        if params.get('owner'):
+            queryset = queryset.filter(owner_id=int(params['owner']))
+        if params.get('category_tree'):
+            path = Subquery(Category.objects.filter(pk=int(params['category_tree'])).values('path')[:1])
+            queryset = queryset.filter(category__in=Category.objects.subtree(path).values('pk'))
+    except ValueError:
+        raise NotFound()
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(queryset, request)
+    # варианты картинок - в аннотациях feed(), запросов при сериализации нет
+    data = serializers.PostFeedSerializer(page, many=True, context={'request': request}).data
+    return paginator.get_paginated_response(data).data
+
+
+@async_api_view
+async def post_detail(request, pk):
+    serializer = serializers.PostSerializer(context={'request': request})
+    # картинки - prefetch внутри aget(), комментарии - в newest_comments для PostSerializer;
+    # при ?fields= грузится только то, что запрошено
+    queryset = Post.objects.select_related('owner', 'category').prefetch_related('images')
+    post = await get_post(serializer.narrow(queryset, request), pk)
+    if 'comments' in serializer.fields:
+        post.newest_comments = [
+            comment async for comment in post.comments.select_related('owner')
+            .order_by('-created_at', '-id')[:serializers.PostSerializer.comments_limit()]
+        ]
+    names = serializers.variant_names(serializer, [post])
+    if 'images' in serializer.fields:
+        names += serializers.variant_names(serializer.fields['images'].child, post.images.all())
+    await sync_to_async(images.ready_variants)(names)
+    serializer.instance = post
+    data = serializer.data
+    if request.user.is_authenticated and serializer.wants('is_liked'):
+        data['is_liked'] = await Like.objects.filter(post_id=post.pk, owner=request.user).aexists()
+    return data
+
+
+@async_api_view
+async def post_comments(request, pk):
+    post = await get_post(Post.objects.only('comments_count'), pk)
+    paginator = PostCommentPagination()
+    page = await paginator.apaginate_queryset(Comment.objects.filter(post_id=post.pk).select_related('owner'),
+                                              request)
+    if paginator.count is None:
+        paginator.count = post.comments_count
+    return paginator.get_paginated_response(serializers.CommentSerializer(page, many=True).data).data
+
+
+@async_api_view
+async def category_list(request):
+    if request.query_params.get('tree') not in ('1', 'true'):
+        categories = [category async for category in Category.objects.all()]
+        return serializers.CategorySerializer(categories, many=True).data
+    categories = [category async for category in Category.objects.order_by('depth', 'name', 'id')]
+    roots = serializers.CategoryTreeSerializer.nest(categories)
+    return serializers.CategoryTreeSerializer(roots, many=True).data
@@ -0,0 +1,256 @@
+"""
+Бенчмарк всех маршрутов main/urls.py и account/urls.py через тестовый клиент.
+
+Для каждого эндпоинта: перцентили латентности и количество SQL запросов.
+Endpoint.budget - максимальное число запросов, превышение = провал.
+Маршрут без эндпоинта в ENDPOINTS - тоже провал (missing_budgets()).
+Сравнение с сохраненным baseline (JSON): больше запросов или p95 хуже в tolerance раз = провал.
+Запускается командой benchmark_api и тестом в main/tests.py.
+"""
+import json
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.urls import URLResolver, get_resolver, resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .cache import post_cache
+from .middleware import QueryRecorder
+from .models import Category, Comment, Post
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+
+class Endpoint:
+
+    def __init__(self, name, method, path, budget, auth=True, data=None, setup=None, format='json'):
+        # format='ndjson': data - список строк, тело уходит как application/x-ndjson
+        self.name = name
+        self.method = method
+        self.path = path
+        self.budget = budget
+        self.auth = auth
+        self.data = data
+        self.setup = setup  # setup(ctx, i) -> kwargs для path/data, не попадает в замер
+        self.format = format
+
+
+class Context:
+    """Объекты, на которые ссылаются эндпоинты. Создаются внутри откатываемой транзакции."""
+
+    def __init__(self):
+        self.user = User.objects.create_user('benchmark', password=BENCHMARK_PASSWORD, is_staff=True)
+        self.token = Token.objects.create(user=self.user)
+        self.post = Post.objects.order_by('-comments_count').first() or Post.objects.create(
+            title='benchmark post', body='benchmark', owner=self.user)
+        self.own_post = Post.objects.create(title='benchmark own post', body='benchmark', owner=self.user)
+        self.comment = Comment.objects.create(post=self.post, owner=self.user, body='benchmark')
+        self.category = Category.objects.filter(parent=None).first() or Category.objects.create(name='benchmark')
+
+    def new_post(self, i):
+        return {'pk': Post.objects.create(title=f'benchmark delete {i}', owner=self.user).pk}
+
+    def new_comment(self, i):
+        return {'pk': Comment.objects.create(post=self.post, owner=self.user, body='benchmark').pk}
+
+    def new_token(self, i):
+        Token.objects.filter(user=self.user).delete()
+        self.token = Token.objects.create(user=self.user)
+        return {}
+
+    def like(self, i):
+        self.user.liked.get_or_create(post=self.post)
+        return {}
+
+    def unlike(self, i):
+        self.user.liked.filter(post=self.post).delete()
+        return {}
+
+
+ENDPOINTS = (
+    # main/urls.py
+    Endpoint('posts-list', 'get', '/api/v1/posts/', budget=3),
+    Endpoint('posts-list-anonymous', 'get', '/api/v1/posts/', budget=2, auth=False),
+    Endpoint('posts-list-category-tree', 'get', '/api/v1/posts/?category_tree={category}', budget=3),
+    Endpoint('posts-list-cursor', 'get', '/api/v1/posts/?pagination=cursor&count=false', budget=2),
+    Endpoint('posts-search', 'get', '/api/v1/posts/search/?q=lorem', budget=3),
+    Endpoint('posts-detail', 'get', '/api/v1/posts/{post}/', budget=5),
+    Endpoint('posts-create', 'post', '/api/v1/posts/', budget=4,
+             data={'title': 'benchmark created {i}', 'body': 'text'}, format='multipart'),
+    Endpoint('posts-update', 'put', '/api/v1/posts/{own_post}/', budget=5,
+             data={'title': 'benchmark own post', 'body': 'updated {i}'}, format='multipart'),
+    Endpoint('posts-partial-update', 'patch', '/api/v1/posts/{own_post}/', budget=4,
+             data={'body': 'patched {i}'}, format='multipart'),
+    Endpoint('posts-destroy', 'delete', '/api/v1/posts/{pk}/', budget=8, setup=Context.new_post),
+    Endpoint('posts-comments', 'get', '/api/v1/posts/{post}/comments/', budget=3),
+    Endpoint('posts-add-like', 'post', '/api/v1/posts/{post}/add_like/', budget=3, setup=Context.unlike),
+    Endpoint('posts-remove-like', 'post', '/api/v1/posts/{post}/remove_like/', budget=3, setup=Context.like),
+    Endpoint('posts-get-likes', 'get', '/api/v1/posts/{own_post}/get_likes/', budget=3),
+    Endpoint('posts-favorite', 'post', '/api/v1/posts/{post}/favorite_posts/', budget=4),
+    Endpoint('posts-reactions', 'post', '/api/v1/posts/reactions/', budget=9, setup=Context.unlike,
+             data={'reactions': [{'post': '{post}', 'type': 'like', 'value': True},
+                                 {'post': '{own_post}', 'type': 'favorite', 'value': True},
+                                 {'post': '{own_post}', 'type': 'like', 'value': False}]}),
+    Endpoint('posts-trending', 'get', '/api/v1/posts/trending/', budget=2),
+    Endpoint('posts-cache-stats', 'get', '/api/v1/posts/cache_stats/', budget=1),
+    Endpoint('posts-export', 'get', '/api/v1/posts/export/?comments=true', budget=2),
+    Endpoint('posts-import', 'post', '/api/v1/posts/import/', budget=12, format='ndjson',
+             data=[{'type': 'post', 'title': 'benchmark imported {i}', 'body': 'text'},
+                   {'type': 'comment', 'post': 'benchmark imported {i}', 'body': 'text'},
+                   {'type': 'like', 'post': '{post}'},
+                   {'type': 'favorite', 'post': '{post}'}]),
+    Endpoint('api-root', 'get', '/api/v1/', budget=0),
+    Endpoint('categories', 'get', '/api/v1/categories/', budget=1, auth=False),
+    Endpoint('categories-tree', 'get', '/api/v1/categories/?tree=true', budget=1, auth=False),
+    Endpoint('comments-list-cursor', 'get', '/api/v1/comments/?pagination=cursor', budget=3),
+    Endpoint('comments-create', 'post', '/api/v1/comments/', budget=4,
+             data={'post': '{post}', 'body': 'benchmark {i}'}),
+    Endpoint('comments-detail', 'get', '/api/v1/comments/{comment}/', budget=3),
+    Endpoint('comments-update', 'put', '/api/v1/comments/{comment}/', budget=5,
+             data={'post': '{post}', 'body': 'updated {i}'}),
+    Endpoint('comments-destroy', 'delete', '/api/v1/comments/{pk}/', budget=5, setup=Context.new_comment),
+    Endpoint('db-pool-stats', 'get', '/api/v1/db-pool-stats/', budget=0),
+    # main/async_views.py
+    Endpoint('async-posts-list', 'get', '/api/v1/async/posts/', budget=2),
+    Endpoint('async-list-category-tree', 'get', '/api/v1/async/posts/?category_tree={category}', budget=2),
+    Endpoint('async-posts-detail', 'get', '/api/v1/async/posts/{post}/', budget=4),
+    Endpoint('async-posts-comments', 'get', '/api/v1/async/posts/{post}/comments/', budget=2),
+    Endpoint('async-categories', 'get', '/api/v1/async/categories/', budget=1, auth=False),
+    Endpoint('async-categories-tree', 'get', '/api/v1/async/categories/?tree=true', budget=1, auth=False),
+    # account/urls.py
+    Endpoint('users-list-cursor', 'get', '/api/v1/accounts/?pagination=cursor', budget=2, auth=False),
+    Endpoint('users-detail', 'get', '/api/v1/accounts/{user}/', budget=5),
+    Endpoint('users-favorites', 'get', '/api/v1/accounts/{user}/favorites/', budget=3),
+    Endpoint('users-register', 'post', '/api/v1/accounts/register/', budget=4, auth=False,
+             data={'username': 'benchmark_{i}', 'email': 'b{i}@example.com', 'first_name': 'Bench',
+                   'last_name': 'Mark', 'password': 'qwerty123', 'password2': 'qwerty123'}),
+    Endpoint('users-login', 'post', '/api/v1/accounts/login/', budget=10, auth=False,
+             data={'username': 'benchmark', 'password': BENCHMARK_PASSWORD}),
+    Endpoint('token-cache-stats', 'get', '/api/v1/accounts/token-cache-stats/', budget=0),
+    Endpoint('users-logout', 'post', '/api/v1/accounts/logout/', budget=4, setup=Context.new_token),
+)
+URLCONFS = ('main.urls', 'account.urls')
+
+
+def routes(urlconfs=URLCONFS):
+    """
+    Маршруты из urlconfs в виде ResolverMatch.route, без дублей DRF с суффиксом формата (.json, .api).
+    """
+    def walk(patterns, route, included):
+        for pattern in patterns:
+            # как django.urls.resolvers._join_route
+            path = route + str(pattern.pattern).removeprefix('^') if route else str(pattern.pattern)
+            if isinstance(pattern, URLResolver):
+                module = getattr(pattern.urlconf_module, '__name__', None)
+                yield from walk(pattern.url_patterns, path, included or module in urlconfs)
+            elif included and 'format' not in pattern.pattern.regex.groupindex:
+                yield path
+
+    return set(walk(get_resolver().url_patterns, '', False))
+
+
+def missing_budgets(endpoints=ENDPOINTS):
+    """Маршруты, для которых в endpoints нет ни одного эндпоинта, а значит, и бюджета запросов."""
+    params = {'i': 0, 'pk': 1, 'post': 1, 'own_post': 1, 'comment': 1, 'user': 1, 'category': 1}
+    covered = {resolve(endpoint.path.format(**params).split('?')[0]).route for endpoint in endpoints}
+    return sorted(routes() - covered)
+
+
+def _format(value, params):
+    if isinstance(value, str):
+        return value.format(**params)
+    if isinstance(value, dict):
+        return {key: _format(item, params) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_format(item, params) for item in value]
+    return value
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run(iterations=10, endpoints=ENDPOINTS, use_cache=False):
+    """
+    Прогоняет эндпоинты и откатывает все изменения в БД.
+    Возвращает {name: {'queries', 'budget', 'p50_ms', 'p95_ms', 'p99_ms', 'statuses'}}.
+    """
+    results = {}
+    cache_enabled, post_cache.enabled = post_cache.enabled, use_cache
+    try:
+        with transaction.atomic():
+            ctx = Context()
+            client = APIClient(SERVER_NAME='localhost')
+            for endpoint in endpoints:
+                results[endpoint.name] = _run_endpoint(client, ctx, endpoint, iterations)
+            transaction.set_rollback(True)
+    finally:
+        post_cache.enabled = cache_enabled
+    return results
+
+
+def _run_endpoint(client, ctx, endpoint, iterations):
+    timings, queries, statuses = [], [], set()
+    for i in range(iterations):
+        params = {'i': i, 'post': ctx.post.pk, 'own_post': ctx.own_post.pk,
+                  'comment': ctx.comment.pk, 'user': ctx.user.pk, 'category': ctx.category.pk}
+        if endpoint.setup is not None:
+            params.update(endpoint.setup(ctx, i))
+        headers = {'HTTP_AUTHORIZATION': f'Token {ctx.token.key}'} if endpoint.auth else {}
+        request = getattr(client, endpoint.method)
+        kwargs = {'data': _format(endpoint.data, params), 'format': endpoint.format} if endpoint.data else {}
+        if endpoint.format == 'ndjson':
+            kwargs = {'data': '\n'.join(json.dumps(row) for row in kwargs['data']),
+                      'content_type': 'application/x-ndjson'}
+
+        recorder = QueryRecorder(slow_queries=0, detect_n_plus_one=False)
+        with connections['default'].execute_wrapper(recorder):
+            started = time.perf_counter()
+            response = request(endpoint.path.format(**params), **kwargs, **headers)
+            if response.streaming:
+                # выгрузка читает базу, пока отдается тело
+                b''.join(response.streaming_content)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(recorder.count)
+        statuses.add(response.status_code)
+    return {
+        'queries': max(queries),
+        'budget': endpoint.budget,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'statuses': sorted(statuses),
+    }
+
+
+def check(results, baseline=None, tolerance=1.5, min_ms=5.0):
+    """Список нарушений: бюджет запросов, ошибки 5xx, регрессии относительно baseline."""
+    problems = []
+    for name, result in results.items():
+        if result['queries'] > result['budget']:
+            problems.append(f'{name}: {result["queries"]} queries > budget {result["budget"]}')
+        if any(status >= 500 for status in result['statuses']):
+            problems.append(f'{name}: server error {result["statuses"]}')
+        if not baseline or name not in baseline:
+            continue
+        before = baseline[name]
+        if result['queries'] > before['queries']:
+            problems.append(f'{name}: {result["queries"]} queries, baseline {before["queries"]}')
+        if result['p95_ms'] > max(before['p95_ms'] * tolerance, before['p95_ms'] + min_ms):
+            problems.append(f'{name}: p95 {result["p95_ms"]}ms, baseline {before["p95_ms"]}ms')
+    return problems
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
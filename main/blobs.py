@@ -0,0 +1,146 @@
+"""
+Счетчик ссылок на файлы картинок (ImageBlob) и сборка мусора.
+
+Ссылки - Post.preview и PostImages.image. Счетчики двигают сигналы
+(main/signals.py), после bulk_create их нужно двигать самим через retain().
+Удаляются только файлы без ссылок, не менявшиеся дольше grace секунд:
+загрузка пишет файл раньше, чем коммитится строка, которая на него ссылается.
+Повторная загрузка того же файла сдвигает его mtime (ContentAddressedStorage.save),
+а collect() перепроверяет каждый файл прямо перед удалением.
+"""
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest, Now
+from django.utils import timezone
+
+from . import images
+from .models import ImageBlob, Post, PostImages
+from .storage import get_image_storage, is_addressed
+
+
+def _by_count(names):
+    counts = Counter(name for name in names if name)
+    grouped = {}
+    for name, count in counts.items():
+        grouped.setdefault(count, []).append(name)
+    return grouped
+
+
+def retain(names):
+    grouped = _by_count(names)
+    if not grouped:
+        return
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name) for group in grouped.values() for name in group], ignore_conflicts=True
+    )
+    for count, group in grouped.items():
+        ImageBlob.objects.filter(name__in=group).update(refcount=F('refcount') + count, updated_at=Now())
+
+
+def release(names):
+    for count, group in _by_count(names).items():
+        ImageBlob.objects.filter(name__in=group).update(
+            refcount=Greatest(F('refcount') - count, 0), updated_at=Now()
+        )
+
+
+def referenced_names():
+    """{name: число ссылок} по реальным строкам."""
+    counts = Counter(PostImages.objects.exclude(image='').values_list('image', flat=True))
+    counts.update(Post.objects.exclude(preview='').exclude(preview=None).values_list('preview', flat=True))
+    return counts
+
+
+def rebuild_refcounts():
+    """Пересчитывает refcount по реальным ссылкам. Возвращает число блобов."""
+    counts = referenced_names()
+    ImageBlob.objects.bulk_create([ImageBlob(name=name) for name in counts], ignore_conflicts=True)
+    blobs = list(ImageBlob.objects.all())
+    changed = [blob for blob in blobs if blob.refcount != counts.get(blob.name, 0)]
+    for blob in changed:
+        blob.refcount = counts.get(blob.name, 0)
+        blob.updated_at = timezone.now()
+    ImageBlob.objects.bulk_update(changed, ['refcount', 'updated_at'], batch_size=1000)
+    return len(blobs)
+
+
+def readdress(storage=None):
+    """
+    Переносит старые файлы (Spider_Man_60PRstl.jpeg) в контентно-адресуемые имена,
+    одинаковые копии схлопываются в один файл. Старые файлы остаются сиротами до collect().
+    Возвращает {старое имя: новое имя}.
+    """
+    storage = storage or get_image_storage()
+    moved = {}
+    for name in referenced_names():
+        if is_addressed(name) or not storage.exists(name):
+            continue
+        with storage.open(name, 'rb') as f:
+            moved[name] = storage.save(name, f)
+    for old, new in moved.items():
+        PostImages.objects.filter(image=old).update(image=new)
+        Post.objects.filter(preview=old).update(preview=new)
+    if moved:
+        rebuild_refcounts()
+    return moved
+
+
+def _orphan_files(storage, directory, known, older_than):
+    root = storage.path(directory)
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d != 'variants']
+        for filename in files:
+            full_path = os.path.join(path, filename)
+            name = os.path.relpath(full_path, storage.location).replace(os.sep, '/')
+            if name not in known and os.path.getmtime(full_path) < older_than:
+                yield name
+
+
+def _referenced(name):
+    return (PostImages.objects.filter(image=name).exists()
+            or Post.objects.filter(preview=name).exists())
+
+
+def collect(grace=3600, dry_run=False, directory='images', storage=None):
+    """
+    Удаляет файлы (и их варианты) без ссылок: блобы с refcount = 0 и файлы, о которых
+    ImageBlob не знает. Перед удалением ссылки перепроверяются по реальным строкам.
+    Возвращает (список удаленных имен, освобождено байт).
+    """
+    storage = storage or get_image_storage()
+    referenced = referenced_names()
+    deadline, older_than = timezone.now() - timedelta(seconds=grace), time.time() - grace
+    candidates = set(ImageBlob.objects.filter(refcount=0, updated_at__lt=deadline).values_list('name', flat=True))
+    known = set(ImageBlob.objects.values_list('name', flat=True))
+    candidates.update(_orphan_files(storage, directory, known, older_than))
+    candidates -= set(referenced)
+
+    deleted, freed = [], 0
+    for name in sorted(candidates):
+        if dry_run:
+            freed += storage.size(name) if storage.exists(name) else 0
+            deleted.append(name)
+            continue
+        # пока шел обход, загрузка могла снова сослаться на файл: строку блоба удаляем,
+        # только если она все еще без ссылок (retain() в чужой транзакции держит ее блокировку),
+        # а файл - только если его mtime не сдвинул повторный save()
+        with transaction.atomic():
+            if _referenced(name):
+                continue
+            if name in known:
+                rows, _ = ImageBlob.objects.filter(name=name, refcount=0, updated_at__lt=deadline).delete()
+                if not rows:
+                    continue
+            size = storage.size(name) if storage.exists(name) else 0
+            if storage.delete_if_stale(name, older_than):
+                images.delete_variants(name, storage)
+                freed += size
+            elif storage.exists(name):
+                continue
+        deleted.append(name)
+    return deleted, freed
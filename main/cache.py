@@ -0,0 +1,356 @@
+"""
+Кэш ответов PostViewSet.
+
+Кэшируется только общая для всех часть ответа (сериализованный пост,
+страница ленты). Пользовательские флаги is_liked/is_favorited
+досчитываются поверх кэша отдельным запросом.
+
+Сброс точечный, по сигналам (см. main/signals.py):
+  post:<pk>:version  - версия поста; любое его изменение (лайк, комментарий, картинка,
+                       правка) ставит новую
+  post:<pk>:<версия>:<вариант>
+                     - детальная страница поста: каждый вариант (host + ?fields=, ?expand=,
+                       ?format=) под своим ключом; с другими параметрами ответ не кэшируется.
+                       Новая версия = старые варианты недоступны и вытесняются по TIMEOUT
+  post:<pk>:<версия>:validator
+                     - валидатор детальной страницы для ETag (main/conditional.py)
+  posts:list:...     - страница ленты хранит версии своих постов и при расхождении
+                       считается промахом: лайк сбрасывает только страницы с этим постом
+  posts:list:gen     - поколение ленты: создание, правка, удаление постов и категорий
+                       (меняется состав страниц); новое поколение = все старые страницы недоступны
+
+Все, что кладется в кэш, читается с primary (replicas.read_from_primary):
+запрос с реплики, отстающей от только что сброшенной записи, иначе вернул бы
+в кэш старые данные до TIMEOUT.
+
+Бэкенды:
+  'lru'    - LRUCache в памяти процесса. Сигналы сбрасывают его только в том процессе,
+             где была запись: годится только для одного воркера (runserver, один процесс
+             с потоками), иначе другие воркеры отдают старое до TIMEOUT
+  'django' - любой кэш из settings.CACHES (FileBasedCache, Redis, ...), общий для всех воркеров
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .fieldsets import EXPAND_PARAM, FIELDS_PARAM
+from .replicas import read_from_primary
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'lru',
+    'ALIAS': 'default',
+    'MAX_ENTRIES': 2048,
+    'TIMEOUT': 300,
+}
+
+_MISSING = object()
+
+
+class CacheStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = self.misses = self.sets = self.deletes = self.evictions = 0
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'sets': self.sets,
+            'deletes': self.deletes,
+            'evictions': self.evictions,
+        }
+
+
+class LRUCache:
+    """Потокобезопасный LRU с TTL и ограничением по количеству записей."""
+
+    def __init__(self, max_entries=1024, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.stats.incr('hits')
+                    return value
+                del self._data[key]
+        self.stats.incr('misses')
+        return default
+
+    def set(self, key, value, timeout=_MISSING):
+        timeout = self.timeout if timeout is _MISSING else timeout
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            evicted = 0
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        self.stats.incr('sets')
+        if evicted:
+            self.stats.incr('evictions', evicted)
+
+    def delete(self, key):
+        with self._lock:
+            existed = self._data.pop(key, _MISSING) is not _MISSING
+        self.stats.incr('deletes')
+        return existed
+
+    def get_many(self, keys):
+        values = {}
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                values[key] = value
+        return values
+
+    def set_many(self, data, timeout=_MISSING):
+        for key, value in data.items():
+            self.set(key, value, timeout)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoCache:
+    """Обертка над кэшем из settings.CACHES, чтобы считать попадания так же, как LRUCache."""
+
+    def __init__(self, alias='default', timeout=300):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.stats = CacheStats()
+
+    def get(self, key, default=None):
+        value = self.cache.get(key, _MISSING)
+        if value is _MISSING:
+            self.stats.incr('misses')
+            return default
+        self.stats.incr('hits')
+        return value
+
+    def set(self, key, value, timeout=_MISSING):
+        self.cache.set(key, value, self.timeout if timeout is _MISSING else timeout)
+        self.stats.incr('sets')
+
+    def delete(self, key):
+        self.stats.incr('deletes')
+        return self.cache.delete(key)
+
+    def get_many(self, keys):
+        values = self.cache.get_many(keys)
+        self.stats.incr('hits', len(values))
+        self.stats.incr('misses', len(keys) - len(values))
+        return values
+
+    def set_many(self, data, timeout=_MISSING):
+        self.cache.set_many(data, self.timeout if timeout is _MISSING else timeout)
+        self.stats.incr('sets', len(data))
+
+    def clear(self):
+        self.cache.clear()
+
+    def __len__(self):
+        return 0
+
+
+def make_backend(config, setting_name):
+    """LRUCache или DjangoCache по словарю настроек вида POST_CACHE."""
+    if config['BACKEND'] == 'lru':
+        return LRUCache(config['MAX_ENTRIES'], config['TIMEOUT'])
+    if config['BACKEND'] == 'django':
+        return DjangoCache(config['ALIAS'], config['TIMEOUT'])
+    raise ValueError(f"Unknown {setting_name} backend: {config['BACKEND']!r}")
+
+
+class PostCache:
+    list_generation_key = 'posts:list:gen'
+    # параметры, от которых зависит детальная страница; с любыми другими она не кэшируется
+    detail_params = (FIELDS_PARAM, EXPAND_PARAM, 'format')
+
+    def __init__(self, config=None):
+        config = {**DEFAULTS, **(config or {})}
+        self.enabled = config['ENABLED']
+        self.responses = CacheStats()
+        self.backend = make_backend(config, 'POST_CACHE')
+
+    @staticmethod
+    def variant(request):
+        return f'{request.get_host()}?{request.GET.urlencode()}'
+
+    def detail_variant(self, request):
+        """Хэш host и нормализованных detail_params или None, если в запросе есть другие параметры."""
+        if set(request.GET) - set(self.detail_params):
+            return None
+        parts = [request.get_host()]
+        for name in self.detail_params:
+            value = request.GET.get(name)
+            if value is not None:
+                if name != 'format':
+                    # ?fields=title,id и ?fields=id,title - один ответ
+                    value = ','.join(sorted({item.strip() for item in value.split(',') if item.strip()}))
+                parts.append(f'{name}={value}')
+        return hashlib.md5('&'.join(parts).encode()).hexdigest()
+
+    def post_key(self, pk, suffix):
+        # версия в ключе: изменение поста делает недоступными все его варианты разом
+        return f'post:{pk}:{self.post_versions([pk], create=True)[0]}:{suffix}'
+
+    def get_post(self, pk, request, build):
+        """Сериализованный пост из кэша или build() с сохранением в кэш."""
+        variant = self.detail_variant(request) if self.enabled and str(pk).isdigit() else None
+        if variant is None:
+            return build(), False
+        key = self.post_key(int(pk), variant)
+        data = self.backend.get(key, _MISSING)
+        if data is not _MISSING:
+            self.responses.incr('hits')
+            return data, True
+        self.responses.incr('misses')
+        with read_from_primary():
+            data = build()
+        self.backend.set(key, data)
+        return data, False
+
+    def get_post_validator(self, pk, build):
+        """Валидатор поста из кэша: под той же версией, что и варианты, и сбрасывается вместе с ними."""
+        if not self.enabled or not str(pk).isdigit():
+            return build()
+        key = self.post_key(int(pk), 'validator')
+        validator = self.backend.get(key, _MISSING)
+        if validator is _MISSING:
+            with read_from_primary():
+                validator = build()
+            self.backend.set(key, validator)
+        return validator
+
+    def list_key(self, request):
+        generation = self.backend.get(self.list_generation_key)
+        if generation is None:
+            generation = self.bump_list_generation()
+        return f'posts:list:{generation}:{self.variant(request)}'
+
+    def get_list_validator(self, request, build):
+        if not self.enabled:
+            return build()
+        key = self.list_key(request) + ':validator'
+        validator = self.backend.get(key, _MISSING)
+        if validator is _MISSING:
+            with read_from_primary():
+                validator = build()
+            self.backend.set(key, validator)
+        return validator
+
+    @staticmethod
+    def post_version_key(pk):
+        return f'post:{pk}:version'
+
+    @staticmethod
+    def new_version():
+        # время - для Last-Modified, uuid - чтобы две версии одной секунды не совпали
+        return f'{time.time():.6f}:{uuid.uuid4().hex}'
+
+    def post_versions(self, pks, create=False):
+        """Версии постов по порядку pks; create - завести недостающие (вытесненные или новые)."""
+        keys = [self.post_version_key(pk) for pk in pks]
+        versions = self.backend.get_many(keys)
+        if create:
+            missing = {key: self.new_version() for key in keys if key not in versions}
+            if missing:
+                self.backend.set_many(missing, None)
+                versions.update(missing)
+        return tuple(versions.get(key) for key in keys)
+
+    @staticmethod
+    def version_time(versions):
+        """Время последнего изменения постов страницы (для Last-Modified) или None."""
+        stamps = [float(version.split(':')[0]) for version in versions if version]
+        return datetime.fromtimestamp(max(stamps), tz=dt_timezone.utc) if stamps else None
+
+    def get_list(self, request, build):
+        """
+        (страница, попадание, версии ее постов). Страница без 'id' в элементах не кэшируется
+        (версии не к чему привязать) - такие запросы сюда не идут (PostViewSet.list_cacheable).
+        """
+        if not self.enabled:
+            return build(), False, ()
+        key = self.list_key(request)
+        entry = self.backend.get(key, _MISSING)
+        if entry is not _MISSING:
+            data, pks, versions = entry
+            # лайк или комментарий на посте страницы сменил его версию - страница устарела
+            if None not in versions and self.post_versions(pks) == versions:
+                self.responses.incr('hits')
+                return data, True, versions
+        self.responses.incr('misses')
+        with read_from_primary():
+            data = build()
+        items = data['results'] if isinstance(data, dict) else data
+        pks = [item['id'] for item in items]
+        versions = self.post_versions(pks, create=True)
+        self.backend.set(key, (data, pks, versions))
+        return data, False, versions
+
+    def bump_list_generation(self):
+        generation = uuid.uuid4().hex
+        # поколение должно жить дольше страниц, которые на него ссылаются
+        self.backend.set(self.list_generation_key, generation, None)
+        return generation
+
+    def invalidate_post(self, pk, lists=False):
+        self.invalidate_posts([pk], lists)
+
+    def invalidate_posts(self, pks, lists=False):
+        """
+        Сбрасывает посты pks: детальные страницы и страницы ленты, где они есть.
+        lists=True - поменялся состав ленты (пост создан, удален, изменен), сбрасываются все страницы.
+        """
+        pks = list(pks)
+        self._invalidate(pks, lists)
+        # еще раз после коммита: параллельный запрос мог успеть закэшировать старые данные
+        transaction.on_commit(lambda: self._invalidate(pks, lists))
+
+    def _invalidate(self, pks, lists):
+        if pks:
+            self.backend.set_many({self.post_version_key(pk): self.new_version() for pk in pks}, None)
+        if lists:
+            self.bump_list_generation()
+
+    def stats(self):
+        """responses - попадания по ответам, backend - по ключам (включая служебные)."""
+        return {
+            'responses': self.responses.as_dict(),
+            'backend': {**self.backend.stats.as_dict(), 'size': len(self.backend)},
+        }
+
+
+post_cache = PostCache(getattr(settings, 'POST_CACHE', None))
@@ -0,0 +1,79 @@
+"""
+Условные GET (ETag / Last-Modified) для PostViewSet.
+
+Post.changed_at сдвигается при любом изменении того, что видно в ответах о посте:
+сам пост (auto_now), счетчики лайков/комментариев/избранного (тем же UPDATE в
+main/counters.py и main/reactions.py), правка комментария, картинки,
+переименование категории или автора (main/signals.py). Поэтому валидатор - это
+timestamp, который читается без сериализаторов:
+
+    /posts/<id>/           changed_at поста и лайкнул ли юзер - один запрос
+    /posts/<id>/comments/  changed_at поста, который грузится и так
+    /posts/                COUNT и MAX(changed_at) отфильтрованных постов - один запрос,
+                           COUNT уходит в пагинацию вместо ее COUNT(*)
+
+Валидаторы анонимов и ленты лежат в кэше постов (main/cache.py) рядом с ответами.
+
+ETag зависит еще от юзера и query string: у разных юзеров и страниц ответы разные.
+"""
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Exists, Max, OuterRef
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils import timezone
+from django.utils.http import http_date
+
+from .models import Comment, Like, Post
+
+
+def make_etag(*parts):
+    return 'W/"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def variant(request):
+    return request.user.pk, request.GET.urlencode()
+
+
+def post_validator(pk, user):
+    """(changed_at, is_liked) поста или None, если его нет."""
+    if not str(pk).isdigit():
+        return None
+    queryset = Post.objects.filter(pk=pk)
+    if not user.is_authenticated:
+        row = queryset.values_list('changed_at').first()
+        return row and (row[0], False)
+    liked = Like.objects.filter(post=OuterRef('pk'), owner=user)
+    return queryset.annotate(is_liked=Exists(liked)).values_list('changed_at', 'is_liked').first()
+
+
+def list_validator(queryset):
+    """(число постов, последнее изменение) - ловит и изменения, и удаления."""
+    row = queryset.order_by().aggregate(count=Count('pk'), changed_at=Max('changed_at'))
+    return row['count'], row['changed_at']
+
+
+def not_modified(request, etag, last_modified):
+    """304 (или 412 для If-Match), если у клиента актуальная версия, иначе None."""
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    return response and set_validators(response, etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+    # ответ зависит от юзера (is_liked), общие кэши не должны отдавать его другим
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def touch(queryset):
+    """Сдвигает changed_at постов queryset - для изменений мимо счетчиков."""
+    # время приложения, как у auto_now: CURRENT_TIMESTAMP в SQLite - с точностью до секунды
+    return queryset.update(changed_at=timezone.now())
+
+
+def touch_commented_by(user):
+    return touch(Post.objects.filter(pk__in=Comment.objects.filter(owner=user).values('post_id')))
@@ -0,0 +1,44 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Comment, Favorites, Like, Post
+
+
+# модель-реакция -> денормализованный счетчик в Post
+COUNTER_FIELDS = {
+    Like: 'likes_count',
+    Comment: 'comments_count',
+    Favorites: 'favorites_count',
+}
+
+
+def change_counter(model, post_id, delta):
+    """Атомарно сдвигает счетчик поста одним UPDATE ... SET x = x + delta."""
+    return change_counters(model, [post_id], delta)
+
+
+def change_counters(model, post_ids, delta):
+    field = COUNTER_FIELDS[model]
+    # changed_at - для ETag (main/conditional.py), тем же UPDATE
+    return Post.objects.filter(pk__in=post_ids).update(
+        changed_at=timezone.now(), **{field: Greatest(F(field) + delta, 0)},
+    )
+
+
+def _count_subquery(model):
+    counted = (model.objects.filter(post=OuterRef('pk'))
+               .order_by().values('post').annotate(c=Count('pk')).values('c'))
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def rebuild_counters(queryset=None):
+    """
+    Пересчитывает счетчики по реальным строкам в main_like/main_comment/main_favorites.
+    Возвращает количество обновленных постов.
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+    return queryset.order_by().update(changed_at=timezone.now(), **{
+        field: _count_subquery(model) for model, field in COUNTER_FIELDS.items()
+    })
@@ -0,0 +1,120 @@
+"""
+Потоковая выгрузка постов (и комментариев) в NDJSON или CSV.
+
+Строки читаются через values_list().iterator(chunk_size) - на Postgres это
+серверный курсор, в памяти одновременно только одна пачка, сколько бы ни было постов.
+Счетчики лайков/комментариев/избранного берутся из денормализованных полей Post.
+
+Инкрементальная выгрузка: since - посты с changed_at >= since (его сдвигают и правки,
+и счетчики - main/counters.py, main/reactions.py) и комментарии с updated_at >= since
+(новые и отредактированные). Следующий since - время начала текущей выгрузки
+(exported_at); изменения во время выгрузки попадут и в следующую. Удаления
+инкрементальная выгрузка не видит - их покажет только полная.
+
+Под ASGI Django 4.1 перебирает StreamingHttpResponse в event loop, где ORM запрещен, -
+эндпоинт рассчитан на WSGI, под ASGI пользуйтесь командой export_posts.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Comment, Post
+
+FORMATS = ('ndjson', 'csv')
+
+POST_FIELDS = (
+    ('id', 'id'),
+    ('title', 'title'),
+    ('body', 'body'),
+    ('owner', 'owner__username'),
+    ('category', 'category_id'),
+    ('preview', 'preview'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+    ('changed_at', 'changed_at'),
+    ('likes_count', 'likes_count'),
+    ('comments_count', 'comments_count'),
+    ('favorites_count', 'favorites_count'),
+)
+COMMENT_FIELDS = (
+    ('id', 'id'),
+    ('post', 'post_id'),
+    ('owner', 'owner__username'),
+    ('body', 'body'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+)
+# CSV - одна таблица на оба типа строк, лишние колонки пустые
+CSV_COLUMNS = ('type', 'id', 'post', 'title', 'body', 'owner', 'category', 'preview',
+               'created_at', 'updated_at', 'changed_at', 'likes_count', 'comments_count', 'favorites_count')
+
+
+def parse_since(value):
+    """ISO 8601 -> aware datetime (без зоны - в TIME_ZONE), None если не разобрать."""
+    try:
+        since = parse_datetime(value)
+    except ValueError:
+        return None
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def _rows(queryset, fields, chunk_size):
+    names = [name for name, _ in fields]
+    for values in queryset.values_list(*(lookup for _, lookup in fields)).iterator(chunk_size=chunk_size):
+        yield dict(zip(names, values))
+
+
+def export_rows(since=None, comments=False, chunk_size=2000):
+    """(тип, dict) по всем постам, затем по комментариям. Порядок по id - стабильный."""
+    posts = Post.objects.order_by('pk')
+    if since is not None:
+        posts = posts.filter(changed_at__gte=since)
+    for row in _rows(posts, POST_FIELDS, chunk_size):
+        yield 'post', row
+    if comments:
+        queryset = Comment.objects.order_by('pk')
+        if since is not None:
+            queryset = queryset.filter(updated_at__gte=since)
+        for row in _rows(queryset, COMMENT_FIELDS, chunk_size):
+            yield 'comment', row
+
+
+def ndjson_lines(rows):
+    for row_type, row in rows:
+        yield json.dumps({'type': row_type, **row}, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class _Line:
+    """Файл для csv.writer, который просто возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(_Line(), CSV_COLUMNS)
+    yield writer.writeheader()
+    for row_type, row in rows:
+        yield writer.writerow({'type': row_type, **row})
+
+
+def render(rows, output_format):
+    return (ndjson_lines if output_format == 'ndjson' else csv_lines)(rows)
+
+
+def buffered(lines, size=64 * 1024):
+    """Склеивает строки в куски по ~size символов: меньше мелких записей в сокет."""
+    chunk, length = [], 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield ''.join(chunk)
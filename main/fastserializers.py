@@ -0,0 +1,138 @@
+"""
+Быстрая сериализация списков: строки QuerySet.values() вместо моделей и ModelSerializer.
+
+FastSerializer(serializer_class, context) один раз на запрос разбирает поля обычного
+сериализатора (с учетом ?fields=, main/fieldsets.py) в список (имя, ключ values(), конвертер).
+Дальше на строку - один проход по этому списку: ни экземпляров модели, ни обхода source,
+ни OrderedDict. Конвертеры - to_representation тех же полей DRF (для файлов - по имени файла),
+поэтому ответ совпадает с serializer_class(..., many=True).data байт в байт.
+
+Поддерживаются поля модели, source через FK ('owner.username'), PrimaryKeyRelatedField,
+файлы, ImageVariantsField и аннотации queryset. SerializerMethodField - если в
+Meta.fast_sources указано, какое значение строки нужно методу.
+Замеры - команда benchmark_serializers.
+"""
+from types import SimpleNamespace
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.relations import ManyRelatedField, PKOnlyObject, RelatedField
+from rest_framework.response import Response
+
+from .images import ready_variants, remember
+from .serializers import ImageVariantsField
+
+_SKIP = object()
+
+
+class FastSerializer:
+
+    def __init__(self, serializer_class, context=None):
+        serializer = serializer_class(context=context or {})
+        self.model = serializer_class.Meta.model
+        self.sources = getattr(serializer_class.Meta, 'fast_sources', {})
+        # (имя, ключ values(), конвертер или None, None отдавать без конвертера,
+        #  nullable FK на пути source, что отдать при NULL в них - см. guards)
+        self.fields = []
+        self.image_lookups = []  # ImageVariantsField: готовые варианты читаются одним запросом на страницу
+        for name, field in serializer.fields.items():
+            if not field.write_only:
+                self.fields.append((name, *self.compile(serializer, name, field), *self.guards(field)))
+        self.lookups = list(dict.fromkeys(
+            lookup for _, lookup, _, _, guards, _ in self.fields for lookup in (lookup, *guards)
+        ))
+
+    def compile(self, serializer, name, field):
+        if isinstance(field, serializers.SerializerMethodField):
+            if name not in self.sources:
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.Meta.fast_sources has no {name!r}')
+            lookup, method = self.sources[name], getattr(serializer, field.method_name)
+            # метод получает объект с единственным атрибутом - тем, что он читает
+            return lookup, lambda value: method(SimpleNamespace(**{lookup: value})), False
+        if field.source == '*' or isinstance(field, (ManyRelatedField, serializers.BaseSerializer)):
+            raise ImproperlyConfigured(f'{type(serializer).__name__}.{name} is not supported by FastSerializer')
+        lookup = field.source.replace('.', '__')
+        if isinstance(field, ImageVariantsField):
+            # в values() только имя файла - хранилище берем у поля модели
+            field.storage = field.storage or self.model._meta.get_field(field.source).storage
+            self.image_lookups.append((lookup, field.ready_source))
+            return lookup, field.to_representation, True
+        if isinstance(field, serializers.FileField):
+            model_field = self.model._meta.get_field(field.source)
+            # FieldFile без экземпляра модели: url берется из storage по имени
+            return lookup, lambda value: field.to_representation(model_field.attr_class(None, model_field, value)), True
+        if isinstance(field, RelatedField):
+            # values() отдает pk связанного объекта
+            return lookup, lambda value: field.to_representation(PKOnlyObject(pk=value)), True
+        if type(field) is serializers.ReadOnlyField:
+            return lookup, None, True
+        return lookup, field.to_representation, True
+
+    def guards(self, field):
+        """
+        source вида 'category.name' при category = NULL: DRF отдает default, None (allow_null)
+        или пропускает поле - для этого в строке нужны сами FK.
+        """
+        parts = field.source.split('.')
+        if len(parts) < 2 or isinstance(field, serializers.SerializerMethodField):
+            return (), _SKIP
+        guards, opts = [], self.model._meta
+        for i, part in enumerate(parts[:-1]):
+            model_field = opts.get_field(part)
+            if model_field.null:
+                guards.append('__'.join(parts[:i + 1]))
+            opts = model_field.related_model._meta
+        if field.default is not empty:
+            missing = field.get_default()
+        elif field.allow_null:
+            missing = None
+        else:
+            missing = _SKIP
+        return tuple(guards), missing
+
+    def values(self, queryset, extra=()):
+        """queryset -> строки values(); extra - еще нужные ключи (например, для курсора)."""
+        # готовые варианты картинок - если queryset их аннотировал (Post.objects.feed)
+        ready = [ready for _, ready in self.image_lookups if ready in queryset.query.annotations]
+        return queryset.values(*dict.fromkeys([*self.lookups, *ready, *extra]))
+
+    def serialize(self, rows):
+        if self.image_lookups:
+            rows = list(rows)
+            for row in rows:
+                for lookup, ready in self.image_lookups:
+                    if row[lookup] and ready in row:
+                        remember(row[lookup], set(row[ready] or ()))
+            ready_variants([row[lookup] for row in rows for lookup, ready in self.image_lookups if ready not in row])
+        data = []
+        for row in rows:
+            item = {}
+            for name, lookup, convert, skip_none, guards, missing in self.fields:
+                if guards and any(row[guard] is None for guard in guards):
+                    if missing is not _SKIP:
+                        item[name] = missing
+                    continue
+                value = row[lookup]
+                if convert is None or (value is None and skip_none):
+                    item[name] = value
+                else:
+                    item[name] = convert(value)
+            data.append(item)
+        return data
+
+
+class FastListMixin:
+    """list() для GenericAPIView через FastSerializer по get_serializer_class()."""
+
+    def fast_list(self, queryset):
+        fast = FastSerializer(self.get_serializer_class(), self.get_serializer_context())
+        cursor_fields = getattr(self.paginator, 'cursor_fields', lambda request: ())(self.request)
+        rows = fast.values(queryset, cursor_fields)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(fast.serialize(page))
+        return Response(fast.serialize(rows))
+
+    def list(self, request, *args, **kwargs):
+        return self.fast_list(self.filter_queryset(self.get_queryset()))
@@ -0,0 +1,86 @@
+"""
+Sparse fieldsets: ?fields=id,title и ?expand=comments.
+
+?fields= оставляет в ответе только перечисленные поля. Тяжелые поля
+(Meta.expandable: вложенные списки, отдельные запросы) при ?fields= попадают в ответ,
+только если перечислены в ?fields= или ?expand=. Без ?fields= ответ прежний.
+
+Те же поля сужают SQL (narrow): колонки модели - в .only(), FK - в select_related
+только если из них что-то нужно, обратные связи и M2M - в prefetch_related только
+по запрошенным полям. ?fields=id,title не читает ни body, ни картинки, ни комментарии.
+"""
+from django.core.exceptions import FieldDoesNotExist
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def _names(request, param):
+    value = getattr(request, 'query_params', {}).get(param)
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def requested_fields(request, expandable=()):
+    """Имена полей из ?fields= (плюс разрешенные ?expand=) или None - отдавать все."""
+    if request is None:
+        return None
+    fields = _names(request, FIELDS_PARAM)
+    if fields is None:
+        return None
+    return fields | ((_names(request, EXPAND_PARAM) or set()) & set(expandable))
+
+
+class SparseFieldsMixin:
+    """Для ModelSerializer: поля по ?fields= / ?expand= из context['request']."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sparse_fields = requested_fields(self.context.get('request'), getattr(self.Meta, 'expandable', ()))
+        if self.sparse_fields is not None:
+            for name in set(self.fields) - self.sparse_fields:
+                self.fields.pop(name)
+
+    def wants(self, name):
+        """Нужно ли поле, которого нет в self.fields (добавляется в to_representation)."""
+        return self.sparse_fields is None or name in self.sparse_fields
+
+    @classmethod
+    def narrow(cls, queryset, request):
+        """queryset, из которого читается только то, что попадет в ответ."""
+        serializer = cls(context={'request': request})
+        if serializer.sparse_fields is None:
+            return queryset
+        opts = queryset.model._meta
+        columns, relations, prefetch = {opts.pk.name}, set(), set()
+        sources = getattr(cls.Meta, 'sparse_sources', {})
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            # SerializerMethodField и прочие source='*' читают то, что указано в Meta.sparse_sources
+            paths = sources.get(name, ()) if field.source == '*' else (field.source,)
+            for path in paths:
+                parts = path.split('.')
+                try:
+                    model_field = opts.get_field(parts[0])
+                except FieldDoesNotExist:
+                    continue  # аннотация или свойство
+                if model_field.many_to_many or model_field.one_to_many:
+                    prefetch.add(parts[0])
+                elif model_field.is_relation and len(parts) > 1:
+                    relations.add(parts[0])
+                    columns.add('__'.join(parts[:2]))
+                else:
+                    columns.add(parts[0])
+        # по ключам сортировки keyset-пагинация строит курсоры - без них был бы запрос на объект
+        for name in queryset.query.order_by or opts.ordering:
+            name = name.lstrip('-') if isinstance(name, str) else ''
+            if name and '__' not in name and name != '?':
+                columns.add(name)
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset.only(*columns)
@@ -0,0 +1,33 @@
+import django_filters
+from django.db.models import Subquery
+from rest_framework.filters import SearchFilter
+
+from .models import Category, Post
+from .search import get_search_backend
+
+
+class PostFilter(django_filters.FilterSet):
+    # посты категории и всех ее потомков; путь корня берется подзапросом, поэтому запрос один
+    category_tree = django_filters.NumberFilter(method='filter_category_tree')
+
+    class Meta:
+        model = Post
+        fields = ('category', 'owner')
+
+    def filter_category_tree(self, queryset, name, value):
+        path = Subquery(Category.objects.filter(pk=value).values('path')[:1])
+        subtree = Category.objects.subtree(path).values('pk')
+        return queryset.filter(category__in=subtree)
+
+
+class PostSearchFilter(SearchFilter):
+    """
+    ?search= ленты через полнотекстовый индекс (main/search.py), а не ILIKE по search_fields.
+    Только отбор: сортировка и keyset-пагинация ленты остаются прежними.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return get_search_backend().filter(queryset, query)
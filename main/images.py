@@ -0,0 +1,175 @@
+"""
+Уменьшенные копии картинок (Post.preview, PostImages.image).
+
+Варианты описаны в settings.IMAGE_VARIANTS и лежат рядом с оригиналом, расширение
+оригинала остается в имени (a.png и a.jpg не делят один вариант):
+    images/Spider_Man.jpeg -> images/variants/Spider_Man.jpeg_thumbnail.jpg, ..._webp.webp
+Генерация идет в пуле потоков после коммита транзакции, а не в потоке запроса.
+Pillow отпускает GIL на декодировании и ресайзе, поэтому потоков достаточно.
+
+Готовые варианты записываются в ImageBlob.variants - сериализаторы не ходят в хранилище
+за exists(). ready_variants() читает их одним запросом на пачку имен и помнит в процессе:
+полный набор - пока не вытеснят, неполный - READY_TTL секунд (вариант мог дописаться
+в другом воркере). Запрос синхронный: async views (main/async_views.py) загружают
+варианты через sync_to_async до сериализации.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .models import ImageBlob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIANTS = {
+    'thumbnail': {'size': (320, 320), 'format': 'JPEG', 'quality': 80},
+    'medium': {'size': (1024, 1024), 'format': 'JPEG', 'quality': 85},
+    'webp': {'size': (1024, 1024), 'format': 'WEBP', 'quality': 80},
+}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+READY_TTL = 10
+READY_MAX_ENTRIES = 10000
+
+_executor = None
+_executor_lock = threading.Lock()
+_ready = OrderedDict()  # name -> (frozenset вариантов, когда перечитать или None)
+_ready_lock = threading.Lock()
+
+
+def get_variants():
+    return getattr(settings, 'IMAGE_VARIANTS', DEFAULT_VARIANTS)
+
+
+def variant_name(name, variant):
+    options = get_variants()[variant]
+    directory, filename = os.path.split(name)
+    return os.path.join(directory, 'variants', f'{filename}_{variant}.{EXTENSIONS[options["format"]]}')
+
+
+def remember(name, variants):
+    """Запоминает готовые варианты, уже прочитанные из ImageBlob (аннотации Post.objects.feed)."""
+    complete = set(get_variants()) <= variants
+    with _ready_lock:
+        _ready[name] = (frozenset(variants), None if complete else time.monotonic() + READY_TTL)
+        _ready.move_to_end(name)
+        while len(_ready) > READY_MAX_ENTRIES:
+            _ready.popitem(last=False)
+
+
+def ready_variants(names):
+    """{name: frozenset готовых вариантов} по ImageBlob.variants; незнакомые имена - одним запросом."""
+    now, ready, missing = time.monotonic(), {}, []
+    with _ready_lock:
+        for name in dict.fromkeys(filter(None, names)):
+            entry = _ready.get(name)
+            if entry is None or (entry[1] is not None and entry[1] < now):
+                missing.append(name)
+            else:
+                ready[name] = entry[0]
+    if missing:
+        found = dict(ImageBlob.objects.filter(name__in=missing).values_list('name', 'variants'))
+        for name in missing:
+            variants = set(found.get(name) or ())
+            remember(name, variants)
+            ready[name] = frozenset(variants)
+    return ready
+
+
+def set_ready(name, variants):
+    """Записывает готовые варианты файла (в ImageBlob и в память процесса)."""
+    ImageBlob.objects.filter(name=name).update(variants=sorted(variants))
+    remember(name, set(variants))
+
+
+def variant_urls(name, storage):
+    """{variant: url} для уже готовых вариантов; пока вариант не готов, отдаем оригинал."""
+    if not name:
+        return None
+    original = storage.url(name)
+    ready = ready_variants([name])[name]
+    return {variant: storage.url(variant_name(name, variant)) if variant in ready else original
+            for variant in get_variants()}
+
+
+def render_variant(image, options):
+    image = image.copy()
+    image.thumbnail(options['size'], Image.Resampling.LANCZOS)
+    if options['format'] == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, options['format'], quality=options.get('quality', 85), optimize=True)
+    return buffer.getvalue()
+
+
+def generate_variants(name, storage, force=False):
+    """Синхронно создает все варианты. Возвращает список созданных путей."""
+    todo = {variant: variant_name(name, variant) for variant in get_variants()}
+    if not force:
+        todo = {variant: path for variant, path in todo.items() if not storage.exists(path)}
+    if not todo:
+        set_ready(name, get_variants())
+        return []
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    created = []
+    for variant, path in todo.items():
+        content = ContentFile(render_variant(image, get_variants()[variant]))
+        if hasattr(storage, 'save_exact'):
+            # ContentAddressedStorage.save переименовал бы вариант в хэш
+            created.append(storage.save_exact(path, content))
+            continue
+        if storage.exists(path):
+            storage.delete(path)
+        created.append(storage.save(path, content))
+    set_ready(name, get_variants())
+    return created
+
+
+def delete_variants(name, storage):
+    set_ready(name, ())
+    for variant in get_variants():
+        path = variant_name(name, variant)
+        if storage.exists(path):
+            storage.delete(path)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMAGE_WORKERS', 2),
+                                           thread_name_prefix='image-variants')
+        return _executor
+
+
+def _run(func, name, storage):
+    try:
+        func(name, storage)
+    except Exception:
+        logger.exception('Image variants failed for %s', name)
+    finally:
+        # как поток write-behind: соединение возвращается в пул, а не висит за потоком,
+        # и сломанное (рестарт БД) не переживет задачу
+        connections.close_all()
+
+
+def schedule(func, name, storage):
+    if name:
+        transaction.on_commit(lambda: get_executor().submit(_run, func, name, storage))
+
+
+def schedule_variants(field_file):
+    """Поставить генерацию в очередь после коммита."""
+    schedule(generate_variants, field_file.name, field_file.storage)
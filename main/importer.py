@@ -0,0 +1,257 @@
+"""
+Потоковый импорт NDJSON: посты, комментарии, лайки и избранное.
+
+Одна строка - один объект:
+    {"type": "post", "title": "...", "body": "...", "owner": "alice", "category": 3,
+     "preview": "images/a.jpeg", "images": ["images/b.jpeg"]}
+    {"type": "comment", "post": "Заголовок поста или id", "owner": "bob", "body": "..."}
+    {"type": "like", "post": 17, "owner": "bob"}
+    {"type": "favorite", "post": 17, "owner": "bob"}
+owner - username или id (по умолчанию - тот, кто импортирует), category - id или имя.
+id - только число JSON: строка всегда имя или заголовок ("post": "2022" - пост с заголовком 2022).
+Картинки - имена уже лежащих в хранилище файлов, варианты потом делает generate_image_variants.
+
+Строки читаются пачками по batch_size. На пачку - один запрос за юзерами,
+один за категориями, один за занятыми заголовками, один за постами,
+на которые ссылаются комментарии и реакции, и bulk_create по каждой модели.
+Строки с ошибками пропускаются и попадают в отчет, остальные импортируются.
+Пост должен идти раньше своих комментариев и реакций (можно в той же пачке).
+Уже существующие лайки и избранное молча пропускаются и не считаются в created.
+"""
+import itertools
+import json
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from . import trending
+from .blobs import retain
+from .cache import post_cache
+from .counters import rebuild_counters
+from .models import Category, Comment, Favorites, Like, Post, PostImages
+
+REACTION_MODELS = {
+    'like': Like,
+    'favorite': Favorites,
+}
+ROW_TYPES = ('post', 'comment', *REACTION_MODELS)
+
+REQUIRED = 'This field is required.'
+
+
+class ImportReport:
+
+    def __init__(self, max_errors=1000):
+        self.lines = 0
+        self.created = Counter()
+        self.errors = []
+        self.error_count = 0
+        self.max_errors = max_errors
+
+    def error(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'lines': self.lines,
+            'created': {row_type: self.created[row_type] for row_type in ROW_TYPES},
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def _ref(value):
+    """Число JSON -> id, непустая строка - имя или заголовок (даже из одних цифр), остальное -> None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    return value if isinstance(value, str) and value else None
+
+
+def _lookup(queryset, refs, name_field):
+    """{ссылка: pk} одним запросом: ссылки - id или значения name_field."""
+    ids = {ref for ref in refs if isinstance(ref, int)}
+    names = {ref for ref in refs if isinstance(ref, str)}
+    if not ids and not names:
+        return {}
+    found = {}
+    # для неуникальных имен (категории) берется первая по id
+    rows = queryset.filter(Q(pk__in=ids) | Q(**{f'{name_field}__in': names})).order_by('-pk')
+    for pk, name in rows.values_list('pk', name_field):
+        if pk in ids:
+            found[pk] = pk
+        if name in names:
+            found[name] = pk
+    return found
+
+
+class Importer:
+
+    def __init__(self, default_owner=None, batch_size=1000, max_errors=1000, progress=None):
+        self.default_owner = default_owner
+        self.batch_size = batch_size
+        self.report = ImportReport(max_errors)
+        self.progress = progress  # вызывается с отчетом после каждой пачки
+
+    def run(self, lines):
+        """lines - итератор строк (bytes или str), например файл или request.stream."""
+        numbered = enumerate(lines, 1)
+        while True:
+            batch = list(itertools.islice(numbered, self.batch_size))
+            if not batch:
+                return self.report
+            self.import_batch(batch)
+            # ошибки разбора пишутся раньше ошибок записи той же пачки
+            self.report.errors.sort(key=lambda error: error['line'])
+            if self.progress:
+                self.progress(self.report)
+
+    def import_batch(self, batch):
+        rows = []
+        for line, raw in batch:
+            self.report.lines = line
+            row = self.parse(line, raw)
+            if row is not None:
+                rows.append((line, row))
+        if not rows:
+            return
+        created = Counter()
+        try:
+            with transaction.atomic():
+                touched = self.write(rows, created)
+        except IntegrityError as exc:
+            # гонка с параллельной записью (например, тот же заголовок) - откатывается вся пачка
+            self.report.error(rows[0][0], {'batch': [f'Lines {rows[0][0]}-{rows[-1][0]} not imported: {exc}']})
+            return
+        self.report.created.update(created)
+        post_cache.invalidate_posts(touched, lists=True)
+
+    def parse(self, line, raw):
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8', errors='replace')
+        if not raw.strip():
+            return None
+        try:
+            row = json.loads(raw)
+        except ValueError as exc:
+            self.report.error(line, {'non_field_errors': [f'Invalid JSON: {exc}']})
+            return None
+        if not isinstance(row, dict):
+            self.report.error(line, {'non_field_errors': ['Expected a JSON object.']})
+            return None
+        if row.get('type') not in ROW_TYPES:
+            self.report.error(line, {'type': [f'Expected one of: {", ".join(ROW_TYPES)}.']})
+            return None
+        return row
+
+    def write(self, rows, created):
+        owners = _lookup(User.objects.all(), [_ref(row.get('owner')) for _, row in rows], 'username')
+        new_posts = self.create_posts([(line, row) for line, row in rows if row['type'] == 'post'], owners)
+        created['post'] += len(new_posts)
+        # посты из этой же пачки уже вставлены и тоже найдутся
+        others = [(line, row) for line, row in rows if row['type'] != 'post']
+        posts = _lookup(Post.objects.all(), [_ref(row.get('post')) for _, row in others], 'title')
+
+        comments, reactions = [], {row_type: {} for row_type in REACTION_MODELS}
+        for line, row in others:
+            errors = {}
+            owner_id = self.owner_id(row, owners, errors)
+            post_id = posts.get(_ref(row.get('post')))
+            if post_id is None:
+                errors['post'] = [REQUIRED if row.get('post') in (None, '') else 'Post not found.']
+            body = row.get('body')
+            if row['type'] == 'comment' and (not isinstance(body, str) or not body):
+                errors['body'] = [REQUIRED]
+            if errors:
+                self.report.error(line, errors)
+            elif row['type'] == 'comment':
+                comments.append(Comment(post_id=post_id, owner_id=owner_id, body=body))
+            else:
+                reactions[row['type']][post_id, owner_id] = True
+
+        Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+        created['comment'] += len(comments)
+        for row_type, pairs in reactions.items():
+            if not pairs:
+                continue
+            model = REACTION_MODELS[row_type]
+            # ignore_conflicts не говорит, сколько строк вставлено: считаем до и после
+            existing = model.objects.filter(post_id__in={post_id for post_id, _ in pairs})
+            before = existing.count()
+            model.objects.bulk_create(
+                [model(post_id=post_id, owner_id=owner_id) for post_id, owner_id in pairs],
+                batch_size=self.batch_size, ignore_conflicts=True,
+            )
+            created[row_type] += existing.count() - before
+
+        # bulk_create не шлет сигналы: счетчики пересчитываем по затронутым постам
+        touched = set(new_posts)
+        touched.update(comment.post_id for comment in comments)
+        touched.update(post_id for pairs in reactions.values() for post_id, _ in pairs)
+        if touched:
+            rebuild_counters(Post.objects.filter(pk__in=touched))
+            trending.rebuild(touched)
+        return touched
+
+    def owner_id(self, row, owners, errors):
+        if row.get('owner') in (None, ''):
+            if self.default_owner is None:
+                errors['owner'] = [REQUIRED]
+            return self.default_owner and self.default_owner.pk
+        owner_id = owners.get(_ref(row['owner']))
+        if owner_id is None:
+            errors['owner'] = ['User not found.']
+        return owner_id
+
+    def create_posts(self, rows, owners):
+        """Возвращает pk созданных постов."""
+        if not rows:
+            return []
+        categories = _lookup(Category.objects.all(), [_ref(row.get('category')) for _, row in rows], 'name')
+        titles = [row.get('title') for _, row in rows if isinstance(row.get('title'), str)]
+        taken = set(Post.objects.filter(title__in=titles).values_list('title', flat=True))
+        max_length = Post._meta.get_field('title').max_length
+
+        posts, images = [], []
+        for line, row in rows:
+            errors = {}
+            title, body = row.get('title'), row.get('body', '')
+            if not isinstance(title, str) or not title.strip():
+                errors['title'] = [REQUIRED]
+            elif len(title) > max_length:
+                errors['title'] = [f'Ensure this field has no more than {max_length} characters.']
+            elif title in taken:
+                errors['title'] = ['Post with this title already exists.']
+            if not isinstance(body, str):
+                errors['body'] = ['Not a valid string.']
+            owner_id = self.owner_id(row, owners, errors)
+            category_id = None
+            if row.get('category') not in (None, ''):
+                category_id = categories.get(_ref(row['category']))
+                if category_id is None:
+                    errors['category'] = ['Category not found.']
+            preview, names = row.get('preview') or None, row.get('images') or []
+            if preview is not None and not isinstance(preview, str):
+                errors['preview'] = ['Not a valid string.']
+            if not isinstance(names, list) or not all(isinstance(name, str) and name for name in names):
+                errors['images'] = ['Expected a list of file names.']
+            if errors:
+                self.report.error(line, errors)
+                continue
+            taken.add(title)
+            posts.append(Post(title=title, body=body, owner_id=owner_id, category_id=category_id, preview=preview))
+            images.append(names)
+
+        Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        post_images = [
+            PostImages(post=post, image=name, title=PostImages.generate_name())
+            for post, names in zip(posts, images) for name in names
+        ]
+        PostImages.objects.bulk_create(post_images, batch_size=self.batch_size)
+        retain([post.preview.name for post in posts if post.preview] + [image.image.name for image in post_images])
+        return [post.pk for post in posts]
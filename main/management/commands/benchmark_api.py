@@ -0,0 +1,46 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Латентность и число SQL запросов для всех эндпоинтов (все изменения откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--baseline', help='JSON с прошлыми результатами для сравнения')
+        parser.add_argument('--save-baseline', action='store_true', help='записать результаты в --baseline')
+        parser.add_argument('--tolerance', type=float, default=1.5, help='допустимый рост p95 (во сколько раз)')
+        parser.add_argument('--with-cache', action='store_true', help='не отключать кэш постов')
+        parser.add_argument('--only', action='append', help='имя эндпоинта (можно несколько раз)')
+
+    def handle(self, *args, **options):
+        endpoints = benchmarks.ENDPOINTS
+        if options['only']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in options['only']]
+        results = benchmarks.run(options['iterations'], endpoints, use_cache=options['with_cache'])
+
+        self.stdout.write(f'{"endpoint":24} {"queries":>8} {"budget":>7} {"p50":>9} {"p95":>9} {"p99":>9}  status')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:24} {result["queries"]:8} {result["budget"]:7} {result["p50_ms"]:7.2f}ms '
+                f'{result["p95_ms"]:7.2f}ms {result["p99_ms"]:7.2f}ms  {result["statuses"]}'
+            )
+
+        path = options['baseline']
+        if options['save_baseline']:
+            if not path:
+                raise CommandError('--save-baseline requires --baseline')
+            benchmarks.save_baseline(path, results)
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {path}'))
+            return
+
+        baseline = benchmarks.load_baseline(path) if path and os.path.exists(path) else None
+        problems = benchmarks.check(results, baseline, options['tolerance'])
+        if not options['only']:
+            problems += [f'{route}: no query budget' for route in benchmarks.missing_budgets()]
+        if problems:
+            raise CommandError('\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('All endpoints within budget'))
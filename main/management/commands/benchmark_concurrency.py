@@ -0,0 +1,139 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.asgi import get_asgi_application
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from main.benchmarks import percentile
+from main.cache import post_cache
+from main.models import Post
+
+# синхронный эндпоинт -> его async версия (main/async_views.py)
+PAIRS = (
+    ('/api/v1/posts/?pagination=cursor&count=false', '/api/v1/async/posts/?count=false'),
+    ('/api/v1/posts/{post}/', '/api/v1/async/posts/{post}/'),
+    ('/api/v1/posts/{post}/comments/', '/api/v1/async/posts/{post}/comments/'),
+    ('/api/v1/categories/', '/api/v1/async/categories/'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Пропускная способность и латентность синхронных (WSGI, пул потоков) и async (ASGI) '
+            'эндпоинтов при N одновременных клиентах')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, action='append',
+                            help='одновременных клиентов (можно несколько раз), по умолчанию 1, 10, 50')
+        parser.add_argument('--requests', type=int, default=200, help='запросов на замер')
+        parser.add_argument('--threads', type=int, default=8, help='потоков WSGI воркера')
+        parser.add_argument('--db-latency', type=float, default=5.0,
+                            help='искусственная задержка на каждый SQL запрос, мс (сеть до БД)')
+        parser.add_argument('--token', help='ключ токена для Authorization (по умолчанию аноним)')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='не отключать кэш постов (у async версий его нет)')
+
+    def handle(self, *args, **options):
+        post = Post.objects.order_by('-comments_count').first()
+        if post is None:
+            self.stderr.write('Нет постов, сначала запустите seed_data')
+            return
+        self.headers = [(b'authorization', f'Token {options["token"]}'.encode())] if options['token'] else []
+        self.install_latency(options['db_latency'] / 1000)
+        post_cache.enabled = post_cache.enabled and options['with_cache']
+        wsgi, asgi = WSGIHandler(), get_asgi_application()
+
+        self.stdout.write(f'{"endpoint":48} {"clients":>7} {"mode":>5} {"rps":>8} {"p50":>9} {"p95":>9}  status')
+        for sync_path, async_path in PAIRS:
+            sync_path, async_path = sync_path.format(post=post.pk), async_path.format(post=post.pk)
+            for clients in options['concurrency'] or [1, 10, 50]:
+                for mode, path, runner in (('wsgi', sync_path, self.run_wsgi), ('asgi', async_path, self.run_asgi)):
+                    app = wsgi if mode == 'wsgi' else asgi
+                    started = time.perf_counter()
+                    timings, statuses = runner(app, path, clients, options['requests'], options['threads'])
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'{path:48} {clients:7} {mode:>5} {len(timings) / elapsed:8.1f} '
+                        f'{statistics.median(timings):7.1f}ms {percentile(timings, 95):7.1f}ms  {sorted(statuses)}'
+                    )
+
+    @staticmethod
+    def install_latency(delay):
+        if not delay:
+            return
+
+        def sleep(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        # каждый поток открывает свое соединение, обертку вешаем на все новые
+        def add_wrapper(sender, connection, **kwargs):
+            connection.execute_wrappers.append(sleep)
+
+        connection_created.connect(add_wrapper, weak=False)
+        for connection in connections.all():
+            connection.close()
+
+    def environ(self, path):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+            'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http', 'wsgi.errors': BytesIO(),
+        }
+        for name, value in self.headers:
+            environ['HTTP_' + name.decode().upper()] = value.decode()
+        return environ
+
+    def run_wsgi(self, app, path, clients, total, threads):
+        """clients клиентов, но обслуживают их только threads потоков, как gunicorn --threads."""
+        statuses = set()
+        workers = threading.BoundedSemaphore(threads)
+
+        def call(_):
+            started = time.perf_counter()
+            with workers:  # ожидание свободного потока входит в латентность клиента
+                response = app(self.environ(path), lambda status, headers: statuses.add(int(status[:3])))
+                b''.join(response)
+                response.close()
+            return (time.perf_counter() - started) * 1000
+
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            timings = list(pool.map(call, range(total)))
+        return timings, statuses
+
+    def run_asgi(self, app, path, clients, total, threads):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'headers': [(b'host', b'localhost'), *self.headers],
+            'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        }
+        statuses = set()
+
+        async def call(semaphore):
+            async with semaphore:
+                started = time.perf_counter()
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        statuses.add(message['status'])
+
+                await app(dict(scope), receive, send)
+                return (time.perf_counter() - started) * 1000
+
+        async def main():
+            semaphore = asyncio.Semaphore(clients)
+            return await asyncio.gather(*(call(semaphore) for _ in range(total)))
+
+        return asyncio.run(main()), statuses
@@ -0,0 +1,102 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from main.models import Post
+from main.search import LikePostSearch, get_search_backend
+
+WORDS = (
+    'spider man web city hero villain python django api blog post image comment like '
+    'favorite category search index query vector rank snippet cache token user news '
+    'sport music movie travel food science history game code review release bug fix'
+).split()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает ?search= ленты через полнотекстовый индекс со старым ILIKE SearchFilter '
+            'и ранжированный /posts/search/ на сгенерированном корпусе. '
+            'Корпус создается в транзакции и откатывается, --keep - оставить его для следующих запусков')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000, help='размер корпуса')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--query', action='append', dest='queries',
+                            help='поисковая строка (можно несколько раз)')
+        parser.add_argument('--keep', action='store_true',
+                            help='не откатывать корпус (следующий запуск досеет только недостающее)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options)
+            # по умолчанию база остается как была: корпус в миллион постов - не для живой БД
+            transaction.set_rollback(not options['keep'])
+        if not options['keep']:
+            self.stdout.write('corpus rolled back')
+
+    def run(self, options):
+        owner, _ = User.objects.get_or_create(username='search-benchmark')
+        self.seed(owner, options['posts'], options['batch_size'])
+
+        queries = options['queries'] or ['spider', 'django api', 'cach', 'release bug fix']
+        backend = get_search_backend()
+        # те же запросы, что строит API: ?search= ленты (до индекса - DRF SearchFilter) и /posts/search/
+        variants = (
+            ('list ilike', lambda queryset, query: self.feed(LikePostSearch().filter(queryset, query))),
+            (f'list {connection.vendor}', lambda queryset, query: self.feed(backend.filter(queryset, query))),
+            (f'search {connection.vendor}', backend.search),
+        )
+        for query in queries:
+            for name, build in variants:
+                timings = self.measure(build, query, options['repeat'])
+                self.stdout.write(
+                    f'{query!r:20} {name:18} median={statistics.median(timings):8.1f}ms '
+                    f'max={max(timings):8.1f}ms'
+                )
+
+    @staticmethod
+    def feed(queryset):
+        # порядок keyset-пагинации ленты (PostPagination)
+        return queryset.order_by('created_at', 'id')
+
+    @staticmethod
+    def vocabulary(rnd, size=50_000):
+        # частоты слов по Ципфу, как в живом тексте: редкие слова встречаются редко
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        words = list(WORDS) + [''.join(rnd.choices(letters, k=rnd.randint(4, 10))) for _ in range(size)]
+        weights = [1 / (rank + 1) for rank in range(len(words))]
+        rnd.shuffle(words)
+        return words, weights
+
+    def seed(self, owner, total, batch_size):
+        existing = Post.objects.filter(owner=owner).count()
+        rnd = random.Random(42)
+        words, weights = self.vocabulary(rnd)
+        for start in range(existing, total, batch_size):
+            stop = min(start + batch_size, total)
+            Post.objects.bulk_create([
+                Post(
+                    owner=owner,
+                    title=f'{" ".join(rnd.choices(words, weights, k=4))} #{i}',
+                    body=' '.join(rnd.choices(words, weights, k=60)),
+                )
+                for i in range(start, stop)
+            ])
+            self.stdout.write(f'seeded {stop}/{total}', ending='\r')
+        self.stdout.write(f'corpus: {total} posts')
+
+    @staticmethod
+    def measure(build, query, repeat):
+        # то же, что делает API: COUNT(*) + первая страница
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset = build(Post.objects.all(), query)
+            queryset.count()
+            list(queryset[:5])
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
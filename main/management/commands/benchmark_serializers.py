@@ -0,0 +1,85 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from main import serializers
+from main.fastserializers import FastSerializer
+from main.models import Category, Post
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает сериализацию списков через ModelSerializer и FastSerializer (строк в секунду)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='строк в одном списке')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--cleanup', action='store_true', help='удалить сгенерированные данные после замеров')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        owner, _ = User.objects.get_or_create(username='serializer-benchmark')
+        self.seed(owner, rows)
+
+        request = Request(RequestFactory(SERVER_NAME='localhost').get('/api/v1/posts/'))
+        request.user = owner
+        context = {'request': request}
+        cases = (
+            ('posts-feed', serializers.PostFeedSerializer, Post.objects.feed(owner)),
+            ('posts', serializers.PostListSerializer, Post.objects.all()),
+            ('users', serializers.UserListSerializer, User.objects.all()),
+            ('categories', serializers.CategorySerializer, Category.objects.all()),
+        )
+        self.stdout.write(f'{"list":12} {"rows":>6} {"drf rows/s":>12} {"fast rows/s":>12} {"speedup":>8}  output')
+        for name, serializer_class, queryset in cases:
+            queryset = queryset.order_by('pk')[:rows]
+
+            def drf():
+                return serializer_class(list(queryset), many=True, context=context).data
+
+            def fast():
+                serializer = FastSerializer(serializer_class, context)
+                return serializer.serialize(list(serializer.values(queryset)))
+
+            renderer = JSONRenderer()
+            identical = renderer.render(drf()) == renderer.render(fast())
+            count = len(fast())
+            drf_rate, fast_rate = (self.rate(func, count, options['repeat']) for func in (drf, fast))
+            self.stdout.write(
+                f'{name:12} {count:6} {drf_rate:12.0f} {fast_rate:12.0f} {fast_rate / drf_rate:7.1f}x  '
+                f'{"identical" if identical else "DIFFERENT"}'
+            )
+
+        if options['cleanup']:
+            Category.objects.filter(name__startswith='serializer-benchmark').delete()
+            User.objects.filter(username__startswith='serializer-benchmark').delete()
+
+    def seed(self, owner, total):
+        # посты, юзеры и категории, пока каждого не станет хотя бы total
+        categories = list(Category.objects.filter(name__startswith='serializer-benchmark')[:1])
+        for i in range(Category.objects.count(), total):
+            parent = categories[-1] if categories and i % 3 else None
+            categories.append(Category.objects.create(name=f'serializer-benchmark {i}', parent=parent))
+        User.objects.bulk_create([
+            User(username=f'serializer-benchmark-{i}') for i in range(User.objects.count(), total)
+        ])
+        start = Post.objects.count()
+        Post.objects.bulk_create([
+            Post(owner=owner, title=f'serializer-benchmark #{i}', body='text ' * 50,
+                 category=categories[i % len(categories)] if categories else None)
+            for i in range(start, total)
+        ], batch_size=2000)
+        self.stdout.write(f'data: {total} posts, users and categories')
+
+    @staticmethod
+    def rate(func, count, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return count / statistics.median(timings)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from main import blobs
+
+
+class Command(BaseCommand):
+    help = 'Удаляет файлы картинок, на которые не ссылается ни один пост (и их варианты)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=3600,
+                            help='не трогать файлы, менявшиеся за последние N секунд')
+        parser.add_argument('--dry-run', action='store_true', help='только показать, что будет удалено')
+        parser.add_argument('--rebuild', action='store_true', help='сначала пересчитать refcount')
+        parser.add_argument('--readdress', action='store_true',
+                            help='перенести старые файлы в имена по sha256 (схлопывает копии)')
+
+    def handle(self, *args, **options):
+        if options['readdress'] and not options['dry_run']:
+            moved = blobs.readdress()
+            self.stdout.write(f'Перенесено файлов: {len(moved)}')
+        if options['rebuild']:
+            self.stdout.write(f'Пересчитано блобов: {blobs.rebuild_refcounts()}')
+        deleted, freed = blobs.collect(grace=options['grace'], dry_run=options['dry_run'])
+        for name in deleted:
+            self.stdout.write(name)
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(f'{verb} файлов: {len(deleted)}, {freed / 1024 / 1024:.1f} MB'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.writebehind import reaction_buffer
+
+
+class Command(BaseCommand):
+    help = 'Сбрасывает буфер write-behind лайков и избранного (main/writebehind.py) в базу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='сбрасывать постоянно, раз в FLUSH_INTERVAL')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            flushed = reaction_buffer.flush()
+            self.stdout.write(self.style.SUCCESS(f'Сброшено реакций: {flushed}'))
+            return
+        interval = reaction_buffer.config['FLUSH_INTERVAL'] or 1.0
+        while True:
+            flushed = reaction_buffer.flush()
+            if flushed:
+                self.stdout.write(f'Сброшено реакций: {flushed}, {reaction_buffer.stats()}')
+            connections.close_all()
+            time.sleep(interval)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from main.images import generate_variants
+from main.models import Post, PostImages
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии для уже загруженных картинок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='пересоздать существующие варианты')
+
+    def handle(self, *args, **options):
+        storage = PostImages._meta.get_field('image').storage
+        names = set(PostImages.objects.values_list('image', flat=True))
+        names |= set(Post.objects.exclude(preview='').exclude(preview=None).values_list('preview', flat=True))
+        created = 0
+        for name in sorted(names):
+            try:
+                created += len(generate_variants(name, storage, force=options['force']))
+            except (FileNotFoundError, OSError) as e:
+                self.stderr.write(f'{name}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Картинок: {len(names)}, создано вариантов: {created}'))
@@ -0,0 +1,38 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importer import Importer
+
+
+class Command(BaseCommand):
+    help = 'Импорт постов, комментариев, лайков и избранного из NDJSON (формат - в main/importer.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="файл NDJSON или '-' для stdin")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--owner', help='username автора для строк без owner')
+        parser.add_argument('--max-errors', type=int, default=100, help='сколько ошибок вывести')
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['owner']:
+            owner = User.objects.filter(username=options['owner']).first()
+            if owner is None:
+                raise CommandError(f'User {options["owner"]!r} not found')
+        progress = self.progress if options['verbosity'] > 1 else None
+        importer = Importer(owner, options['batch_size'], options['max_errors'], progress)
+        if options['path'] == '-':
+            report = importer.run(sys.stdin)
+        else:
+            with open(options['path'], 'rb') as f:
+                report = importer.run(f)
+
+        for error in report.errors:
+            self.stderr.write(f'line {error["line"]}: {error["errors"]}')
+        created = ' '.join(f'{name}={count}' for name, count in report.as_dict()['created'].items())
+        self.stdout.write(self.style.SUCCESS(f'lines={report.lines} {created} errors={report.error_count}'))
+
+    def progress(self, report):
+        self.stdout.write(f'{report.lines} lines, {sum(report.created.values())} rows, {report.error_count} errors')
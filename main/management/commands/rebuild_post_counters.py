@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from main.counters import rebuild_counters
+from main.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает likes_count, comments_count и favorites_count у постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('post_ids', nargs='*', type=int, help='id постов (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        queryset = Post.objects.all()
+        if options['post_ids']:
+            queryset = queryset.filter(pk__in=options['post_ids'])
+        updated = rebuild_counters(queryset)
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано постов: {updated}'))
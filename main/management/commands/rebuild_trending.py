@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main import trending
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинг "в тренде" (PostRank) по счетчикам постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('post_ids', nargs='*', type=int, help='id постов (по умолчанию все)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        updated = trending.rebuild(options['post_ids'] or None, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано постов: {updated}'))
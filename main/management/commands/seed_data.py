@@ -0,0 +1,116 @@
+import itertools
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main import trending
+from main.blobs import retain
+from main.cache import post_cache
+from main.counters import rebuild_counters
+from main.models import Category, Comment, Favorites, Like, Post, PostImages
+
+SEED_PASSWORD = 'seed-password'
+SAMPLE_IMAGES = ('images/Spider_Man.jpeg', 'images/download.jpeg', 'images/download_1.jpeg',
+                 'images/download_2.jpeg')
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua').split()
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу тестовыми данными через bulk_create (для бенчмарков)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--categories', type=int, default=5, help='корневых категорий')
+        parser.add_argument('--depth', type=int, default=3, help='уровней вложенности категорий')
+        parser.add_argument('--children', type=int, default=2, help='детей у каждой категории')
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--images', type=int, default=2, help='картинок на пост')
+        parser.add_argument('--comments', type=int, default=5, help='комментариев на пост')
+        parser.add_argument('--likes', type=int, default=10, help='лайков на пост (не больше --users)')
+        parser.add_argument('--favorites', type=int, default=2, help='избранных на пост (не больше --users)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='seed', help='префикс имен юзеров и заголовков')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        self.rnd = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = options['prefix']
+
+        users = self.create_users(prefix, options['users'])
+        categories = self.create_categories(prefix, options['categories'], options['depth'], options['children'])
+        posts = self.create_posts(prefix, options['posts'], users, categories)
+
+        post_images = PostImages.objects.bulk_create((
+            PostImages(post=post, title=f'image{post.pk}_{i}', image=self.rnd.choice(SAMPLE_IMAGES))
+            for post in posts for i in range(options['images'])
+        ), batch_size=self.batch_size)
+        Comment.objects.bulk_create((
+            Comment(post=post, owner=self.rnd.choice(users), body=self.text(12))
+            for post in posts for _ in range(options['comments'])
+        ), batch_size=self.batch_size)
+        self.create_reactions(Like, posts, users, options['likes'])
+        self.create_reactions(Favorites, posts, users, options['favorites'])
+
+        # bulk_create не шлет сигналы: пересчитываем счетчики и сбрасываем кэш сами
+        rebuild_counters(Post.objects.filter(pk__in=[post.pk for post in posts]))
+        trending.rebuild([post.pk for post in posts])
+        retain([image.image.name for image in post_images] + [post.preview.name for post in posts if post.preview])
+        post_cache.bump_list_generation()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'users={len(users)} categories={len(categories)} posts={len(posts)}'
+        ))
+
+    def text(self, words):
+        return ' '.join(self.rnd.choices(WORDS, k=words))
+
+    def create_users(self, prefix, count):
+        password = make_password(SEED_PASSWORD)  # хэш считается долго, один на всех
+        start = User.objects.filter(username__startswith=f'{prefix}_user_').count()
+        return User.objects.bulk_create((
+            User(username=f'{prefix}_user_{i}', password=password, first_name='Seed', last_name=str(i))
+            for i in range(start, start + count)
+        ), batch_size=self.batch_size)
+
+    def create_categories(self, prefix, roots, depth, children):
+        level = Category.objects.bulk_create(Category(name=f'{prefix} category {i}') for i in range(roots))
+        categories = list(level)
+        for _ in range(depth - 1):
+            level = Category.objects.bulk_create(
+                Category(name=f'{parent.name}.{i}', parent=parent) for parent in level for i in range(children)
+            )
+            categories.extend(level)
+        Category.rebuild_paths()  # bulk_create не вызывает Category.save()
+        return categories
+
+    def create_posts(self, prefix, count, users, categories):
+        start = Post.objects.filter(title__startswith=f'{prefix} post ').count()
+        return Post.objects.bulk_create((
+            Post(
+                title=f'{prefix} post {i}',
+                body=self.text(80),
+                owner=self.rnd.choice(users),
+                category=self.rnd.choice(categories) if categories else None,
+                # превью у половины постов: бюджеты запросов проверяются и с вариантами картинок
+                preview=SAMPLE_IMAGES[i % len(SAMPLE_IMAGES)] if i % 2 else None,
+            )
+            for i in range(start, start + count)
+        ), batch_size=self.batch_size)
+
+    def create_reactions(self, model, posts, users, per_post):
+        per_post = min(per_post, len(users))
+        rows = (
+            model(post=post, owner=owner)
+            for post in posts for owner in self.rnd.sample(users, per_post)
+        )
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                break
+            model.objects.bulk_create(batch, ignore_conflicts=True)
@@ -0,0 +1,220 @@
+import asyncio
+import heapq
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from . import replicas
+
+logger = logging.getLogger('main.sql')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SLOW_REQUEST_MS': 500,       # медленнее - строка в лог с WARNING, остальные - DEBUG
+    'SLOW_QUERIES': 3,            # сколько самых медленных запросов писать в лог
+    'SQL_MAX_LENGTH': 500,
+    'DETECT_N_PLUS_ONE': True,
+    'N_PLUS_ONE_THRESHOLD': 10,   # один и тот же SQL больше N раз за запрос
+}
+
+_IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def sql_shape(sql):
+    """SQL без значений: IN (%s, %s, %s) и IN (%s) считаются одним запросом."""
+    return _LITERAL_RE.sub('?', _IN_LIST_RE.sub('IN (...)', sql))
+
+
+class QueryRecorder:
+    """
+    Обертка для connection.execute_wrapper(): считает запросы и время в БД.
+    В отличие от connection.queries работает при DEBUG=False и не хранит все запросы,
+    только N самых медленных и счетчик форм SQL.
+    """
+
+    def __init__(self, slow_queries=3, detect_n_plus_one=True, sql_max_length=500):
+        self.count = 0
+        self.duration = 0.0
+        self.slow_queries = slow_queries
+        self.sql_max_length = sql_max_length
+        self.slowest = []  # heap из (duration, seq, sql)
+        self.shapes = Counter() if detect_n_plus_one else None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - started)
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        if self.shapes is not None:
+            self.shapes[sql_shape(sql)] += 1
+        if self.slow_queries:
+            item = (duration, self.count, sql[:self.sql_max_length])
+            if len(self.slowest) < self.slow_queries:
+                heapq.heappush(self.slowest, item)
+            elif duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+
+    def repeated(self, threshold):
+        if self.shapes is None:
+            return []
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Для каждого запроса: количество SQL, суммарное время в БД, самые медленные запросы.
+    Отдает заголовок Server-Timing и пишет структурированную строку в лог main.sql:
+    WARNING - для запросов дольше SLOW_REQUEST_MS и вероятных N+1 (одинаковый SQL
+    больше N_PLUS_ONE_THRESHOLD раз), остальные - DEBUG. По умолчанию выключен.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = {**DEFAULTS, **getattr(settings, 'QUERY_INSTRUMENTATION', {})}
+        # как MiddlewareMixin: перед async view не занимаем поток на весь запрос
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.config['ENABLED']:
+            return self.get_response(request)
+
+        recorder = self.new_recorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.install(stack, recorder)
+            response = self.get_response(request)
+        return self.finish(request, response, recorder, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not self.config['ENABLED']:
+            return await self.get_response(request)
+
+        recorder = self.new_recorder()
+        started = time.perf_counter()
+        stack = ExitStack()
+        # async ORM выполняет SQL в потоке sync_to_async(thread_sensitive=True),
+        # соединения там свои - обертки ставим из того же потока
+        await sync_to_async(self.install)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, recorder, time.perf_counter() - started)
+
+    def new_recorder(self):
+        return QueryRecorder(self.config['SLOW_QUERIES'], self.config['DETECT_N_PLUS_ONE'],
+                             self.config['SQL_MAX_LENGTH'])
+
+    @staticmethod
+    def install(stack, recorder):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+    def finish(self, request, response, recorder, total):
+        response['Server-Timing'] = (
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries", '
+            f'total;dur={total * 1000:.1f}'
+        )
+        self.log(request, response, recorder, total)
+        return response
+
+    def log(self, request, response, recorder, total):
+        repeated = recorder.repeated(self.config['N_PLUS_ONE_THRESHOLD'])
+        level = logging.WARNING if repeated or total * 1000 >= self.config['SLOW_REQUEST_MS'] else logging.DEBUG
+        if not logger.isEnabledFor(level):
+            return
+        resolver_match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': resolver_match.view_name if resolver_match else None,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'slowest': [
+                {'ms': round(duration * 1000, 2), 'sql': sql}
+                for duration, _, sql in sorted(recorder.slowest, reverse=True)
+            ],
+        }
+        if repeated:
+            record['n_plus_one'] = [{'count': count, 'sql': shape[:self.config['SQL_MAX_LENGTH']]}
+                                    for shape, count in repeated]
+        logger.log(level, json.dumps(record, ensure_ascii=False))
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Безопасные запросы читают с реплик (main/replicas.py), после записи
+    клиент на DATABASE_REPLICAS['PIN_SECONDS'] секунд читает только с primary.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = replicas.get_config()
+        self.cache = caches[self.config['CACHE_ALIAS']]
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.config['REPLICAS']:
+            return self.get_response(request)
+        key = replicas.pin_key(request)
+        use_replica = request.method in replicas.SAFE_METHODS and not (
+            replicas.pinned_by_cookie(request, self.config) or (key and self.cache.get(key))
+        )
+        state, token = replicas.begin(use_replica)
+        try:
+            response = self.get_response(request)
+        finally:
+            replicas.end(token)
+        if replicas.should_pin(request, response, state):
+            replicas.set_pin_cookie(response, self.config)
+            if key:
+                self.cache.set(key, True, self.config['PIN_SECONDS'])
+        return response
+
+    async def __acall__(self, request):
+        if not self.config['REPLICAS']:
+            return await self.get_response(request)
+        key = replicas.pin_key(request)
+        use_replica = request.method in replicas.SAFE_METHODS and not (
+            replicas.pinned_by_cookie(request, self.config) or (key and await self.cache.aget(key))
+        )
+        state, token = replicas.begin(use_replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            replicas.end(token)
+        if replicas.should_pin(request, response, state):
+            replicas.set_pin_cookie(response, self.config)
+            if key:
+                await self.cache.aset(key, True, self.config['PIN_SECONDS'])
+        return response
@@ -0,0 +1,46 @@
+# Generated by Django 4.1 on 2026-10-18 03:36
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model('main', 'Post')
+    counters = {
+        'likes_count': apps.get_model('main', 'Like'),
+        'comments_count': apps.get_model('main', 'Comment'),
+        'favorites_count': apps.get_model('main', 'Favorites'),
+    }
+    values = {}
+    for field, model in counters.items():
+        counted = (model.objects.filter(post=OuterRef('pk'))
+                   .order_by().values('post').annotate(c=Count('pk')).values('c'))
+        values[field] = Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+    Post.objects.update(**values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_alter_category_options_like_favorites'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
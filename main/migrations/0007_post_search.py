@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def install_search(apps, schema_editor):
+    from main import search
+    search.install(schema_editor.connection)
+
+
+def uninstall_search(apps, schema_editor):
+    from main import search
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # tsvector + GIN (Postgres) / FTS5 (SQLite), см. main/search.py
+
+    dependencies = [
+        ('main', '0006_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search, uninstall_search),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1 on 2026-10-18 03:56
+
+from django.db import migrations, models
+import main.storage
+from collections import Counter
+
+
+def fill_blobs(apps, schema_editor):
+    Post = apps.get_model('main', 'Post')
+    PostImages = apps.get_model('main', 'PostImages')
+    ImageBlob = apps.get_model('main', 'ImageBlob')
+    counts = Counter(PostImages.objects.exclude(image='').values_list('image', flat=True))
+    counts.update(Post.objects.exclude(preview='').exclude(preview=None).values_list('preview', flat=True))
+    ImageBlob.objects.bulk_create([ImageBlob(name=name, refcount=count) for name, count in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_post_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='preview',
+            field=models.ImageField(null=True, storage=main.storage.get_image_storage, upload_to='images/'),
+        ),
+        migrations.AlterField(
+            model_name='postimages',
+            name='image',
+            field=models.ImageField(storage=main.storage.get_image_storage, upload_to='images/'),
+        ),
+        migrations.AddIndex(
+            model_name='imageblob',
+            index=models.Index(fields=['refcount', 'updated_at'], name='imageblob_gc_idx'),
+        ),
+        migrations.RunPython(fill_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1 on 2026-10-18 03:57
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Category = apps.get_model('main', 'Category')
+    categories = list(Category.objects.all())
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+    stack = [(category, '', 0) for category in children.get(None, [])]
+    while stack:
+        category, prefix, depth = stack.pop()
+        category.path, category.depth = f'{prefix}{category.pk}/', depth
+        stack.extend((child, category.path, depth + 1) for child in children.get(category.pk, []))
+    Category.objects.bulk_update(categories, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
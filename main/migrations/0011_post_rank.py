@@ -0,0 +1,44 @@
+# Generated by Django 4.1 on 2026-10-18 04:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+import math
+from datetime import datetime, timezone
+
+
+def fill_ranks(apps, schema_editor):
+    # веса и полураспад по умолчанию из main/trending.py; с другими настройками - rebuild_trending
+    Post = apps.get_model('main', 'Post')
+    PostRank = apps.get_model('main', 'PostRank')
+    epoch = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    ranks = []
+    rows = Post.objects.values_list('pk', 'created_at', 'likes_count', 'comments_count', 'favorites_count')
+    for pk, created_at, likes, comments, favorites in rows.iterator(chunk_size=2000):
+        base = (created_at - epoch).total_seconds() / (24 * 3600)
+        engagement = likes + 2 * comments + 3 * favorites
+        ranks.append(PostRank(post_id=pk, base=base, engagement=engagement, score=base + math.log2(1 + engagement)))
+    PostRank.objects.bulk_create(ranks, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_comment_post_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostRank',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='main.post')),
+                ('base', models.FloatField(default=0)),
+                ('engagement', models.FloatField(default=0)),
+                ('score', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='postrank',
+            index=models.Index(fields=['-score', '-post'], name='postrank_score_idx'),
+        ),
+        migrations.RunPython(fill_ranks, migrations.RunPython.noop),
+    ]
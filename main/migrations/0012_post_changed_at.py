@@ -0,0 +1,24 @@
+# Generated by Django 4.1 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+def copy_updated_at(apps, schema_editor):
+    Post = apps.get_model('main', 'Post')
+    Post.objects.update(changed_at=models.F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_post_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='changed_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copy_updated_at, migrations.RunPython.noop),
+    ]
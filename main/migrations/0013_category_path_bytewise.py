@@ -0,0 +1,31 @@
+from django.db import migrations
+
+# Поддерево категории - диапазон путей [path, path + ':') (CategoryQuerySet.subtree).
+# Он верен только при побайтовом сравнении строк, а типичный collation базы в Postgres
+# (en_US.UTF-8) игнорирует '/' и ':' на первом уровне: '1/3/' < '1:' там ложно.
+# Поэтому subtree() сравнивает path COLLATE "C" (BytewiseCollate), и для этого
+# выражения нужен свой индекс. В SQLite collation по умолчанию и так BINARY -
+# хватает обычного индекса по path.
+
+INDEX = 'category_path_c_idx'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {INDEX} ON main_category ((path COLLATE "C"))')
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_post_changed_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_comment_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='variants',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -1,18 +1,141 @@
-from django.db import models
+import secrets
+
+from django.db import models, transaction
+from django.db.models.functions import Collate, Concat, Substr
+from django.db.models.lookups import GreaterThanOrEqual, LessThan
+
+from .storage import get_image_storage
+
+
+class BytewiseCollate(Collate):
+    """
+    Побайтовое сравнение строк независимо от collation базы: "C" в Postgres, BINARY в SQLite.
+    В en_US.UTF-8 и других лингвистических collation '/' и ':' на первом уровне
+    сравнения игнорируются, и диапазоны по путям категорий ломаются.
+    """
+
+    def __init__(self, expression):
+        super().__init__(expression, 'C')
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, collation='BINARY', **extra_context)
+
+
+class CategoryQuerySet(models.QuerySet):
+
+    def subtree(self, path):
+        """
+        Категория с путем path и все ее потомки.
+        Пути состоят из цифр и '/', поэтому поддерево - диапазон [path, path + ':')
+        в побайтовом порядке (BytewiseCollate, в Postgres - индекс category_path_c_idx);
+        в отличие от LIKE 'path%', он использует btree индекс и тогда, когда
+        path - выражение (Subquery), и все идет одним запросом.
+        """
+        if isinstance(path, str):
+            path = models.Value(path)
+        upper = Concat(path, models.Value(':'), output_field=models.CharField())
+        column = BytewiseCollate('path')
+        return self.filter(GreaterThanOrEqual(column, path), LessThan(column, upper))
 
 
 class Category(models.Model):
     name = models.CharField(max_length=255)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='children', blank=True, null=True)
+    # материализованный путь из id предков: "1/5/12/", пересчитывается в save()
+    path = models.CharField(max_length=255, editable=False, default='', db_index=True)
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
-        return f'{self.name} --> {self.parent}' if self.parent else self.name
+        if not self.parent_id:
+            return self.name
+        if not self.path:
+            return f'{self.name} --> {self.parent}'
+        # все предки одним запросом вместо запроса на каждый уровень
+        names = (Category.objects.filter(pk__in=self.path.split('/')[:-2])
+                 .order_by('-depth').values_list('name', flat=True))
+        return ' --> '.join([self.name, *names])
+
+    def build_path(self):
+        parent = Category.objects.only('path', 'depth').get(pk=self.parent_id) if self.parent_id else None
+        if parent is not None and self.path and parent.path.startswith(self.path):
+            raise ValueError('Category cannot be moved under its own descendant')
+        return (parent.path if parent else '') + f'{self.pk}/', parent.depth + 1 if parent else 0
+
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        old_path = self.path
+        path, depth = self.build_path()
+        if path == old_path:
+            return
+        Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+        if old_path:
+            # перенос поддерева: меняем префикс пути у всех потомков
+            Category.objects.subtree(old_path).exclude(pk=self.pk).update(
+                path=Concat(models.Value(path), Substr('path', len(old_path) + 1), output_field=models.CharField()),
+                depth=models.F('depth') + (depth - self.depth),
+            )
+        self.path, self.depth = path, depth
+
+    @classmethod
+    def rebuild_paths(cls):
+        """Пересчитывает path/depth всего дерева (после bulk_create). Возвращает число категорий."""
+        categories = list(cls.objects.only('pk', 'parent_id', 'path', 'depth'))
+        children = {}
+        for category in categories:
+            children.setdefault(category.parent_id, []).append(category)
+        changed, stack = [], [(category, '', 0) for category in children.get(None, [])]
+        while stack:
+            category, prefix, depth = stack.pop()
+            path = f'{prefix}{category.pk}/'
+            if (category.path, category.depth) != (path, depth):
+                category.path, category.depth = path, depth
+                changed.append(category)
+            stack.extend((child, path, depth + 1) for child in children.get(category.pk, []))
+        cls.objects.bulk_update(changed, ['path', 'depth'], batch_size=1000)
+        return len(categories)
 
     class Meta:
         verbose_name = 'Category'
         verbose_name_plural = 'Categories'
 
 
+def variants_of(ref):
+    """ImageBlob.variants файла из колонки ref (готовые варианты, main/images.py) - подзапросом."""
+    return models.Subquery(ImageBlob.objects.filter(name=models.OuterRef(ref)).values('variants')[:1])
+
+
+class PostQuerySet(models.QuerySet):
+
+    def with_variants(self):
+        """preview_ready для PostListSerializer: варианты превью без запроса на пост."""
+        return self.annotate(preview_ready=variants_of('preview'))
+
+    def feed(self, user):
+        """
+        Все, что нужно PostFeedSerializer, за один SELECT:
+        автор и категория через JOIN, первая картинка, готовые варианты картинок (main/images.py)
+        и флаги текущего юзера подзапросами.
+        """
+        first_image = PostImages.objects.filter(post=models.OuterRef('pk')).order_by('id').values('image')[:1]
+        queryset = self.select_related('owner', 'category').annotate(
+            first_image=models.Subquery(first_image),
+            preview_ready=variants_of('preview'),
+            first_image_ready=variants_of('first_image'),
+        )
+        if user.is_authenticated:
+            return queryset.annotate(
+                is_liked=models.Exists(Like.objects.filter(post=models.OuterRef('pk'), owner=user)),
+                is_favorited=models.Exists(Favorites.objects.filter(post=models.OuterRef('pk'), owner=user)),
+            )
+        return queryset.annotate(
+            is_liked=models.Value(False, output_field=models.BooleanField()),
+            is_favorited=models.Value(False, output_field=models.BooleanField()),
+        )
+
+
 class Post(models.Model):
     """
     Model for Post
@@ -21,9 +144,24 @@ class Post(models.Model):
     body = models.TextField(blank=True)
     owner = models.ForeignKey('auth.User', related_name='posts', on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, related_name='posts', null=True)
-    preview = models.ImageField(upload_to='images/', null=True)
+    preview = models.ImageField(upload_to='images/', storage=get_image_storage, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # любое изменение того, что видно в ответах о посте (main/conditional.py)
+    changed_at = models.DateTimeField(auto_now=True)
+    # денормализованные счетчики, обновляются сигналами (см. main/signals.py)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # имя файла из БД: по нему сигналы видят замену картинки (main/blobs.py)
+        instance._stored_image = instance.__dict__.get('preview')
+        return instance
 
     def __str__(self):
         return f'{self.owner} - {self.title}'
@@ -32,17 +170,25 @@ class Post(models.Model):
         ordering = ('created_at',)
         verbose_name = 'Посты'
         verbose_name_plural = 'Пост'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='post_keyset_idx'),
+        ]
 
 
 class PostImages(models.Model):
     title = models.CharField(max_length=150, blank=True)
-    image = models.ImageField(upload_to='images/')
+    image = models.ImageField(upload_to='images/', storage=get_image_storage)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='images')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_image = instance.__dict__.get('image')
+        return instance
+
     @staticmethod
     def generate_name():
-        from random import randint
-        return 'image' + str(randint(10, 99999))
+        return 'image' + secrets.token_hex(6)
 
     def save(self, *args, **kwargs):
         self.title = self.generate_name()
@@ -54,10 +200,19 @@ class Comment(models.Model):
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE)
     body = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # правка тоже попадает в инкрементальную выгрузку (main/exporter.py)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'{self.owner} -> {self.post} -> {self.created_at}'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='comment_keyset_idx'),
+            # комментарии поста от новых к старым (PostCommentPagination)
+            models.Index(fields=['post', 'created_at', 'id'], name='comment_post_keyset_idx'),
+        ]
+
 
 class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
@@ -74,4 +229,38 @@ class Favorites(models.Model):
 
     class Meta:
         unique_together = ['post', 'owner']
-        # если такой пост есть в "favorites", мы не можем добавить его снова
\ No newline at end of file
+        # если такой пост есть в "favorites", мы не можем добавить его снова
+
+
+class PostRank(models.Model):
+    """Рейтинг "в тренде" (main/trending.py): score = log2(1 + engagement) + base."""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    base = models.FloatField(default=0)        # возраст поста в периодах полураспада от trending.EPOCH
+    engagement = models.FloatField(default=0)  # взвешенная сумма лайков, комментариев и избранного
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', '-post'], name='postrank_score_idx'),
+        ]
+
+
+class ImageBlob(models.Model):
+    """
+    Файл в хранилище картинок и число ссылок на него из Post.preview и PostImages.image.
+    Файлы с refcount = 0 удаляет команда collect_images.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.PositiveIntegerField(default=0)
+    # уже созданные уменьшенные копии (main/images.py), чтобы не спрашивать хранилище
+    variants = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount})'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refcount', 'updated_at'], name='imageblob_gc_idx'),
+        ]
@@ -0,0 +1,253 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class StandartResultPagination(PageNumberPagination):
+    page_size = 5
+    page_query_param = 'page'
+    max_page_size = 1000
+    known_count = None  # уже посчитанный view COUNT(*) - второй раз не считается
+
+    def django_paginator_class(self, queryset, page_size):
+        paginator = DjangoPaginator(queryset, page_size)
+        if self.known_count is not None:
+            paginator.count = self.known_count
+        return paginator
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) пагинация по (created_at, id).
+    Страница ищется через WHERE (created_at, id) > (...) по индексу,
+    поэтому 5000-я страница стоит столько же, сколько первая.
+    Курсоры непрозрачные: base64 от значений ключа и направления.
+    ?count=false отключает COUNT(*).
+    Поле с '-' в ordering - по убыванию (индекс подходит тот же).
+    """
+    ordering = ('created_at', 'id')
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    include_count = True
+    known_count = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset) if self.get_include_count(request) else None
+        return self.finish_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """То же для async views (main/async_views.py): запросы через async ORM."""
+        self.count = await queryset.order_by().acount() if self.get_include_count(request) else None
+        return self.finish_page([obj async for obj in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """Запрос страницы (на одну запись больше, чтобы узнать, есть ли следующая)."""
+        self.request = request
+        self.model = queryset.model
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request, queryset.model)
+        if self.position is not None:
+            queryset = queryset.filter(self.keyset_filter(self.position, self.reverse))
+        ordering = [self.flip(field) if self.reverse else field for field in self.ordering]
+        return queryset.order_by(*ordering)[:self.page_size + 1]
+
+    def finish_page(self, page):
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if self.reverse:
+            page.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param],
+                                 strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_include_count(self, request):
+        value = request.query_params.get(self.count_query_param)
+        if value is None:
+            return self.include_count
+        return value.lower() not in ('0', 'false', 'no')
+
+    def get_count(self, queryset):
+        if self.known_count is not None:
+            return self.known_count
+        return queryset.order_by().count()
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @property
+    def key_fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def cursor_fields(self, request):
+        return self.key_fields
+
+    def keyset_filter(self, position, reverse):
+        """(a, b) > (x, y)  ==>  a > x OR (a = x AND b > y)"""
+        fields = self.key_fields
+        conditions = []
+        for i, field in enumerate(fields):
+            lookup = 'lt' if self.ordering[i].startswith('-') != reverse else 'gt'
+            equal = {name: value for name, value in zip(fields[:i], position[:i])}
+            conditions.append(Q(**equal, **{f'{field}__{lookup}': position[i]}))
+        return reduce(or_, conditions)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, obj, reverse):
+        opts = self.model._meta
+        if isinstance(obj, dict):
+            # строка values() (main/fastserializers.py): ключи курсора в ней есть, см. cursor_fields
+            obj = SimpleNamespace(**obj)
+        position = [opts.get_field(field).value_to_string(obj) for field in self.key_fields]
+        raw = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(raw.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            raw_position = data['p']
+            if len(raw_position) != len(self.ordering):
+                raise ValueError
+            position = [model._meta.get_field(field).to_python(value)
+                        for field, value in zip(self.key_fields, raw_position)]
+            return position, bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class UserKeysetPagination(KeysetPagination):
+    # у auth.User нет created_at
+    ordering = ('date_joined', 'id')
+
+
+class SwitchablePagination(BasePagination):
+    """
+    Включает keyset пагинацию по ?pagination=cursor (или по наличию cursor),
+    иначе отдает работу fallback_class. fallback_class = None - без пагинации.
+    """
+    keyset_class = KeysetPagination
+    fallback_class = None
+    mode_query_param = 'pagination'
+
+    def __init__(self):
+        self.delegate = None
+        self.known_count = None
+
+    def use_keyset(self, request):
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.keyset_class.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request):
+            self.delegate = self.keyset_class()
+        elif self.fallback_class is not None:
+            self.delegate = self.fallback_class()
+        else:
+            return None
+        self.delegate.known_count = self.known_count
+        return self.delegate.paginate_queryset(queryset, request, view)
+
+    def cursor_fields(self, request):
+        """Поля, которые нужны строкам страницы для курсоров."""
+        return self.keyset_class().key_fields if self.use_keyset(request) else ()
+
+    def get_paginated_response(self, data):
+        return self.delegate.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        if self.fallback_class is not None:
+            return self.fallback_class().get_paginated_response_schema(schema)
+        return schema
+
+    def get_results(self, data):
+        return data['results']
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.delegate, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.delegate.to_html()
+
+
+class PostPagination(SwitchablePagination):
+    fallback_class = StandartResultPagination
+
+
+class CommentPagination(SwitchablePagination):
+    pass
+
+
+class PostCommentPagination(KeysetPagination):
+    # комментарии поста: сначала новые, всегда keyset; count берется из Post.comments_count
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    include_count = False
+
+
+class UserPagination(SwitchablePagination):
+    keyset_class = UserKeysetPagination
+
+
+class FavoritesPagination(KeysetPagination):
+    # у Favorites нет created_at, id растет вместе со временем добавления
+    ordering = ('-id',)
+    page_size = 20
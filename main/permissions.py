@@ -9,4 +9,10 @@ class IsAuthor(BasePermission):
 
 class IsAccountOwner(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return request.user == obj
\ No newline at end of file
+        return request.user == obj
+
+
+class IsOwnAccount(BasePermission):
+    # для вложенных маршрутов accounts/<pk>/...
+    def has_permission(self, request, view):
+        return request.user.pk == view.kwargs.get('pk')
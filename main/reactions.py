@@ -0,0 +1,120 @@
+"""
+Лайки и избранное без загрузки поста и без гонок.
+
+Добавление - INSERT ... SELECT FROM main_post ... ON CONFLICT DO NOTHING RETURNING,
+удаление - DELETE ... RETURNING. Повторный запрос или два параллельных
+не падают на unique_together, а просто ничего не меняют.
+На Postgres счетчик в Post и рейтинг PostRank (main/trending.py) обновляются
+в том же запросе (data-modifying CTE), на SQLite - отдельными UPDATE в той же транзакции.
+Строки меняются в обход ORM, поэтому post_save/post_delete не приходят;
+вместо них шлется reactions_changed (подписчики в main/signals.py).
+"""
+from django.db import connection, transaction
+from django.dispatch import Signal
+
+from . import trending
+from .counters import COUNTER_FIELDS, change_counters
+from .models import Favorites, Like, Post, PostRank
+
+REACTIONS = {
+    'like': Like,
+    'favorite': Favorites,
+}
+
+# sender - модель реакции, post_ids - посты, где строка реально добавлена/удалена, delta - +1/-1
+reactions_changed = Signal()
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def _insert_sql(model, post_ids):
+    table, post_table = model._meta.db_table, Post._meta.db_table
+    return (
+        f'INSERT INTO {table} (post_id, owner_id) '
+        f'SELECT id, %s FROM {post_table} WHERE id IN ({_placeholders(post_ids)}) '
+        f'ON CONFLICT (post_id, owner_id) DO NOTHING RETURNING post_id'
+    )
+
+
+def _delete_sql(model, post_ids):
+    return (
+        f'DELETE FROM {model._meta.db_table} '
+        f'WHERE owner_id = %s AND post_id IN ({_placeholders(post_ids)}) RETURNING post_id'
+    )
+
+
+def _with_counter(sql, model, delta):
+    """Postgres: тот же запрос плюс UPDATE счетчика и рейтинга через CTE."""
+    field = COUNTER_FIELDS[model]
+    engagement = f'GREATEST(engagement + {trending.weight(model) * delta!r}, 0)'
+    return (
+        f'WITH changed AS ({sql}), '
+        f'counted AS (UPDATE {Post._meta.db_table} '
+        f'SET {field} = GREATEST({field} + {delta}, 0), changed_at = STATEMENT_TIMESTAMP() '
+        f'WHERE id IN (SELECT post_id FROM changed)), '
+        f'ranked AS (UPDATE {PostRank._meta.db_table} SET engagement = {engagement}, '
+        f'score = base + LN({engagement} + 1) / LN(2) '
+        f'WHERE post_id IN (SELECT post_id FROM changed)) '
+        f'SELECT post_id FROM changed'
+    )
+
+
+def _execute(model, user_id, post_ids, delta):
+    post_ids = sorted(set(post_ids))
+    if not post_ids:
+        return []
+    sql = (_insert_sql if delta > 0 else _delete_sql)(model, post_ids)
+    if connection.vendor == 'postgresql':
+        sql = _with_counter(sql, model, delta)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, *post_ids])
+        changed = sorted(row[0] for row in cursor.fetchall())
+    if changed and connection.vendor != 'postgresql':
+        change_counters(model, changed, delta)
+        trending.record(model, changed, delta)
+    return changed
+
+
+def apply(model, user_id, add=(), remove=()):
+    """
+    Добавляет реакции на посты add и снимает с постов remove одной транзакцией.
+    Возвращает (добавлено, удалено) - id постов, где что-то реально изменилось.
+    Несуществующие посты молча пропускаются.
+    """
+    # без SAVEPOINT: внутри чужой транзакции это лишние запросы на каждый лайк
+    with transaction.atomic(savepoint=False):
+        added = _execute(model, user_id, add, 1)
+        removed = _execute(model, user_id, remove, -1)
+        for post_ids, delta in ((added, 1), (removed, -1)):
+            if post_ids:
+                reactions_changed.send(sender=model, post_ids=post_ids, owner_id=user_id, delta=delta)
+    return added, removed
+
+
+def apply_many(user_id, changes):
+    """
+    Реакции нескольких видов одной транзакцией:
+    {model: {'add': [...], 'remove': [...]}} -> {model: (добавлено, удалено)}.
+    """
+    with transaction.atomic():
+        return {model: apply(model, user_id, **change) for model, change in changes.items()}
+
+
+def add(model, user_id, post_id):
+    return bool(apply(model, user_id, add=[post_id])[0])
+
+
+def remove(model, user_id, post_id):
+    return bool(apply(model, user_id, remove=[post_id])[1])
+
+
+def toggle(model, user_id, post_id):
+    """
+    True - реакция поставлена, False - снята, None - поста нет.
+    Сначала пробуем снять: если реакция была, это единственный запрос.
+    """
+    if remove(model, user_id, post_id):
+        return False
+    return True if add(model, user_id, post_id) else None
@@ -0,0 +1,128 @@
+"""
+Чтение с реплик с read-your-writes.
+
+ReplicaRoutingMiddleware на каждый запрос решает, можно ли читать с реплики:
+GET/HEAD/OPTIONS - можно, пока клиент не закреплен за primary. После записи
+(небезопасный метод или любой db_for_write) клиент закрепляется на
+PIN_SECONDS секунд: cookie для браузеров и ключ в кэше по заголовку
+Authorization для API клиентов, которые cookie не хранят.
+Вне запросов (команды, shell) роутер ничего не решает - все идет в default.
+
+То, что кладется в общие кэши (main/cache.py), читается только с primary
+(read_from_primary): данные с отстающей реплики, закэшированные уже после
+сброса кэша по записи, жили бы там весь TIMEOUT - сбросить их было бы некому.
+"""
+import contextvars
+import hashlib
+from contextlib import contextmanager
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+DEFAULTS = {
+    'REPLICAS': [],
+    'PIN_SECONDS': 5,
+    'COOKIE_NAME': 'primary_until',
+    'CACHE_ALIAS': 'shared',
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_REPLICAS', {})}
+
+
+class RoutingState:
+    # объект, а не флаги в ContextVar: sync_to_async копирует контекст,
+    # а изменения в потоке должны быть видны middleware
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+_state = contextvars.ContextVar('replica_routing', default=None)
+
+
+def begin(use_replica):
+    state = RoutingState(use_replica)
+    return state, _state.set(state)
+
+
+def end(token):
+    _state.reset(token)
+
+
+@contextmanager
+def read_from_primary():
+    """Чтения внутри блока идут в default, даже если запросу можно на реплику."""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    use_replica, state.use_replica = state.use_replica, False
+    try:
+        yield
+    finally:
+        state.use_replica = use_replica
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None:
+            return None
+        replicas = get_config()['REPLICAS']
+        if state.use_replica and not state.wrote and replicas:
+            return random.choice(replicas)
+        # явно default: иначе Django возьмет базу из hints['instance'], а она могла прийти с реплики
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики - копии default
+        databases = {DEFAULT_DB_ALIAS, *get_config()['REPLICAS']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_config()['REPLICAS']:
+            return False
+        return None
+
+
+def pin_key(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return 'replicas:pin:' + hashlib.sha256(authorization.encode()).hexdigest()
+
+
+def pinned_by_cookie(request, config):
+    try:
+        return float(request.COOKIES.get(config['COOKIE_NAME'], 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def should_pin(request, response, state):
+    if state.wrote:
+        return True
+    # main/reactions.py пишет сырым SQL мимо роутера
+    return request.method not in SAFE_METHODS and response.status_code < 400
+
+
+def set_pin_cookie(response, config):
+    seconds = config['PIN_SECONDS']
+    response.set_cookie(config['COOKIE_NAME'], f'{time.time() + seconds:.3f}', max_age=seconds,
+                        httponly=True, samesite='Lax')
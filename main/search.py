@@ -0,0 +1,220 @@
+"""
+Полнотекстовый поиск по постам (title + body).
+
+Postgres: колонка main_post.search_vector (tsvector) с GIN индексом,
+заполняется триггером, ранжирование ts_rank_cd, сниппеты ts_headline.
+SQLite: external content таблица FTS5 main_post_fts с триггерами,
+ранжирование bm25, сниппеты snippet(). Нужна для локальной разработки и тестов.
+
+Колонки и триггеры живут только в БД (Post о них не знает), чтобы обычные
+SELECT по постам не тащили tsvector. install() идемпотентна и вызывается
+из миграции и после каждого migrate (SQLite пересоздает таблицу при ALTER
+и теряет триггеры).
+"""
+import re
+from types import SimpleNamespace
+
+from django.db import connection as default_connection
+from django.db.models import BooleanField, FloatField, TextField, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+SEARCH_CONFIG = 'simple'
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+_PG_INSTALL = (
+    'ALTER TABLE main_post ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    f'''
+    CREATE OR REPLACE FUNCTION main_post_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.body, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS main_post_search_vector_trigger ON main_post',
+    '''
+    CREATE TRIGGER main_post_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, body ON main_post
+    FOR EACH ROW EXECUTE PROCEDURE main_post_search_vector_update()
+    ''',
+    'CREATE INDEX IF NOT EXISTS main_post_search_idx ON main_post USING GIN (search_vector)',
+)
+
+_PG_BACKFILL = f'''
+    UPDATE main_post SET search_vector =
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(body, '')), 'B')
+    WHERE search_vector IS NULL
+'''
+
+_PG_UNINSTALL = (
+    'DROP TRIGGER IF EXISTS main_post_search_vector_trigger ON main_post',
+    'DROP FUNCTION IF EXISTS main_post_search_vector_update()',
+    'DROP INDEX IF EXISTS main_post_search_idx',
+    'ALTER TABLE main_post DROP COLUMN IF EXISTS search_vector',
+)
+
+_SQLITE_INSTALL = (
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS main_post_fts USING fts5(
+        title, body, content='main_post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS main_post_fts_ai AFTER INSERT ON main_post BEGIN
+        INSERT INTO main_post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS main_post_fts_ad AFTER DELETE ON main_post BEGIN
+        INSERT INTO main_post_fts(main_post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS main_post_fts_au AFTER UPDATE OF title, body ON main_post BEGIN
+        INSERT INTO main_post_fts(main_post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO main_post_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END
+    ''',
+)
+
+_SQLITE_UNINSTALL = (
+    'DROP TRIGGER IF EXISTS main_post_fts_ai',
+    'DROP TRIGGER IF EXISTS main_post_fts_ad',
+    'DROP TRIGGER IF EXISTS main_post_fts_au',
+    'DROP TABLE IF EXISTS main_post_fts',
+)
+
+
+def _is_installed(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'main_post_search_vector_trigger'")
+        else:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'main_post_fts_ai'")
+        return cursor.fetchone() is not None
+
+
+def install(connection=default_connection):
+    """Создает (или восстанавливает) поисковый индекс. Повторный вызов ничего не ломает."""
+    if connection.vendor not in ('postgresql', 'sqlite') or _is_installed(connection):
+        return False
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in _PG_INSTALL:
+                cursor.execute(sql)
+            cursor.execute(_PG_BACKFILL)
+        else:
+            for sql in _SQLITE_INSTALL:
+                cursor.execute(sql)
+            cursor.execute("INSERT INTO main_post_fts(main_post_fts) VALUES ('rebuild')")
+    return True
+
+
+def uninstall(connection=default_connection):
+    statements = {'postgresql': _PG_UNINSTALL, 'sqlite': _SQLITE_UNINSTALL}.get(connection.vendor, ())
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def parse_terms(query):
+    return _WORD_RE.findall(query.lower())
+
+
+class LikePostSearch:
+    """
+    Запасной путь (и точка отсчета в benchmark_search): ILIKE '%term%' без индекса и ранжирования.
+    Ровно тот запрос, которым DRF SearchFilter (search_fields = ('title',)) фильтровал ?search= ленты.
+    """
+    search_fields = ('title',)
+
+    def filter(self, queryset, query):
+        # self вместо view: SearchFilter берет у него только search_fields
+        request = SimpleNamespace(query_params={SearchFilter.search_param: query})
+        return SearchFilter().filter_queryset(request, queryset, self)
+
+    def search(self, queryset, query):
+        return self.filter(queryset, query).annotate(
+            rank=Value(0.0, output_field=FloatField()),
+            snippet=Value(None, output_field=TextField()),
+        ).order_by('-created_at', '-id')
+
+
+class PostgresPostSearch:
+
+    @staticmethod
+    def to_tsquery(terms):
+        # каждый терм как префикс: 'spider:* & man:*'
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def filter(self, queryset, query):
+        """Только отбор по GIN индексу, порядок queryset не меняется."""
+        terms = parse_terms(query)
+        if not terms:
+            return queryset
+        return queryset.filter(RawSQL('main_post.search_vector @@ to_tsquery(%s, %s)',
+                                      (SEARCH_CONFIG, self.to_tsquery(terms)), output_field=BooleanField()))
+
+    def search(self, queryset, query):
+        terms = parse_terms(query)
+        if not terms:
+            return queryset.none()
+        params = (SEARCH_CONFIG, self.to_tsquery(terms))
+        options = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2, MaxWords=20, MinWords=5'
+        return self.filter(queryset, query).annotate(
+            rank=RawSQL('ts_rank_cd(main_post.search_vector, to_tsquery(%s, %s))', params,
+                        output_field=FloatField()),
+            snippet=RawSQL('ts_headline(%s, main_post.body, to_tsquery(%s, %s), %s)',
+                           (SEARCH_CONFIG, *params, options), output_field=TextField()),
+        ).order_by('-rank', '-id')
+
+
+class SqlitePostSearch:
+
+    @staticmethod
+    def to_match(terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def filter(self, queryset, query):
+        """Только отбор по FTS5, порядок queryset не меняется."""
+        terms = parse_terms(query)
+        if not terms:
+            return queryset
+        return queryset.extra(
+            where=['main_post.id IN (SELECT rowid FROM main_post_fts WHERE main_post_fts MATCH %s)'],
+            params=[self.to_match(terms)],
+        )
+
+    def search(self, queryset, query):
+        terms = parse_terms(query)
+        if not terms:
+            return queryset.none()
+        # bm25()/snippet() работают только в запросе с MATCH по самой FTS таблице,
+        # поэтому нужен настоящий JOIN, а не коррелированный подзапрос на каждую строку
+        return queryset.extra(
+            tables=['main_post_fts'],
+            where=['main_post_fts.rowid = main_post.id', 'main_post_fts MATCH %s'],
+            params=[self.to_match(terms)],
+            select={
+                # bm25 тем лучше, чем меньше; title весит больше body
+                'rank': '-bm25(main_post_fts, 10.0, 1.0)',
+                'snippet': "snippet(main_post_fts, 1, %s, %s, '…', 20)",
+            },
+            select_params=(HIGHLIGHT_START, HIGHLIGHT_STOP),
+        ).order_by('-rank', '-id')
+
+
+def get_search_backend(connection=default_connection):
+    if connection.vendor == 'postgresql':
+        return PostgresPostSearch()
+    if connection.vendor == 'sqlite':
+        return SqlitePostSearch()
+    return LikePostSearch()
@@ -1,7 +1,58 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
 
-from .models import Category, Favorites, Like, Post, PostImages, Comment
+from .blobs import retain
+from .fieldsets import SparseFieldsMixin
+from .images import ready_variants, remember, schedule_variants, variant_urls
+from .models import Category, Favorites, Like, Post, PostImages, Comment, variants_of
+from .reactions import REACTIONS
+from .writebehind import reaction_buffer
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    URL уменьшенных копий картинки: {"thumbnail": ..., "medium": ..., "webp": ...}.
+    source - ImageField модели или строка с путем (тогда нужен storage).
+    ready_source - аннотация с ImageBlob.variants (Post.objects.feed), иначе они читаются запросом.
+    """
+
+    def __init__(self, storage=None, ready_source=None, **kwargs):
+        self.storage = storage
+        self.ready_source = ready_source
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        value = super().get_attribute(instance)
+        name = getattr(value, 'name', value)
+        if name and self.ready_source and hasattr(instance, self.ready_source):
+            remember(name, set(getattr(instance, self.ready_source) or ()))
+        return value
+
+    def to_representation(self, value):
+        name = getattr(value, 'name', value)
+        storage = getattr(value, 'storage', self.storage)
+        urls = variant_urls(name, storage)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {variant: request.build_absolute_uri(url) for variant, url in urls.items()}
+
+
+def variant_names(serializer, instances):
+    """Имена картинок всех ImageVariantsField сериализатора (с учетом ?fields=) по instances."""
+    fields = [field for field in serializer.fields.values() if isinstance(field, ImageVariantsField)]
+    values = (field.get_attribute(instance) for instance in instances for field in fields)
+    return [getattr(value, 'name', value) for value in values]
+
+
+class ImageVariantsListSerializer(serializers.ListSerializer):
+    """Готовые варианты картинок всего списка - одним запросом, а не на каждый объект (main/images.py)."""
+
+    def to_representation(self, data):
+        instances = list(data.all() if hasattr(data, 'all') else data)
+        ready_variants(variant_names(self.child, instances))
+        return super().to_representation(instances)
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -33,30 +84,71 @@ class RegisterSerializer(serializers.ModelSerializer):
             last_name=validated_data.get('last_name')  # можно и так вытаскивать значение
         )
         user.set_password(validated_data['password'])
-        user.save()
+        user.save(update_fields=['password'])
         return user
 
 
 # =============================================================================================
 
+class FavoritesListSerializer(serializers.ListSerializer):
+    """Посты всего списка - одним PostListSerializer(many=True), без запроса на пост."""
+
+    def to_representation(self, data):
+        favorites = list(data.all() if hasattr(data, 'all') else data)
+        posts = [favorite.post for favorite in favorites]
+        for favorite, post in zip(favorites, posts):
+            # аннотация FavoritesSerializer.queryset(): варианты превью уже прочитаны
+            if hasattr(favorite, 'post_preview_ready'):
+                post.preview_ready = favorite.post_preview_ready
+        return [{'post': post} for post in PostListSerializer(posts, many=True).data]
+
+
 class FavoritesSerializer(serializers.ModelSerializer):
     class Meta:
         model = Favorites
         fields = ('post',)
+        list_serializer_class = FavoritesListSerializer
 
     def to_representation(self, instance):
         repr = super().to_representation(instance)
         repr['post'] = PostListSerializer(instance.post).data
         return repr
 
-class UserSerializer(serializers.ModelSerializer):
+    @staticmethod
+    def queryset(queryset):
+        """Избранное с постами и вариантами их превью - одним запросом."""
+        return queryset.select_related('post').annotate(post_preview_ready=variants_of('post__preview'))
+
+    @staticmethod
+    def posts(post_ids):
+        """Данные постов в том же виде, что repr['post'] - для избранного из буфера write-behind."""
+        posts = Post.objects.with_variants().in_bulk(post_ids)
+        return PostListSerializer([posts[pk] for pk in post_ids if pk in posts], many=True).data
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         exclude = ('password',)
+        expandable = ('favorites', 'groups', 'user_permissions')
 
     def to_representation(self, instance):
         repr = super().to_representation(instance)
-        repr['favorites'] = FavoritesSerializer(instance.favorites.all(), many=True).data
+        # последние избранные, не больше USER_DETAIL_FAVORITES (?favorites=0 - без них);
+        # полный список - /api/v1/accounts/<id>/favorites/
+        limit = getattr(settings, 'USER_DETAIL_FAVORITES', 10)
+        request = self.context.get('request')
+        if request is not None and 'favorites' in request.query_params:
+            try:
+                limit = min(limit, max(int(request.query_params['favorites']), 0))
+            except ValueError:
+                pass
+        if limit and self.wants('favorites'):
+            favorites = FavoritesSerializer.queryset(instance.favorites.order_by('-id'))[:limit]
+            repr['favorites'] = FavoritesSerializer(favorites, many=True).data
+            if reaction_buffer.enabled:
+                # избранное, которое еще в буфере (main/writebehind.py)
+                repr['favorites'] = reaction_buffer.overlay_favorites(
+                    repr['favorites'], instance.pk, FavoritesSerializer.posts, limit=limit)
         return repr
 
 
@@ -69,13 +161,38 @@ class UserListSerializer(serializers.ModelSerializer):
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = '__all__'
+        fields = ('id', 'name', 'parent')
+
+
+class CategoryTreeSerializer(CategorySerializer):
+    # tree_children заполняет CategoryListView, запросов к БД нет
+    children = serializers.SerializerMethodField()
+
+    class Meta(CategorySerializer.Meta):
+        fields = CategorySerializer.Meta.fields + ('children',)
+
+    def get_children(self, category):
+        return CategoryTreeSerializer(category.tree_children, many=True).data
+
+    @staticmethod
+    def nest(categories):
+        """Раскладывает плоский список по tree_children, возвращает корни."""
+        by_id = {category.pk: category for category in categories}
+        roots = []
+        for category in categories:
+            category.tree_children = []
+            parent = by_id.get(category.parent_id)
+            (parent.tree_children if parent is not None else roots).append(category)
+        return roots
 
 
 class PostImageSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField(source='image')
+
     class Meta:
         model = PostImages
         exclude = ('id',)
+        list_serializer_class = ImageVariantsListSerializer
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -86,36 +203,77 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ('id', 'body', 'owner', 'post')
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
     category = serializers.ReadOnlyField(source='category.name')
     images = PostImageSerializer(many=True)
-    comments = CommentSerializer(many=True, read_only=True)  # 1 способ рабочий код комментов
+    # только последние POST_DETAIL_COMMENTS комментариев, остальные - через /posts/<id>/comments/
+    comments = serializers.SerializerMethodField()
+    preview_variants = ImageVariantsField(source='preview')
 
     class Meta:
         model = Post
-        fields = '__all__'
+        # changed_at - служебное поле для ETag (main/conditional.py)
+        exclude = ('changed_at',)
+        expandable = ('images', 'comments')
+
+    def get_comments(self, post):
+        comments = getattr(post, 'newest_comments', None)  # async view загружает их заранее
+        if comments is None:
+            comments = post.comments.select_related('owner').order_by('-created_at', '-id')[:self.comments_limit()]
+        return CommentSerializer(comments, many=True).data
 
-    def is_liked(self, post):
-        user = self.context.get('request').user
-        return user.liked.filter(post=post).exists()
+    @staticmethod
+    def comments_limit():
+        return getattr(settings, 'POST_DETAIL_COMMENTS', 10)
 
-        # для просмотра комментов или лайков
+    # is_liked добавляет PostViewSet поверх кэшированного ответа
+
+
+class PostListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    preview_variants = ImageVariantsField(source='preview', ready_source='preview_ready')
+
+    class Meta:
+        model = Post
+        fields = ('id', 'title', 'preview', 'preview_variants')
+        list_serializer_class = ImageVariantsListSerializer
 
-    def to_representation(self, instance):
-        repr = super().to_representation(instance)
-        # repr['comments'] = CommentSerializer(instance.comments.all(), many=True).data
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            repr['is_liked'] = self.is_liked(instance)
-        repr['likes_count'] = instance.likes.count()
-        return repr
 
+class PostFeedSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Расширенный список постов. Ожидает queryset из Post.objects.feed(user),
+    поэтому не делает ни одного дополнительного запроса на пост.
+    """
+    owner = serializers.ReadOnlyField(source='owner.username')
+    category = serializers.ReadOnlyField(source='category.name')
+    image = serializers.SerializerMethodField()
+    preview_variants = ImageVariantsField(source='preview', ready_source='preview_ready')
+    image_variants = ImageVariantsField(source='first_image', storage=PostImages._meta.get_field('image').storage,
+                                        ready_source='first_image_ready')
+    is_liked = serializers.BooleanField(read_only=True)
+    is_favorited = serializers.BooleanField(read_only=True)
 
-class PostListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Post
-        fields = ('id', 'title', 'preview')
+        fields = ('id', 'title', 'preview', 'preview_variants', 'owner', 'category', 'created_at',
+                  'likes_count', 'comments_count', 'image', 'image_variants', 'is_liked', 'is_favorited')
+        fast_sources = {'image': 'first_image'}  # main/fastserializers.py
+        list_serializer_class = ImageVariantsListSerializer
+
+    def get_image(self, post):
+        if not post.first_image:
+            return None
+        url = PostImages._meta.get_field('image').storage.url(post.first_image)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class PostSearchSerializer(PostFeedSerializer):
+    rank = serializers.FloatField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
+
+    class Meta(PostFeedSerializer.Meta):
+        fields = PostFeedSerializer.Meta.fields + ('rank', 'snippet')
 
 
 class PostCreateSerializer(serializers.ModelSerializer):
@@ -126,12 +284,26 @@ class PostCreateSerializer(serializers.ModelSerializer):
         model = Post
         fields = ('title', 'body', 'category', 'preview', 'images',)
 
+    def validate(self, attrs):
+        request = self.context.get('request')
+        # файлы, отброшенные StreamingImageUploadHandler, и ошибки фоновой проверки заголовков
+        errors = [f'{item["name"]}: {item["error"]}' for item in getattr(request, 'rejected_uploads', [])]
+        files = request.FILES.getlist('images') + request.FILES.getlist('preview') if request else []
+        errors += [f'{f.name}: {f.error}' for f in files if getattr(f, 'error', None)]
+        if errors:
+            raise serializers.ValidationError({'images': errors})
+        return attrs
+
     def create(self, validated_data):
         request = self.context.get('request')
         created_post = Post.objects.create(**validated_data)
         images_data = request.FILES
         images_object = [PostImages(post=created_post, image=image) for image in images_data.getlist('images')]
         PostImages.objects.bulk_create(images_object)
+        # bulk_create не шлет post_save, ставим генерацию вариантов и считаем ссылки сами
+        for image in images_object:
+            schedule_variants(image.image)
+        retain(image.image.name for image in images_object)
         return created_post
 
 
@@ -141,4 +313,20 @@ class LikeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Like
-        fields = ('owner',)
\ No newline at end of file
+        fields = ('owner',)
+
+
+class ReactionSerializer(serializers.Serializer):
+    post = serializers.IntegerField(min_value=1)
+    type = serializers.ChoiceField(choices=tuple(REACTIONS))
+    value = serializers.BooleanField()
+
+
+class ReactionBatchSerializer(serializers.Serializer):
+    reactions = ReactionSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_reactions(self, items):
+        keys = [(item['post'], item['type']) for item in items]
+        if len(keys) != len(set(keys)):
+            raise serializers.ValidationError('Duplicate post and type in one batch')
+        return items
@@ -0,0 +1,147 @@
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import blobs, conditional, images, search, trending
+from .cache import post_cache
+from .counters import change_counter
+from .models import Category, Comment, Favorites, Like, Post, PostImages
+from .reactions import reactions_changed
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Favorites)
+def increment_post_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(sender, instance.post_id, 1)
+        trending.record(sender, [instance.post_id], 1)
+
+
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Favorites)
+def decrement_post_counter(sender, instance, **kwargs):
+    # при каскадном удалении поста UPDATE просто ничего не найдет
+    change_counter(sender, instance.post_id, -1)
+    trending.record(sender, [instance.post_id], -1)
+
+
+@receiver(post_save, sender=Post)
+def create_post_rank(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        trending.add_post(instance)
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    # SQLite при ALTER TABLE пересоздает main_post и теряет FTS триггеры
+    if sender.name == 'main':
+        search.install(connections[using])
+
+
+# ============================================================================================
+# сброс кэша постов (main/cache.py)
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_cached_post(sender, instance, **kwargs):
+    # новый, удаленный или измененный пост меняет состав страниц ленты (фильтры, поиск)
+    post_cache.invalidate_post(instance.pk, lists=True)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Favorites)
+@receiver(post_delete, sender=Favorites)
+@receiver(post_save, sender=PostImages)
+@receiver(post_delete, sender=PostImages)
+def invalidate_cached_post_relation(sender, instance, **kwargs):
+    # только счетчики и картинки поста: сбрасываются страницы ленты, где он есть
+    post_cache.invalidate_post(instance.post_id)
+
+
+@receiver(reactions_changed)
+def invalidate_cached_reaction_posts(sender, post_ids, **kwargs):
+    post_cache.invalidate_posts(post_ids)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cached_category_posts(sender, instance, **kwargs):
+    # в ответах есть category.name, а удаление категории меняет фильтр по ней
+    posts = Post.objects.filter(category=instance)
+    post_cache.invalidate_posts(posts.values_list('pk', flat=True), lists=True)
+    conditional.touch(posts)
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_owner_posts(sender, instance, created, update_fields=None, **kwargs):
+    # в ответах есть owner.username; login сохраняет только last_login
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    post_cache.invalidate_posts(instance.posts.values_list('pk', flat=True))
+    conditional.touch(instance.posts.all())
+    conditional.touch_commented_by(instance)
+
+
+# ============================================================================================
+# ETag постов (main/conditional.py): то, что не двигает счетчики
+
+@receiver(post_save, sender=Comment)
+def touch_post_on_comment_edit(sender, instance, created, raw=False, **kwargs):
+    # новый комментарий сдвинет changed_at вместе со счетчиком
+    if not created and not raw:
+        conditional.touch(Post.objects.filter(pk=instance.post_id))
+
+
+@receiver(post_save, sender=PostImages)
+@receiver(post_delete, sender=PostImages)
+def touch_post_on_images(sender, instance, raw=False, **kwargs):
+    if not raw:
+        conditional.touch(Post.objects.filter(pk=instance.post_id))
+
+
+# ============================================================================================
+# уменьшенные копии картинок (main/images.py)
+
+@receiver(post_save, sender=Post)
+def generate_preview_variants(sender, instance, raw=False, **kwargs):
+    if instance.preview and not raw:
+        images.schedule_variants(instance.preview)
+
+
+@receiver(post_save, sender=PostImages)
+def generate_image_variants(sender, instance, raw=False, **kwargs):
+    if instance.image and not raw:
+        images.schedule_variants(instance.image)
+
+
+# ============================================================================================
+# ссылки на файлы картинок (main/blobs.py)
+
+def _image_field(sender):
+    return 'preview' if sender is Post else 'image'
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=PostImages)
+def retain_image(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    field = _image_field(sender)
+    if raw or (update_fields is not None and field not in update_fields):
+        return
+    old = None if created else getattr(instance, '_stored_image', None)
+    new = getattr(instance, field).name or None
+    if old != new:
+        blobs.retain([new])
+        blobs.release([old])
+        instance._stored_image = new
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=PostImages)
+def release_image(sender, instance, **kwargs):
+    blobs.release([getattr(instance, _image_field(sender)).name])
@@ -0,0 +1,127 @@
+"""
+Контентно-адресуемое хранилище картинок.
+
+Файл сохраняется один раз под своим sha256:
+    images/Spider_Man.jpeg -> images/3f/a9/3fa9...e1.jpeg
+Повторная загрузка того же содержимого не пишет на диск ничего, только сдвигает
+mtime файла (collect() не удалит его еще grace секунд), и возвращает то же имя.
+Хэш берется из StreamedUploadedFile.sha256 (посчитан при загрузке, main/uploads.py),
+иначе считается по чанкам. Ссылки из Post.preview и PostImages.image считаются
+в main/blobs.py, там же сборка мусора.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+
+def content_digest(content):
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def is_addressed(name):
+    """Имя вида <dir>/ab/cd/abcd...<ext>, которое выдало это хранилище."""
+    parts = name.split('/')
+    stem = os.path.splitext(parts[-1])[0]
+    return (len(parts) >= 3 and len(stem) == 64
+            and parts[-3] == stem[:2] and parts[-2] == stem[2:4])
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def address(self, name, digest):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest[2:4], digest + extension).replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.address(self.generate_filename(name), content_digest(content))
+        if self.exists(name) and self.touch(name):
+            return name
+        return self._save(name, content)
+
+    def touch(self, name):
+        """Сдвигает mtime файла, который снова понадобился. False - файла уже нет."""
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete_if_stale(self, name, older_than):
+        """
+        Удаляет файл, если его mtime старше older_than. Сначала файл переименовывается:
+        параллельный save() того же содержимого либо успел сдвинуть mtime (тогда файл
+        возвращается на место), либо уже не найдет его и запишет заново.
+        """
+        full_path = self.path(name)
+        doomed = f'{full_path}.{uuid.uuid4().hex}.deleted'
+        try:
+            os.rename(full_path, doomed)
+        except FileNotFoundError:
+            return False
+        if os.path.getmtime(doomed) >= older_than:
+            os.replace(doomed, full_path)
+            return False
+        os.remove(doomed)
+        return True
+
+    def save_exact(self, name, content):
+        """Запись под заданным именем с перезаписью (для вариантов из main/images.py)."""
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+        # пишем рядом и переименовываем: читатель не увидит недописанный файл,
+        # а гонка двух одинаковых загрузок безопасна - содержимое совпадает
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+        else:
+            tmp_path = f'{full_path}.{uuid.uuid4().hex}.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in content.chunks():
+                        f.write(chunk)
+                os.replace(tmp_path, full_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+
+image_storage = ContentAddressedStorage()
+
+
+def get_image_storage():
+    # callable, чтобы в миграциях не было пути к MEDIA_ROOT
+    return image_storage
@@ -1,3 +1,1359 @@
-from django.test import TestCase
+import csv
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from urllib.parse import quote
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, router
+from django.http import HttpResponse
+from django.http.multipartparser import MultiPartParserError
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APITestCase
+
+from account.authentication import TokenCache, token_cache
+from blogApi.backends.postgresql_pool.pool import ConnectionPool, Database, PoolClosed, PoolTimeout
+
+from . import benchmarks, blobs, counters, images, search, serializers, trending, uploads
+from .cache import PostCache, post_cache
+from .fastserializers import FastSerializer
+from .middleware import ReplicaRoutingMiddleware
+from .models import Category, Comment, Favorites, ImageBlob, Like, Post, PostImages, PostRank
+from .storage import image_storage
+from .writebehind import ReactionBuffer
+
+
+class PostFeedQueryBudgetTest(APITestCase):
+    url = '/api/v1/posts/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='123456')
+        self.category = Category.objects.create(name='News')
+        patcher = mock.patch.object(post_cache, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_posts(self, count):
+        start = Post.objects.count()
+        for i in range(start, start + count):
+            author = User.objects.create_user(username=f'author{i}', password='123456')
+            post = Post.objects.create(title=f'Post {i}', body='text', owner=author, category=self.category)
+            PostImages.objects.create(post=post, image=f'images/{i}_1.jpeg')
+            PostImages.objects.create(post=post, image=f'images/{i}_2.jpeg')
+            Like.objects.create(post=post, owner=self.user)
+            if i % 2:
+                Favorites.objects.create(post=post, owner=self.user)
+
+    def test_anonymous_list_is_constant(self):
+        self.create_posts(1)
+        with self.assertNumQueries(2):  # COUNT(*) + страница
+            self.client.get(self.url)
+        self.create_posts(4)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_authenticated_list_is_constant(self):
+        self.client.force_authenticate(self.user)
+        self.create_posts(5)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        first = response.data['results'][0]
+        self.assertEqual(first['owner'], 'author0')
+        self.assertEqual(first['category'], 'News')
+        self.assertEqual(first['likes_count'], 1)
+        self.assertTrue(first['is_liked'])
+        self.assertFalse(first['is_favorited'])
+        self.assertTrue(first['image'].endswith('/media/images/0_1.jpeg'))
+
+
+class KeysetPaginationTest(APITestCase):
+
+    def setUp(self):
+        post_cache.backend.clear()
+        owner = User.objects.create_user(username='pager', password='123456')
+        posts = [Post.objects.create(title=f'Page {i}', owner=owner) for i in range(7)]
+        # одинаковый created_at у нескольких постов: порядок решает id
+        Post.objects.filter(pk__in=[post.pk for post in posts[1:5]]).update(created_at=posts[1].created_at)
+        self.ids = list(Post.objects.order_by('created_at', 'id').values_list('id', flat=True))
+
+    def walk(self, url, link='next'):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data[link]
+        return ids, pages
+
+    def test_cursor_round_trip_with_ties(self):
+        ids, pages = self.walk('/api/v1/posts/?pagination=cursor&page_size=2')
+        self.assertEqual(ids, self.ids)
+        self.assertEqual(len(pages), 4)
+        self.assertIsNone(pages[0]['previous'])
+        back, _ = self.walk(pages[-1]['previous'], link='previous')
+        # назад - те же страницы в обратном порядке, внутри страницы порядок прежний
+        self.assertEqual(back, self.ids[4:6] + self.ids[2:4] + self.ids[0:2])
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'eyJwIjpbXX0=', 'eyJwIjpbIm5vdCBhIGRhdGUiLDFdfQ=='):
+            self.assertEqual(self.client.get(f'/api/v1/posts/?cursor={cursor}').status_code, 404)
+
+    def test_count_param(self):
+        self.assertEqual(self.client.get('/api/v1/posts/?pagination=cursor').data['count'], 7)
+        self.assertNotIn('count', self.client.get('/api/v1/posts/?pagination=cursor&count=false').data)
+
+
+class SearchTest(APITestCase):
+    """Через API - проверяет индекс той базы, на которой идут тесты (FTS5 в SQLite, tsvector в Postgres)."""
+
+    def setUp(self):
+        owner = User.objects.create_user(username='searcher', password='123456')
+        self.in_title = Post.objects.create(title='Spider story', body='about a city', owner=owner)
+        self.in_body = Post.objects.create(title='Other story', body='a spider and one more spider', owner=owner)
+        Post.objects.create(title='Unrelated', body='nothing here', owner=owner)
+
+    def search(self, query):
+        response = self.client.get('/api/v1/posts/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_title_ranks_above_body(self):
+        results = self.search('spider')
+        self.assertEqual([item['id'] for item in results], [self.in_title.pk, self.in_body.pk])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+        self.assertIn(f'{search.HIGHLIGHT_START}spider{search.HIGHLIGHT_STOP}', results[1]['snippet'])
+
+    def test_prefix_and_all_terms(self):
+        self.assertEqual([item['id'] for item in self.search('spid')], [self.in_title.pk, self.in_body.pk])
+        self.assertEqual([item['id'] for item in self.search('spider city')], [self.in_title.pk])
+        self.assertEqual(self.client.get('/api/v1/posts/search/').status_code, 400)
+
+    def test_triggers_follow_updates_and_deletes(self):
+        self.in_title.title = 'Renamed web'
+        self.in_title.save()
+        self.assertEqual([item['id'] for item in self.search('web')], [self.in_title.pk])
+        self.assertEqual([item['id'] for item in self.search('spider')], [self.in_body.pk])
+        self.in_body.delete()
+        self.assertEqual(self.search('spider'), [])
+
+    def test_list_search_uses_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/posts/', {'search': 'spid'})
+        # порядок ленты, а не релевантности; body тоже ищется - ILIKE по title так не умел
+        self.assertEqual([item['id'] for item in response.data['results']], [self.in_title.pk, self.in_body.pk])
+        self.assertEqual(response.data['count'], 2)
+        self.assertFalse([query['sql'] for query in queries if ' LIKE ' in query['sql'].upper()])
+        self.assertEqual(self.client.get('/api/v1/posts/', {'search': '!!'}).data['count'], 3)
+
+    def test_like_baseline_is_search_filter(self):
+        queryset = Post.objects.order_by('id')
+        baseline = search.LikePostSearch().filter(queryset, 'spider, story')
+        self.assertEqual(str(baseline.query), str(queryset.filter(title__icontains='spider')
+                                                  .filter(title__icontains='story').query))
+        self.assertEqual(list(baseline), [self.in_title])
+
+    @skipUnless(connection.vendor == 'postgresql', 'tsvector only on PostgreSQL')
+    def test_postgres_search_vector(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT search_vector::text FROM main_post WHERE id = %s', [self.in_title.pk])
+            self.assertEqual(cursor.fetchone()[0], "'a':4B 'about':3B 'city':5B 'spider':1A 'story':2A")
+        self.assertEqual(search.PostgresPostSearch.to_tsquery(['spider', 'man']), 'spider:* & man:*')
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 only on SQLite')
+    def test_sqlite_fts_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rowid FROM main_post_fts WHERE main_post_fts MATCH 'spider' ORDER BY rowid")
+            self.assertEqual([row[0] for row in cursor.fetchall()], [self.in_title.pk, self.in_body.pk])
+        self.assertEqual(search.SqlitePostSearch.to_match(['spider', 'man']), '"spider"* "man"*')
+
+
+class PostCountersTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='counter', password='123456')
+        self.other = User.objects.create_user(username='counter2', password='123456')
+        self.post = Post.objects.create(title='Counted', owner=self.user)
+
+    def counts(self):
+        self.post.refresh_from_db()
+        return self.post.likes_count, self.post.comments_count, self.post.favorites_count
+
+    def test_signals_move_counters(self):
+        like = Like.objects.create(post=self.post, owner=self.user)
+        Like.objects.create(post=self.post, owner=self.other)
+        comment = Comment.objects.create(post=self.post, owner=self.user, body='one')
+        favorite = Favorites.objects.create(post=self.post, owner=self.other)
+        self.assertEqual(self.counts(), (2, 1, 1))
+        like.delete()
+        comment.delete()
+        favorite.delete()
+        self.assertEqual(self.counts(), (1, 0, 0))
+
+    def test_counters_never_go_below_zero(self):
+        like = Like.objects.create(post=self.post, owner=self.user)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=0)
+        like.delete()
+        counters.change_counter(Comment, self.post.pk, -5)
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_rebuild_command_fixes_corrupted_counters(self):
+        Like.objects.create(post=self.post, owner=self.user)
+        Comment.objects.create(post=self.post, owner=self.user, body='one')
+        untouched = Post.objects.create(title='Untouched', owner=self.user)
+        Post.objects.update(likes_count=7, comments_count=0, favorites_count=3)
+        out = StringIO()
+        call_command('rebuild_post_counters', str(self.post.pk), stdout=out)
+        self.assertIn('Пересчитано постов: 1', out.getvalue())
+        self.assertEqual(self.counts(), (1, 1, 0))
+        self.assertEqual(Post.objects.get(pk=untouched.pk).likes_count, 7)
+        call_command('rebuild_post_counters', stdout=StringIO())
+        self.assertEqual(Post.objects.get(pk=untouched.pk).likes_count, 0)
+
+
+class PostCacheTest(APITestCase):
+
+    def setUp(self):
+        post_cache.backend.clear()
+        self.user = User.objects.create_user(username='reader', password='123456')
+        self.post = Post.objects.create(title='Cached', body='text', owner=self.user)
+
+    def test_anonymous_hit_skips_database(self):
+        self.client.get('/api/v1/posts/')
+        self.client.get(f'/api/v1/posts/{self.post.pk}/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/posts/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        with self.assertNumQueries(0):
+            self.client.get(f'/api/v1/posts/{self.post.pk}/')
+
+    def test_like_invalidates_post_and_list(self):
+        self.client.get(f'/api/v1/posts/{self.post.pk}/')
+        self.client.get('/api/v1/posts/')
+        Like.objects.create(post=self.post, owner=self.user)
+        detail = self.client.get(f'/api/v1/posts/{self.post.pk}/')
+        feed = self.client.get('/api/v1/posts/')
+        self.assertEqual(detail['X-Cache'], 'MISS')
+        self.assertEqual(detail.data['likes_count'], 1)
+        self.assertEqual(feed.data['results'][0]['likes_count'], 1)
+
+    def test_detail_variants_are_normalized_and_whitelisted(self):
+        url = f'/api/v1/posts/{self.post.pk}/'
+        self.assertEqual(self.client.get(url, {'fields': 'id,title'})['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url, {'fields': 'title, id'})['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        # произвольные параметры не плодят варианты в кэше
+        for _ in range(2):
+            response = self.client.get(url, {'utm_source': 'mail'})
+            self.assertEqual((response.status_code, response['X-Cache']), (200, 'MISS'))
+        Like.objects.create(post=self.post, owner=self.user)
+        self.assertEqual(self.client.get(url, {'fields': 'id,title'})['X-Cache'], 'MISS')
+
+    def test_like_keeps_other_pages_cached(self):
+        other = Post.objects.create(title='Other', body='text', owner=self.user)
+        self.client.get('/api/v1/posts/')
+        self.client.get(f'/api/v1/posts/?search={other.title}')
+        Like.objects.create(post=self.post, owner=self.user)
+        with self.assertNumQueries(0):
+            untouched = self.client.get(f'/api/v1/posts/?search={other.title}')
+        self.assertEqual(untouched['X-Cache'], 'HIT')
+        feed = self.client.get('/api/v1/posts/')
+        self.assertEqual(feed['X-Cache'], 'MISS')
+        self.assertEqual(next(item for item in feed.data['results'] if item['id'] == self.post.pk)['likes_count'], 1)
+
+    def test_like_changes_list_etag(self):
+        etag = self.client.get('/api/v1/posts/')['ETag']
+        Like.objects.create(post=self.post, owner=self.user)
+        response = self.client.get('/api/v1/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_user_flags_are_not_cached(self):
+        Like.objects.create(post=self.post, owner=self.user)
+        self.client.get('/api/v1/posts/')
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/posts/')
+        self.assertTrue(response.data['results'][0]['is_liked'])
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/v1/posts/')
+        self.assertFalse(response.data['results'][0]['is_liked'])
+
+
+class EndpointBudgetTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_data', users=20, posts=30, stdout=StringIO())
+
+    def test_all_endpoints_within_query_budget(self):
+        results = benchmarks.run(iterations=2)
+        self.assertEqual(set(results), {endpoint.name for endpoint in benchmarks.ENDPOINTS})
+        self.assertEqual(benchmarks.check(results), [])
+
+    def test_every_route_has_budget(self):
+        self.assertEqual(benchmarks.missing_budgets(), [])
+        self.assertIn('api/v1/async/categories/', benchmarks.routes())
+        endpoints = [endpoint for endpoint in benchmarks.ENDPOINTS if not endpoint.path.startswith('/api/v1/async/')]
+        self.assertEqual(len(benchmarks.missing_budgets(endpoints)), 4)
+
+    def test_regression_against_baseline(self):
+        results = {'posts-list': {'queries': 3, 'budget': 3, 'p95_ms': 10.0, 'statuses': [200]}}
+        baseline = {'posts-list': {'queries': 2, 'p95_ms': 2.0}}
+        self.assertEqual(len(benchmarks.check(results, baseline)), 2)
+
+
+class ContentAddressedStorageTest(APITestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media = media.name
+        self.user = User.objects.create_user(username='uploader', password='123456')
+        self.client.force_authenticate(self.user)
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        self.content = buffer.getvalue()
+
+    def upload(self, title, count=1):
+        images = [SimpleUploadedFile(f'copy{i}.png', self.content, 'image/png') for i in range(count)]
+        response = self.client.post('/api/v1/posts/', {'title': title, 'body': 'x', 'images': images},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Post.objects.get(title=title)
+
+    def stored_files(self):
+        return [name for path, _, files in os.walk(self.media) if 'variants' not in path for name in files]
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload('first', count=2)
+        second = self.upload('second')
+        names = set(PostImages.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(ImageBlob.objects.get(name=names.pop()).refcount, 3)
+
+        first.delete()
+        self.assertEqual(blobs.collect(grace=0), ([], 0))
+        self.assertEqual(len(self.stored_files()), 1)
+
+        second.delete()
+        deleted, freed = blobs.collect(grace=0)
+        self.assertEqual(len(deleted), 1)
+        self.assertEqual(freed, len(self.content))
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_reupload_during_collect_keeps_file(self):
+        self.upload('first').delete()
+        blob = ImageBlob.objects.get()
+        old = time.time() - 7200
+        os.utime(image_storage.path(blob.name), (old, old))
+        ImageBlob.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+        orphan_files = blobs._orphan_files
+
+        def reupload_then_walk(*args):
+            # кандидаты уже выбраны - тот же файл загружают снова
+            self.upload('again')
+            return orphan_files(*args)
+
+        with mock.patch.object(blobs, '_orphan_files', reupload_then_walk):
+            self.assertEqual(blobs.collect(), ([], 0))
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+
+    def test_delete_if_stale_spares_touched_file(self):
+        name = image_storage.save('images/a.png', BytesIO(self.content))
+        self.assertFalse(image_storage.delete_if_stale(name, time.time() - 60))
+        self.assertTrue(image_storage.exists(name))
+        self.assertTrue(image_storage.delete_if_stale(name, time.time() + 60))
+        self.assertFalse(image_storage.exists(name))
+
+
+class ImageVariantsTest(APITestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        images._ready.clear()
+        post_cache.backend.clear()
+        self.user = User.objects.create_user(username='painter', password='123456')
+        buffer = BytesIO()
+        Image.new('RGB', (400, 300), 'blue').save(buffer, 'PNG')
+        self.name = image_storage.save('images/blue.png', ContentFile(buffer.getvalue()))
+        self.post = Post.objects.create(title='Blue', owner=self.user, preview=self.name)
+
+    def test_variant_names_keep_extension(self):
+        self.assertNotEqual(images.variant_name('images/a.png', 'thumbnail'),
+                            images.variant_name('images/a.jpg', 'thumbnail'))
+
+    def test_urls_come_from_recorded_variants(self):
+        with mock.patch.object(image_storage, 'exists', side_effect=AssertionError('exists() called')):
+            self.assertEqual(set(images.variant_urls(self.name, image_storage).values()),
+                             {image_storage.url(self.name)})
+        images.generate_variants(self.name, image_storage)
+        self.assertEqual(ImageBlob.objects.get(name=self.name).variants, sorted(images.get_variants()))
+        images._ready.clear()
+        with mock.patch.object(image_storage, 'exists', side_effect=AssertionError('exists() called')):
+            urls = images.variant_urls(self.name, image_storage)
+        self.assertEqual(urls['thumbnail'], image_storage.url(images.variant_name(self.name, 'thumbnail')))
+
+    def test_post_list_serializer_batches_lookups(self):
+        for i in range(3):
+            Post.objects.create(title=f'Blue {i}', owner=self.user, preview=self.name)
+        with self.assertNumQueries(2):  # посты + ImageBlob одним запросом
+            data = serializers.PostListSerializer(Post.objects.all(), many=True).data
+        self.assertEqual(len(data), 4)
+
+    async def test_cold_async_detail(self):
+        await sync_to_async(PostImages.objects.create)(post=self.post, image=self.name)
+        await sync_to_async(images.generate_variants)(self.name, image_storage)
+        images._ready.clear()
+        response = await self.async_client.get(f'/api/v1/async/posts/{self.post.pk}/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertIn('/variants/', data['preview_variants']['thumbnail'])
+        self.assertIn('/variants/', data['images'][0]['image_variants']['thumbnail'])
+
+    def test_worker_returns_connection(self):
+        with mock.patch('main.images.connections') as connections, self.assertLogs('main.images', 'ERROR'):
+            images._run(mock.Mock(side_effect=OSError), self.name, image_storage)
+        connections.close_all.assert_called_once_with()
+
+    def test_feed_reads_variants_in_the_same_query(self):
+        images.generate_variants(self.name, image_storage)
+        images._ready.clear()
+        with mock.patch.object(post_cache, 'enabled', False), self.assertNumQueries(2):
+            response = self.client.get('/api/v1/posts/')
+        self.assertIn('/variants/', response.data['results'][0]['preview_variants']['webp'])
+
+
+class StreamingUploadTest(APITestCase):
+
+    def setUp(self):
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        self.content = buffer.getvalue()
+
+    def start(self):
+        """Загрузка, у которой парсер успел отдать один чанк и пропал."""
+        handler = uploads.StreamingImageUploadHandler()
+        try:
+            handler.new_file('images', 'a.png', 'image/png', None)
+        except uploads.StopFutureHandlers:
+            pass
+        handler.receive_data_chunk(self.content[:16], 0)
+        return handler
+
+    def test_abandoned_uploads_do_not_block_new_ones(self):
+        abandoned = [self.start() for _ in range(8)]
+        handler = self.start()
+        handler.receive_data_chunk(self.content[16:], 16)
+        uploaded = handler.file_complete(len(self.content))
+        self.assertTrue(uploaded.done.wait(3))
+        self.assertIsNone(uploaded.error)
+        self.assertEqual(uploaded.image_size, (8, 8))
+
+        writers = [handler.writer for handler in abandoned]
+        for handler in abandoned:
+            handler.upload_interrupted()
+        for writer in writers:
+            writer.thread.join(3)
+            self.assertFalse(writer.thread.is_alive())
+
+    @override_settings(IMAGE_UPLOAD={'IDLE_TIMEOUT': 0.05, 'WAIT_TIMEOUT': 0.05})
+    def test_idle_writer_gives_up(self):
+        writer = self.start().writer
+        writer.thread.join(3)
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(writer.uploaded.error, 'Upload timed out')
+
+        budget = uploads.MemoryBudget(10, timeout=0.05)
+        self.assertTrue(budget.acquire(8))
+        self.assertFalse(budget.acquire(8))
+
+    def test_interrupted_request_stops_writer(self):
+        user = User.objects.create_user(username='uploader')
+        self.client.force_authenticate(user)
+        writers = []
+        original = uploads.StreamingImageUploadHandler.receive_data_chunk
+
+        def receive_and_break(handler, raw_data, start):
+            original(handler, raw_data, start)
+            writers.append(handler.writer)
+            raise MultiPartParserError('connection lost')
+
+        image = SimpleUploadedFile('a.png', self.content, 'image/png')
+        with mock.patch.object(uploads.StreamingImageUploadHandler, 'receive_data_chunk', receive_and_break):
+            response = self.client.post('/api/v1/posts/', {'title': 't', 'body': 'x', 'images': [image]},
+                                        format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(writers), 1)
+        writers[0].thread.join(3)
+        self.assertFalse(writers[0].thread.is_alive())
+        self.assertFalse(Post.objects.exists())
+
+
+class CategoryTreeTest(APITestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(post_cache, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='writer', password='123456')
+        self.root = Category.objects.create(name='Root')
+        self.child = Category.objects.create(name='Child', parent=self.root)
+        self.leaf = Category.objects.create(name='Leaf', parent=self.child)
+        self.other = Category.objects.create(name='Other')
+        for category in (self.root, self.child, self.leaf, self.other):
+            Post.objects.create(title=f'In {category.name}', owner=self.user, category=category)
+
+    def titles(self, category):
+        with self.assertNumQueries(2):  # COUNT(*) + страница
+            response = self.client.get('/api/v1/posts/', {'category_tree': category.pk})
+        return {post['title'] for post in response.data['results']}
+
+    def test_subtree_filter(self):
+        self.assertEqual(self.titles(self.root), {'In Root', 'In Child', 'In Leaf'})
+        self.assertEqual(self.titles(self.child), {'In Child', 'In Leaf'})
+        self.assertEqual(str(self.leaf), 'Leaf --> Child --> Root')
+        # диапазон путей верен только при побайтовом сравнении, не при collation базы
+        self.assertIn('COLLATE', str(Category.objects.subtree(self.root.path).query))
+
+    def test_move_subtree(self):
+        self.child.parent = self.other
+        self.child.save()
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.path, f'{self.other.pk}/{self.child.pk}/{self.leaf.pk}/')
+        self.assertEqual(self.leaf.depth, 2)
+        self.assertEqual(self.titles(self.other), {'In Other', 'In Child', 'In Leaf'})
+        self.root.parent = self.root
+        with self.assertRaises(ValueError):
+            self.root.save()
+
+    def test_nested_tree_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/categories/', {'tree': 'true'})
+        root = next(node for node in response.data if node['name'] == 'Root')
+        self.assertEqual(root['children'][0]['name'], 'Child')
+        self.assertEqual(root['children'][0]['children'][0]['name'], 'Leaf')
+
+
+class PostCommentsTest(APITestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(post_cache, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.post = Post.objects.create(title='Viral', owner=User.objects.create_user(username='star'))
+        for i in range(25):
+            Comment.objects.create(post=self.post, body=f'comment {i}',
+                                   owner=User.objects.create_user(username=f'fan{i}'))
+
+    @override_settings(POST_DETAIL_COMMENTS=3)
+    def test_detail_embeds_newest_comments(self):
+        with self.assertNumQueries(4):  # changed_at для ETag, пост, картинки, комментарии с авторами
+            response = self.client.get(f'/api/v1/posts/{self.post.pk}/')
+        self.assertEqual([c['body'] for c in response.data['comments']], ['comment 24', 'comment 23', 'comment 22'])
+        self.assertEqual(response.data['comments_count'], 25)
+
+    def test_comments_keyset_pages(self):
+        url, bodies = f'/api/v1/posts/{self.post.pk}/comments/', []
+        while url:
+            with self.assertNumQueries(2):  # пост + страница комментариев с авторами
+                response = self.client.get(url)
+            self.assertEqual(response.data['count'], 25)
+            bodies += [c['body'] for c in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(bodies, [f'comment {i}' for i in reversed(range(25))])
+
+
+class UserFavoritesTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='collector', password='123456')
+        owner = User.objects.create_user(username='blogger')
+        for i in range(30):
+            # у части постов превью: варианты читаются в том же запросе (main/images.py)
+            post = Post.objects.create(title=f'Fav {i}', owner=owner, preview=f'images/fav{i}.jpeg' if i % 2 else None)
+            Favorites.objects.create(post=post, owner=self.user)
+        ImageBlob.objects.filter(name='images/fav29.jpeg').update(variants=sorted(images.get_variants()))
+        images._ready.clear()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(USER_DETAIL_FAVORITES=5)
+    def test_detail_favorites_are_capped(self):
+        with self.assertNumQueries(4):  # юзер, groups, user_permissions, избранные с постами
+            response = self.client.get(f'/api/v1/accounts/{self.user.pk}/')
+        self.assertEqual([f['post']['title'] for f in response.data['favorites']],
+                         [f'Fav {i}' for i in range(29, 24, -1)])
+        self.assertIn('/variants/', response.data['favorites'][0]['post']['preview_variants']['thumbnail'])
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/v1/accounts/{self.user.pk}/', {'favorites': 0})
+        self.assertNotIn('favorites', response.data)
+
+    def test_favorites_endpoint_pages(self):
+        url, titles = f'/api/v1/accounts/{self.user.pk}/favorites/', []
+        while url:
+            with self.assertNumQueries(2):  # COUNT(*) + страница с постами
+                response = self.client.get(url)
+            titles += [f['post']['title'] for f in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(titles, [f'Fav {i}' for i in reversed(range(30))])
+
+    def test_favorites_of_other_user_are_forbidden(self):
+        other = User.objects.get(username='blogger')
+        self.assertEqual(self.client.get(f'/api/v1/accounts/{other.pk}/favorites/').status_code, 403)
+
+
+class ReactionsTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='fan', password='123456')
+        owner = User.objects.create_user(username='author')
+        self.posts = [Post.objects.create(title=f'Reacted {i}', owner=owner) for i in range(3)]
+        self.client.force_authenticate(self.user)
+
+    def test_like_twice_does_not_fail(self):
+        url = f'/api/v1/posts/{self.posts[0].pk}/add_like/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].likes_count, 1)
+        self.assertEqual(self.client.post(f'/api/v1/posts/{self.posts[0].pk}/remove_like/').status_code, 204)
+        self.assertEqual(self.client.post(f'/api/v1/posts/{self.posts[0].pk}/remove_like/').status_code, 400)
+        self.assertEqual(self.client.post('/api/v1/posts/999999/add_like/').status_code, 404)
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].likes_count, 0)
+
+    def test_bulk_reactions(self):
+        Favorites.objects.create(post=self.posts[2], owner=self.user)
+        response = self.client.post('/api/v1/posts/reactions/', {'reactions': [
+            {'post': self.posts[0].pk, 'type': 'like', 'value': True},
+            {'post': self.posts[1].pk, 'type': 'like', 'value': True},
+            {'post': self.posts[1].pk, 'type': 'favorite', 'value': True},
+            {'post': self.posts[2].pk, 'type': 'favorite', 'value': False},
+            {'post': 999999, 'type': 'like', 'value': True},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['like'], {'added': [self.posts[0].pk, self.posts[1].pk], 'removed': []})
+        self.assertEqual(response.data['favorite'], {'added': [self.posts[1].pk], 'removed': [self.posts[2].pk]})
+        counters = dict(Post.objects.filter(pk__in=[p.pk for p in self.posts]).values_list('pk', 'favorites_count'))
+        self.assertEqual(counters, {self.posts[0].pk: 0, self.posts[1].pk: 1, self.posts[2].pk: 0})
+
+
+class WriteBehindReactionsTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='fan', password='123456')
+        owner = User.objects.create_user(username='author')
+        self.posts = [Post.objects.create(title=f'Buffered {i}', owner=owner) for i in range(2)]
+        self.client.force_authenticate(self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.buffer = ReactionBuffer({
+            'ENABLED': True, 'PATH': os.path.join(directory.name, 'reactions.sqlite3'), 'FLUSH_INTERVAL': 0,
+        })
+        for target in ('main.views.reaction_buffer', 'main.serializers.reaction_buffer'):
+            patcher = mock.patch(target, self.buffer)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_pending_like_is_visible_before_flush(self):
+        post = self.posts[0]
+        url = f'/api/v1/posts/{post.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.post(f'{url}add_like/').status_code, 201)
+        self.assertEqual(self.client.post(f'{url}add_like/').status_code, 400)
+        self.assertFalse(Like.objects.exists())
+
+        response = self.client.get(url)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue(response.data['is_liked'])
+        self.assertEqual(response.data['likes_count'], 1)
+        item = next(item for item in self.client.get('/api/v1/posts/').data['results'] if item['id'] == post.pk)
+        self.assertEqual((item['is_liked'], item['likes_count']), (True, 1))
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertTrue(Like.objects.filter(post=post, owner=self.user).exists())
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 1)
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+        response = self.client.get(url)
+        self.assertEqual((response.data['is_liked'], response.data['likes_count']), (True, 1))
+
+    def test_flush_keeps_last_state(self):
+        first, second = self.posts
+        Favorites.objects.create(post=second, owner=self.user)
+        self.assertEqual(self.client.post(f'/api/v1/posts/{first.pk}/add_like/').status_code, 201)
+        self.assertEqual(self.client.post(f'/api/v1/posts/{first.pk}/remove_like/').status_code, 204)
+        self.assertEqual(self.client.post(f'/api/v1/posts/{first.pk}/favorite_posts/').status_code, 201)
+        self.assertEqual(self.client.post(f'/api/v1/posts/{second.pk}/favorite_posts/').status_code, 204)
+        self.assertEqual(self.client.post('/api/v1/posts/999999/add_like/').status_code, 404)
+
+        rows = self.buffer.db().execute('SELECT id, kind, user_id, post_id, value FROM pending ORDER BY id').fetchall()
+        self.assertEqual(self.buffer.flush(), 4)
+        # повтор пачки (упали между коммитом и очисткой буфера) ничего не меняет
+        self.buffer.write(rows)
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(list(Favorites.objects.values_list('post_id', flat=True)), [first.pk])
+        counters = dict(Post.objects.values_list('pk', 'favorites_count'))
+        self.assertEqual(counters, {first.pk: 1, second.pk: 0})
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_bulk_reactions_all_or_nothing(self):
+        first, second = self.posts
+        payload = {'reactions': [{'post': first.pk, 'type': 'like', 'value': True},
+                                 {'post': second.pk, 'type': 'favorite', 'value': True}]}
+        busy = [{}, sqlite3.OperationalError('database is locked')]
+        with mock.patch.object(self.buffer, 'pending_state', side_effect=busy):
+            response = self.client.post('/api/v1/posts/reactions/', payload, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+
+        response = self.client.post('/api/v1/posts/reactions/', payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['like'], {'added': [first.pk], 'removed': []})
+        self.assertEqual(response.data['favorite'], {'added': [second.pk], 'removed': []})
+        self.assertEqual(self.buffer.stats()['pending'], 2)
+
+    def test_pending_favorites_in_user_lists(self):
+        first, second = self.posts
+        Favorites.objects.create(post=first, owner=self.user)
+        self.client.post(f'/api/v1/posts/{first.pk}/favorite_posts/')  # снято
+        self.client.post(f'/api/v1/posts/{second.pk}/favorite_posts/')  # добавлено
+        self.assertEqual(Favorites.objects.get().post_id, first.pk)
+
+        response = self.client.get(f'/api/v1/accounts/{self.user.pk}/favorites/')
+        self.assertEqual([item['post']['id'] for item in response.data['results']], [second.pk])
+        response = self.client.get(f'/api/v1/accounts/{self.user.pk}/')
+        self.assertEqual([item['post']['id'] for item in response.data['favorites']], [second.pk])
+
+        self.buffer.flush()
+        response = self.client.get(f'/api/v1/accounts/{self.user.pk}/favorites/')
+        self.assertEqual([item['post']['id'] for item in response.data['results']], [second.pk])
+
+    def test_flush_lease(self):
+        self.client.post(f'/api/v1/posts/{self.posts[0].pk}/add_like/')
+        db = self.buffer.db()
+        db.execute("INSERT OR REPLACE INTO flusher (id, owner, expires) VALUES (1, 'other', 1e12)")
+        self.assertEqual(self.buffer.flush(), 0)
+        db.execute('UPDATE flusher SET expires = 0')
+        self.assertEqual(self.buffer.flush(), 1)
+
+
+class AsyncViewsTest(APITestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(post_cache, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # варианты картинок не должны быть в памяти процесса: async view загружает их сам
+        images._ready.clear()
+        self.user = User.objects.create_user(username='async', password='123456')
+        self.token = Token.objects.create(user=self.user)
+        root = Category.objects.create(name='Async root')
+        Category.objects.create(name='Async child', parent=root)
+        self.post = Post.objects.create(title='Async post', owner=self.user, category=root,
+                                        preview='images/async_preview.jpeg')
+        PostImages.objects.create(post=self.post, image='images/async.jpeg')
+        for i in range(3):
+            Comment.objects.create(post=self.post, owner=self.user, body=f'async {i}')
+        Like.objects.create(post=self.post, owner=self.user)
+
+    async def test_same_data_as_sync_views(self):
+        pairs = (
+            (f'/api/v1/posts/{self.post.pk}/', f'/api/v1/async/posts/{self.post.pk}/'),
+            (f'/api/v1/posts/{self.post.pk}/comments/', f'/api/v1/async/posts/{self.post.pk}/comments/'),
+            ('/api/v1/posts/?pagination=cursor', '/api/v1/async/posts/'),
+            ('/api/v1/categories/?tree=true', '/api/v1/async/categories/?tree=true'),
+            (f'/api/v1/posts/{self.post.pk}/?fields=title,images', f'/api/v1/async/posts/{self.post.pk}/?fields=title,images'),
+            ('/api/v1/posts/?pagination=cursor&fields=id,is_liked', '/api/v1/async/posts/?fields=id,is_liked'),
+        )
+        headers = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        for sync_url, async_url in pairs:
+            # async первым, на холодной памяти вариантов
+            images._ready.clear()
+            response = await self.async_client.get(async_url, authorization=f'Token {self.token.key}')
+            self.assertEqual(response.status_code, 200)
+            expected = (await sync_to_async(self.client.get)(sync_url, **headers)).json()
+            self.assertEqual(response.json(), expected, async_url)
+
+    async def test_errors(self):
+        self.assertEqual((await self.async_client.get('/api/v1/async/posts/999999/')).status_code, 404)
+        # AsyncClient в Django 4.1 принимает заголовки в виде имя=значение
+        response = await self.async_client.get('/api/v1/async/posts/', authorization='Token nope')
+        self.assertEqual(response.status_code, 401)
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cached', password='123456')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = f'/api/v1/accounts/{self.user.pk}/favorites/'
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        return response, [q['sql'] for q in queries if 'authtoken_token' in q['sql']]
+
+    def test_token_lookup_cached(self):
+        response, first = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(first), 1)
+        response, second = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(second, [])
+
+    def test_logout_invalidates(self):
+        self.token_queries()
+        self.assertEqual(self.client.post('/api/v1/accounts/logout/').status_code, 200)
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivation_invalidates(self):
+        self.token_queries()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_logout_invalidates_other_workers(self):
+        # второй воркер - свой экземпляр TokenCache над тем же кэшем
+        other = TokenCache(settings.TOKEN_CACHE)
+        self.token_queries()
+        self.assertIsNotNone(other.get(self.token.key))
+        self.assertEqual(self.client.post('/api/v1/accounts/logout/').status_code, 200)
+        self.assertIsNone(other.get(self.token.key))
+
+    def test_cache_holds_no_password(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.token_queries()
+        cached = token_cache.backend.get(token_cache.key(self.token.key))
+        self.assertEqual(cached, (self.user.pk, 'cached', True, True))
+        user = token_cache.get(self.token.key).user
+        self.assertEqual((user.pk, user.username, user.is_staff, user.is_active), cached)
+        self.assertIn('password', user.get_deferred_fields())
+        # остальные поля - отдельным запросом по pk, как у .only()
+        with self.assertNumQueries(1):
+            self.assertEqual(user.date_joined, self.user.date_joined)
+
+    def test_local_backend_is_short_lived(self):
+        local = TokenCache({'BACKEND': 'lru', 'TIMEOUT': 300})
+        self.assertLessEqual(local.backend.timeout, 5)
+
+
+class QueryInstrumentationTest(APITestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(post_cache, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Post.objects.create(title='Timed', owner=User.objects.create_user(username='timer', password='123456'))
+
+    def test_disabled_by_default(self):
+        with self.assertNoLogs('main.sql', 'DEBUG'):
+            response = self.client.get('/api/v1/posts/')
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(QUERY_INSTRUMENTATION={'ENABLED': True})
+    def test_server_timing_and_query_count(self):
+        with self.assertLogs('main.sql', 'DEBUG') as logs:
+            response = self.client.get('/api/v1/posts/')
+        # COUNT(*) + страница
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries", total;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((logs.records[0].levelname, record['queries'], record['status']), ('DEBUG', 2, 200))
+        self.assertEqual(len(record['slowest']), 2)
+
+    @override_settings(QUERY_INSTRUMENTATION={'ENABLED': True})
+    def test_only_slow_requests_are_warnings(self):
+        with self.assertNoLogs('main.sql', 'WARNING'):
+            self.client.get('/api/v1/posts/')
+        with override_settings(QUERY_INSTRUMENTATION={'ENABLED': True, 'SLOW_REQUEST_MS': 0}):
+            self.client = self.client_class()
+            with self.assertLogs('main.sql', 'WARNING'):
+                self.client.get('/api/v1/posts/')
+
+
+@override_settings(DATABASE_REPLICAS={'REPLICAS': ['replica'], 'PIN_SECONDS': 5})
+class ReplicaRoutingTest(APITestCase):
+    """Роутер без настоящей второй базы: view только спрашивает, куда пошло бы чтение."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+        def view(request):
+            if request.method == 'POST':
+                router.db_for_write(Post)
+            return HttpResponse(router.db_for_read(Post))
+
+        self.middleware = ReplicaRoutingMiddleware(view)
+
+    def read_db(self, request):
+        response = self.middleware(request)
+        return response.content.decode(), response
+
+    def test_safe_requests_read_from_replica(self):
+        self.assertEqual(self.read_db(self.factory.get('/'))[0], 'replica')
+        self.assertEqual(router.db_for_read(Post), 'default')  # вне запроса - всегда default
+        self.assertEqual(router.db_for_write(Post), 'default')
+
+    def test_cookie_pins_after_write(self):
+        db, response = self.read_db(self.factory.post('/'))
+        self.assertEqual(db, 'default')
+        cookie = response.cookies['primary_until']
+        self.assertEqual(cookie['max-age'], 5)
+        request = self.factory.get('/')
+        request.COOKIES['primary_until'] = cookie.value
+        self.assertEqual(self.read_db(request)[0], 'default')
+
+    def test_authorization_pins_after_write(self):
+        self.read_db(self.factory.post('/', HTTP_AUTHORIZATION='Token pinned'))
+        self.assertEqual(self.read_db(self.factory.get('/', HTTP_AUTHORIZATION='Token pinned'))[0], 'default')
+        self.assertEqual(self.read_db(self.factory.get('/', HTTP_AUTHORIZATION='Token other'))[0], 'replica')
+
+    def test_cache_is_filled_from_primary(self):
+        # иначе строка с отстающей реплики попала бы в кэш уже после его сброса
+        cache = PostCache({'BACKEND': 'lru'})
+
+        def view(request):
+            data, _ = cache.get_post(1, request, lambda: router.db_for_read(Post))
+            return HttpResponse(f'{router.db_for_read(Post)} {data}')
+
+        self.assertEqual(ReplicaRoutingMiddleware(view)(self.factory.get('/')).content.decode(), 'replica default')
+
+
+class FakeConnection:
+    """Минимум интерфейса psycopg2 connection, который нужен пулу."""
+
+    def __init__(self):
+        self.closed = 0
+        self.status = 0
+        self.rolled_back = False
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rolled_back = True
+        self.status = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(APITestCase):
+
+    def test_reuse_and_rollback(self):
+        pool = ConnectionPool(FakeConnection, max_size=2)
+        first = pool.getconn()
+        first.status = 2  # INTRANS
+        pool.putconn(first)
+        self.assertTrue(first.rolled_back)
+        self.assertIs(pool.getconn(), first)
+        snapshot = pool.snapshot()
+        self.assertEqual((snapshot['created'], snapshot['checkouts'], snapshot['in_use']), (1, 2, 1))
+
+    def test_broken_connections_discarded(self):
+        pool = ConnectionPool(FakeConnection)
+        broken = pool.getconn()
+        pool.putconn(broken)
+        broken.closed = 1
+        fresh = pool.getconn()
+        self.assertIsNot(fresh, broken)
+        self.assertEqual(pool.snapshot()['failed_checks'], 1)
+        fresh.status = 4  # UNKNOWN: соединение потеряно
+        pool.putconn(fresh)
+        self.assertTrue(fresh.closed)
+        self.assertEqual(pool.snapshot()['size'], 0)
+
+    def test_saturation_wait_and_timeout(self):
+        pool = ConnectionPool(FakeConnection, max_size=1, timeout=0.05)
+        held = pool.getconn()
+        self.assertEqual(pool.snapshot()['saturation'], 1.0)
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        threading.Timer(0.01, pool.putconn, [held]).start()
+        pool.timeout = 5
+        self.assertIs(pool.getconn(), held)
+        snapshot = pool.snapshot()
+        self.assertEqual((snapshot['timeouts'], snapshot['waits']), (1, 1))
+        self.assertGreater(snapshot['wait_ms_max'], 0)
+
+    def test_idle_eviction_keeps_min_size(self):
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=3, max_idle=0)
+        connections = [pool.getconn() for _ in range(3)]
+        for connection in connections:
+            pool.putconn(connection)
+        snapshot = pool.snapshot()
+        self.assertEqual((snapshot['size'], snapshot['evicted']), (1, 2))
+        self.assertEqual(sum(connection.closed for connection in connections), 2)
+
+
+    def test_close_discards_checked_out_connections(self):
+        pool = ConnectionPool(FakeConnection, max_size=2)
+        idle, held = pool.getconn(), pool.getconn()
+        pool.putconn(idle)
+        pool.close()
+        self.assertTrue(idle.closed)
+        self.assertFalse(held.closed)
+        pool.putconn(held)
+        self.assertTrue(held.closed)
+        self.assertEqual(pool.snapshot()['size'], 0)
+        with self.assertRaises(PoolClosed):
+            pool.getconn()
+        self.assertTrue(issubclass(PoolTimeout, Database.OperationalError))
+
+
+class BulkImportTest(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='importer', password='123456', is_staff=True)
+        self.author = User.objects.create_user(username='author', password='123456')
+        self.category = Category.objects.create(name='Imported')
+        Post.objects.create(title='Existing', owner=self.author)
+
+    def ndjson(self, *rows):
+        return '\n'.join(row if isinstance(row, str) else json.dumps(row) for row in rows).encode()
+
+    def test_import_endpoint(self):
+        body = self.ndjson(
+            {'type': 'post', 'title': 'First', 'owner': 'author', 'category': 'Imported', 'images': ['images/a.jpeg']},
+            {'type': 'post', 'title': 'Second', 'category': self.category.pk},
+            {'type': 'comment', 'post': 'First', 'owner': 'author', 'body': 'hi'},
+            {'type': 'like', 'post': 'First', 'owner': 'author'},
+            {'type': 'like', 'post': 'First', 'owner': 'author'},
+            {'type': 'favorite', 'post': 'Second'},
+            {'type': 'post', 'title': 'Existing'},
+            {'type': 'comment', 'post': 'Missing', 'owner': 'nobody', 'body': 'x'},
+            'not json',
+        )
+        url = '/api/v1/posts/import/?batch_size=3'
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.post(url, body, content_type='application/x-ndjson').status_code, 403)
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], {'post': 2, 'comment': 1, 'like': 1, 'favorite': 1})
+        self.assertEqual([error['line'] for error in response.data['errors']], [7, 8, 9])
+        self.assertEqual(set(response.data['errors'][1]['errors']), {'post', 'owner'})
+
+        first = Post.objects.get(title='First')
+        self.assertEqual((first.owner, first.category, first.likes_count, first.comments_count),
+                         (self.author, self.category, 1, 1))
+        self.assertEqual(Post.objects.get(title='Second').favorites_count, 1)
+        self.assertEqual(Post.objects.get(title='Second').owner, self.admin)
+        self.assertEqual(ImageBlob.objects.get(name='images/a.jpeg').refcount, 1)
+
+    def test_existing_reactions_and_numeric_titles(self):
+        numeric = Post.objects.create(title='2022', owner=self.author)
+        Like.objects.create(post=numeric, owner=self.author)
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/api/v1/posts/import/', self.ndjson(
+            {'type': 'like', 'post': '2022', 'owner': 'author'},
+            {'type': 'like', 'post': '2022', 'owner': self.admin.pk},
+            {'type': 'favorite', 'post': numeric.pk, 'owner': 'author'},
+        ), content_type='application/x-ndjson')
+        self.assertEqual(response.data['error_count'], 0)
+        self.assertEqual(response.data['created'], {'post': 0, 'comment': 0, 'like': 1, 'favorite': 1})
+        self.assertEqual(Post.objects.get(pk=numeric.pk).likes_count, 2)
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as f:
+            f.write(self.ndjson({'type': 'post', 'title': 'From file', 'owner': self.author.pk}))
+            f.flush()
+            out = StringIO()
+            call_command('import_posts', f.name, stdout=out)
+        self.assertIn('post=1', out.getvalue())
+        self.assertTrue(Post.objects.filter(title='From file', owner=self.author).exists())
+
+
+class ExportTest(APITestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='exporter', password='123456', is_staff=True)
+        self.client.force_authenticate(self.admin)
+        self.old = Post.objects.create(title='Old', owner=self.admin)
+        Post.objects.filter(pk=self.old.pk).update(updated_at='2020-01-01T00:00:00Z', changed_at='2020-01-01T00:00:00Z')
+        self.new = Post.objects.create(title='New, "quoted"', owner=self.admin, likes_count=3)
+        Comment.objects.create(post=self.new, owner=self.admin, body='comment')
+
+    def export(self, query):
+        response = self.client.get(f'/api/v1/posts/export/?{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Exported-At', response)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_with_comments(self):
+        rows = [json.loads(line) for line in self.export('comments=true').splitlines()]
+        self.assertEqual([(row['type'], row['id']) for row in rows],
+                         [('post', self.old.pk), ('post', self.new.pk), ('comment', self.new.comments.get().pk)])
+        self.assertEqual((rows[1]['owner'], rows[1]['likes_count']), ('exporter', 3))
+
+    def test_csv_since(self):
+        rows = list(csv.DictReader(StringIO(self.export('output=csv&since=2021-01-01T00:00:00'))))
+        self.assertEqual([row['title'] for row in rows], ['New, "quoted"'])
+        self.assertEqual(self.client.get('/api/v1/posts/export/?since=yesterday').status_code, 400)
+
+    def test_since_includes_counters_and_edited_comments(self):
+        comment = Comment.objects.create(post=self.old, owner=self.admin, body='old comment')
+        Comment.objects.filter(pk=comment.pk).update(created_at='2020-01-01T00:00:00Z',
+                                                     updated_at='2020-01-01T00:00:00Z')
+        query = f'comments=true&since={quote(timezone.now().isoformat())}'
+        self.assertEqual(self.export(query), '')
+        Like.objects.create(post=self.old, owner=self.admin)
+        comment.body = 'edited'
+        comment.save()
+        rows = [json.loads(line) for line in self.export(query).splitlines()]
+        self.assertEqual([(row['type'], row['id']) for row in rows], [('post', self.old.pk), ('comment', comment.pk)])
+        self.assertEqual((rows[0]['likes_count'], rows[1]['body']), (1, 'edited'))
+
+    def test_admin_only(self):
+        self.client.force_authenticate(User.objects.create_user(username='reader', password='123456'))
+        self.assertEqual(self.client.get('/api/v1/posts/export/').status_code, 403)
+
+    def test_command(self):
+        out, err = StringIO(), StringIO()
+        call_command('export_posts', '--format', 'csv', stdout=out, stderr=err)
+        self.assertEqual(len(out.getvalue().strip().splitlines()), 3)
+        self.assertIn('--since', err.getvalue())
+
+
+class TrendingTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='trend', password='123456')
+        self.fans = [User.objects.create_user(username=f'fan{i}', password='123456') for i in range(3)]
+        self.old, self.new = (Post.objects.create(title=title, owner=self.user) for title in ('Old', 'New'))
+        # пост трехдневной давности: три периода полураспада, нужно engagement >= 2^3 - 1
+        created_at = self.old.created_at - timedelta(days=3)
+        Post.objects.filter(pk=self.old.pk).update(created_at=created_at)
+        PostRank.objects.filter(post=self.old).update(base=trending.base_score(created_at))
+
+    def titles(self):
+        response = self.client.get('/api/v1/posts/trending/')
+        self.assertEqual(response.status_code, 200)
+        return [post['title'] for post in response.data]
+
+    def test_incremental_and_decay(self):
+        self.client.force_authenticate(self.fans[0])
+        self.client.post(f'/api/v1/posts/{self.old.pk}/add_like/')
+        self.client.post(f'/api/v1/posts/{self.old.pk}/favorite_posts/')
+        self.assertEqual(self.titles(), ['New', 'Old'])  # 1 + 3 < 7
+
+        for fan in self.fans[1:]:
+            Comment.objects.create(post=self.old, owner=fan, body='up')
+        self.assertEqual(self.titles(), ['Old', 'New'])  # 1 + 3 + 2 * 2 = 8
+        rank = PostRank.objects.get(post=self.old)
+        self.assertEqual(rank.engagement, 8)
+
+        self.client.post(f'/api/v1/posts/{self.old.pk}/favorite_posts/')
+        self.assertEqual(self.titles(), ['New', 'Old'])
+        self.assertAlmostEqual(PostRank.objects.get(post=self.old).score, rank.base + math.log2(6))
+
+    def test_rebuild_matches_incremental(self):
+        Like.objects.create(post=self.new, owner=self.fans[0])
+        Comment.objects.create(post=self.new, owner=self.fans[1], body='hi')
+        before = PostRank.objects.get(post=self.new).score
+        PostRank.objects.all().delete()
+        call_command('rebuild_trending', stdout=StringIO())
+        self.assertAlmostEqual(PostRank.objects.get(post=self.new).score, before)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.titles(), ['New', 'Old'])
+
+    def test_rebuild_keeps_concurrent_reactions(self):
+        save = trending._save
+
+        def like_then_save(batch):
+            # лайк между чтением постов и записью рейтинга
+            Like.objects.create(post=self.new, owner=self.fans[0])
+            return save(batch)
+
+        with mock.patch.object(trending, '_save', like_then_save):
+            trending.rebuild([self.new.pk])
+        rank = PostRank.objects.get(post=self.new)
+        self.assertEqual(rank.engagement, 1)
+        self.assertAlmostEqual(rank.score, rank.base + 1)
+
+
+class ConditionalGetTest(APITestCase):
+
+    def setUp(self):
+        post_cache.backend.clear()
+        self.user = User.objects.create_user(username='poller', password='123456')
+        self.post = Post.objects.create(title='Polled', body='text', owner=self.user)
+        self.comment = Comment.objects.create(post=self.post, owner=self.user, body='first')
+        self.url = f'/api/v1/posts/{self.post.pk}/'
+
+    def revalidate(self, url, response, queries):
+        with self.assertNumQueries(queries):
+            return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_detail_not_modified_without_serializers(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        with mock.patch('main.serializers.PostSerializer.to_representation') as to_representation:
+            self.assertEqual(self.revalidate(self.url, response, 1).status_code, 304)  # changed_at + is_liked
+        to_representation.assert_not_called()
+
+        self.client.force_authenticate(None)
+        anonymous = self.client.get(self.url)
+        self.assertNotEqual(anonymous['ETag'], response['ETag'])
+        self.assertEqual(self.revalidate(self.url, anonymous, 0).status_code, 304)  # валидатор из кэша
+
+    def test_changes_move_etag(self):
+        self.client.force_authenticate(self.user)
+        etag = self.client.get(self.url)['ETag']
+        changes = (
+            lambda: self.client.post(f'{self.url}add_like/'),
+            lambda: Comment.objects.filter(pk=self.comment.pk).first().save(),
+            lambda: Comment.objects.create(post=self.post, owner=self.user, body='second'),
+            lambda: PostImages.objects.create(post=self.post, image='images/polled.jpeg'),
+        )
+        for change in changes:
+            change()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+        self.assertTrue(response.data['is_liked'])
+        self.assertEqual(response.data['comments_count'], 2)
+
+    def test_list_and_comments(self):
+        for url in ('/api/v1/posts/', f'{self.url}comments/'):
+            response = self.client.get(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+            self.assertEqual(self.client.get(f'{url}?page_size=1', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        feed = self.client.get('/api/v1/posts/')
+        Post.objects.create(title='Fresh', owner=self.user)
+        self.assertEqual(self.client.get('/api/v1/posts/', HTTP_IF_NONE_MATCH=feed['ETag']).status_code, 200)
+        comments = self.client.get(f'{self.url}comments/')
+        self.comment.delete()
+        response = self.client.get(f'{self.url}comments/', HTTP_IF_NONE_MATCH=comments['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+
+class SparseFieldsetsTest(APITestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(post_cache, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='sparse', password='123456')
+        self.post = Post.objects.create(title='Sparse', body='long body', owner=self.user)
+        PostImages.objects.create(post=self.post, image='images/sparse.jpeg')
+        Comment.objects.create(post=self.post, owner=self.user, body='hidden')
+
+    def test_detail_titles_only(self):
+        url = f'/api/v1/posts/{self.post.pk}/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,title'})
+        self.assertEqual(response.data, {'id': self.post.pk, 'title': 'Sparse'})
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('"main_post"."body"', sql)
+        self.assertNotIn('main_comment', sql)
+        self.assertNotIn('main_postimages', sql)
+
+        response = self.client.get(url, {'fields': 'title,owner', 'expand': 'comments,body'})
+        self.assertEqual(set(response.data), {'title', 'owner', 'comments'})
+        self.assertEqual(response.data['owner'], 'sparse')
+        self.assertEqual(self.client.get(url).data['body'], 'long body')
+
+    def test_feed_and_flags(self):
+        Like.objects.create(post=self.post, owner=self.user)
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/posts/', {'fields': 'title,is_liked'})
+        self.assertEqual(response.data['results'], [{'title': 'Sparse', 'is_liked': True}])
+        self.assertNotIn('"main_post"."body"', ' '.join(query['sql'] for query in queries))
+        Post.objects.create(title='Second', owner=self.user)
+        with self.assertNumQueries(2):  # валидатор ETag + страница, курсор - из той же выборки
+            response = self.client.get('/api/v1/posts/', {'pagination': 'cursor', 'count': 'false',
+                                                          'page_size': 1, 'fields': 'title'})
+        self.assertIsNotNone(response.data['next'])
+        with mock.patch.object(post_cache, 'enabled', True):
+            post_cache.backend.clear()
+            for _ in range(2):
+                response = self.client.get('/api/v1/posts/', {'fields': 'id,is_favorited'})
+                self.assertEqual(response.data['results'][0], {'id': self.post.pk, 'is_favorited': False})
+
+    def test_user_detail(self):
+        Favorites.objects.create(post=self.post, owner=self.user)
+        self.client.force_authenticate(self.user)
+        url = f'/api/v1/accounts/{self.user.pk}/'
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'fields': 'username'})
+        self.assertEqual(response.data, {'username': 'sparse'})
+        response = self.client.get(url, {'fields': 'username', 'expand': 'favorites'})
+        self.assertEqual(response.data['favorites'][0]['post']['title'], 'Sparse')
+
+
+class FastSerializerTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='fast', password='123456')
+        root = Category.objects.create(name='Fast root')
+        Category.objects.create(name='Fast child', parent=root)
+        with_all = Post.objects.create(title='Full', owner=self.user, category=root, preview='images/fast.jpeg')
+        PostImages.objects.create(post=with_all, image='images/fast_1.jpeg')
+        Like.objects.create(post=with_all, owner=self.user)
+        Post.objects.create(title='Bare', owner=self.user)
+
+    def assertSameBytes(self, serializer_class, queryset, query=''):
+        request = Request(RequestFactory().get(f'/api/v1/?{query}'))
+        request.user = self.user
+        context = {'request': request}
+        fast = FastSerializer(serializer_class, context)
+        expected = JSONRenderer().render(serializer_class(queryset, many=True, context=context).data)
+        self.assertEqual(JSONRenderer().render(fast.serialize(fast.values(queryset))), expected)
+
+    def test_byte_identical(self):
+        posts = Post.objects.feed(self.user).order_by('pk')
+        self.assertSameBytes(serializers.PostFeedSerializer, posts)
+        self.assertSameBytes(serializers.PostFeedSerializer, posts, 'fields=title,image,category,is_liked')
+        self.assertSameBytes(serializers.PostListSerializer, Post.objects.order_by('pk'))
+        self.assertSameBytes(serializers.UserListSerializer, User.objects.order_by('pk'))
+        self.assertSameBytes(serializers.CategorySerializer, Category.objects.order_by('pk'))
+
+    def test_views_use_values(self):
+        self.client.force_authenticate(self.user)
+        with mock.patch.object(Post, '__init__', side_effect=AssertionError('model instance')):
+            response = self.client.get('/api/v1/posts/', {'pagination': 'cursor', 'page_size': 1})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(response.data['next']).data['results'][0]['title'], 'Bare')
+        users = self.client.get('/api/v1/accounts/', {'pagination': 'cursor'})
+        self.assertEqual(users.data['results'], [{'id': self.user.pk, 'username': 'fast'}])
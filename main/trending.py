@@ -0,0 +1,122 @@
+"""
+Посты "в тренде" (PostRank).
+
+    score = log2(1 + engagement) + base
+    engagement = WEIGHTS['like'] * лайки + WEIGHTS['comment'] * комментарии + WEIGHTS['favorite'] * избранное
+    base = (created_at - EPOCH) / HALF_LIFE
+
+Формула "hot" как у Reddit: пост на HALF_LIFE старше должен набрать вдвое больше,
+чтобы стоять на том же месте. Затухание заложено в base, поэтому со временем
+score не меняется - порядок хранится готовым и top-K читается по индексу postrank_score_idx.
+
+Инкрементально: каждая реакция/комментарий - один UPDATE строки PostRank
+(сигналы в main/signals.py, лайки и избранное - в запросе main/reactions.py). Периодически и после bulk_create -
+rebuild() по счетчикам Post (команда rebuild_trending), она же поправит веса после их смены.
+"""
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, FloatField, OuterRef, Subquery
+from django.db.models.functions import Greatest, Log
+
+from .models import Comment, Favorites, Like, Post, PostRank
+
+EPOCH = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+DEFAULTS = {
+    'WEIGHTS': {'like': 1.0, 'comment': 2.0, 'favorite': 3.0},
+    'HALF_LIFE_HOURS': 24,
+    'TOP_K': 20,        # ?limit= по умолчанию
+    'MAX_TOP_K': 100,
+}
+
+WEIGHT_NAMES = {
+    Like: 'like',
+    Comment: 'comment',
+    Favorites: 'favorite',
+}
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'TRENDING', {})}
+    config['WEIGHTS'] = {**DEFAULTS['WEIGHTS'], **config['WEIGHTS']}
+    return config
+
+
+def weight(model):
+    return float(get_config()['WEIGHTS'][WEIGHT_NAMES[model]])
+
+
+def base_score(created_at):
+    return (created_at - EPOCH).total_seconds() / (get_config()['HALF_LIFE_HOURS'] * 3600)
+
+
+def add_post(post):
+    base = base_score(post.created_at)
+    PostRank.objects.create(post=post, base=base, score=base)
+
+
+def record(model, post_ids, delta):
+    """Реакция/комментарий добавлены (delta > 0) или сняты на постах post_ids. Один UPDATE."""
+    engagement = Greatest(F('engagement') + weight(model) * delta, 0.0)
+    return PostRank.objects.filter(post_id__in=post_ids).update(
+        engagement=engagement, score=F('base') + Log(2.0, engagement + 1.0),
+    )
+
+
+def rebuild(post_ids=None, batch_size=2000):
+    """
+    Пересчитывает PostRank по счетчикам Post (всех или post_ids). Возвращает число постов.
+    engagement считается в самом UPDATE из счетчиков main_post, без чтения в Python:
+    реакция, пришедшая во время пересчета, не теряется (а строки не удаляются и не вставляются заново).
+    """
+    half_life = get_config()['HALF_LIFE_HOURS'] * 3600
+    queryset = Post.objects.order_by('pk')
+    if post_ids is not None:
+        queryset = queryset.filter(pk__in=post_ids)
+    rows = queryset.values_list('pk', 'created_at', 'trend__base')
+
+    total, batch = 0, []
+    for pk, created_at, stored_base in rows.iterator(chunk_size=batch_size):
+        batch.append((pk, (created_at - EPOCH).total_seconds() / half_life, stored_base))
+        if len(batch) >= batch_size:
+            total += _save(batch)
+            batch = []
+    return total + _save(batch)
+
+
+def weighted_counters():
+    """engagement поста по его счетчикам - подзапрос для UPDATE main_postrank."""
+    weights = get_config()['WEIGHTS']
+    engagement = ExpressionWrapper(
+        float(weights['like']) * F('likes_count') + float(weights['comment']) * F('comments_count')
+        + float(weights['favorite']) * F('favorites_count'),
+        output_field=FloatField(),
+    )
+    return Subquery(Post.objects.filter(pk=OuterRef('post_id')).annotate(engagement=engagement).values('engagement'))
+
+
+@transaction.atomic
+def _save(batch):
+    # base зависит только от created_at и HALF_LIFE: новые строки и смена HALF_LIFE
+    PostRank.objects.bulk_create(
+        [PostRank(post_id=pk, base=base, score=base) for pk, base, stored in batch if stored is None],
+        ignore_conflicts=True,
+    )
+    PostRank.objects.bulk_update(
+        [PostRank(post_id=pk, base=base) for pk, base, stored in batch
+         if stored is not None and not math.isclose(stored, base)],
+        ['base'],
+    )
+    engagement = weighted_counters()
+    PostRank.objects.filter(post_id__in=[pk for pk, _, _ in batch]).update(
+        engagement=engagement, score=F('base') + Log(2.0, engagement + 1.0),
+    )
+    return len(batch)
+
+
+def top(queryset, limit):
+    """Первые limit постов queryset по рейтингу: один запрос, сортировка по индексу PostRank."""
+    return queryset.filter(trend__isnull=False).order_by('-trend__score', '-trend__post')[:limit]
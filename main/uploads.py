@@ -0,0 +1,250 @@
+"""
+Потоковая загрузка картинок с ограничением памяти на запрос.
+
+StreamingImageUploadHandler заменяет стандартные Memory/TemporaryFileUploadHandler:
+  * каждый чанк сразу уходит фоновому писателю во временный файл, парсинг
+    запроса не ждет диска, а файлы одного запроса пишутся параллельно;
+    у каждого файла свой поток-писатель: медленный или брошенный клиент
+    не занимает общий пул, а писатель без новых чанков дольше IDLE_TIMEOUT
+    сам прерывает запись;
+  * в памяти одновременно не больше MAX_BUFFER байт на весь запрос
+    (парсер ждет, пока писатели освободят буфер);
+  * формат проверяется по сигнатуре первого чанка, размеры - по заголовку
+    через PIL без декодирования пикселей; чужие файлы пропускаются (SkipFile)
+    и попадают в request.rejected_uploads;
+  * по ходу записи считается sha256 (uploaded_file.sha256).
+Готовый файл - TemporaryUploadedFile, поэтому FileSystemStorage его
+переносит, а не копирует. Все ожидания (место в буфере, конец записи) -
+не дольше WAIT_TIMEOUT. Если парсинг оборвался на середине файла
+(обрыв соединения, MultiPartParserError, RequestDataTooBig), Django не зовет
+upload_interrupted - его зовет view в конце запроса (PostViewSet.dispatch).
+"""
+import hashlib
+import queue
+import threading
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+from PIL import Image
+
+DEFAULTS = {
+    'CHUNK_SIZE': 64 * 1024,
+    'MAX_BUFFER': 4 * 1024 * 1024,     # на запрос
+    'MAX_FILE_SIZE': 20 * 1024 * 1024,
+    'MAX_PIXELS': 50_000_000,
+    'IDLE_TIMEOUT': 30,   # секунд без новых чанков - писатель прерывает запись
+    'WAIT_TIMEOUT': 60,   # сколько ждать место в буфере или конец записи
+}
+
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_UPLOAD', {})}
+
+
+def sniff_format(header):
+    for signature, image_format in SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+class MemoryBudget:
+    """
+    Счетчик байт в буферах запроса; acquire() ждет, пока писатели не освободят место.
+    False - место не освободилось за timeout (писатель завис).
+    """
+
+    def __init__(self, limit, timeout=None):
+        self.limit = limit
+        self.timeout = timeout
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        with self.condition:
+            # один чанк больше лимита все равно пропускаем, иначе зависнем навсегда
+            if not self.condition.wait_for(lambda: self.used == 0 or self.used + size <= self.limit, self.timeout):
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+
+
+class UploadTimeout(Exception):
+    pass
+
+
+def _written(name):
+    """Атрибут, который заполняет фоновый писатель: чтение ждет окончания записи."""
+
+    def getter(self):
+        self.wait()
+        return self.__dict__[name]
+
+    def setter(self, value):
+        self.__dict__[name] = value
+
+    return property(getter, setter)
+
+
+class StreamedUploadedFile(TemporaryUploadedFile):
+    """TemporaryUploadedFile, который ждет фонового писателя при первом обращении к файлу."""
+    file = _written('_file')
+    error = _written('_error')
+    sha256 = _written('_sha256')
+    image_size = _written('_image_size')
+    image_format = _written('_image_format')
+
+    def __init__(self, *args, wait_timeout=None, **kwargs):
+        self.done = threading.Event()
+        self.wait_timeout = wait_timeout
+        self.error = self.sha256 = self.image_size = self.image_format = None
+        super().__init__(*args, **kwargs)
+
+    def wait(self):
+        if not self.done.wait(self.wait_timeout):
+            raise UploadTimeout(f'Upload of {self.name} did not finish in {self.wait_timeout}s')
+
+    def temporary_file_path(self):
+        self.wait()
+        return super().temporary_file_path()
+
+    def raw_file(self):
+        return self.__dict__['_file']
+
+
+class FileWriter:
+
+    def __init__(self, uploaded, budget, max_pixels, idle_timeout=None):
+        self.uploaded = uploaded
+        self.budget = budget
+        self.max_pixels = max_pixels
+        self.idle_timeout = idle_timeout
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name='upload-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, chunk):
+        """False - писатель не успевает (буфер не освободился за WAIT_TIMEOUT)."""
+        if not self.budget.acquire(len(chunk)):
+            return False
+        self.queue.put(chunk)
+        return True
+
+    def finish(self, size):
+        self.queue.put(None)
+        self.uploaded.size = size
+
+    def abort(self):
+        self.queue.put(False)
+
+    def run(self):
+        uploaded, f = self.uploaded, self.uploaded.raw_file()
+        digest = hashlib.sha256()
+        try:
+            while True:
+                try:
+                    chunk = self.queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    # парсер пропал, не закончив файл
+                    uploaded.error = 'Upload timed out'
+                    chunk = False
+                if chunk is None or chunk is False:
+                    break
+                try:
+                    f.write(chunk)
+                    digest.update(chunk)
+                finally:
+                    self.budget.release(len(chunk))
+            if chunk is False:
+                f.close()
+                return
+            f.flush()
+            f.seek(0)
+            uploaded.sha256 = digest.hexdigest()
+            self.check_image(uploaded, f)
+        except Exception as e:
+            uploaded.error = str(e)
+        finally:
+            uploaded.done.set()
+
+    def check_image(self, uploaded, f):
+        # Image.open читает только заголовок, пиксели не декодируются
+        try:
+            with Image.open(f) as image:
+                uploaded.image_format = image.format
+                uploaded.image_size = width, height = image.size
+        except (Image.UnidentifiedImageError, SyntaxError):
+            uploaded.error = 'Invalid image file'
+            return
+        finally:
+            f.seek(0)
+        if width * height > self.max_pixels:
+            uploaded.error = f'Image is too large: {width}x{height}'
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.config = get_config()
+        self.chunk_size = self.config['CHUNK_SIZE']
+        self.budget = MemoryBudget(self.config['MAX_BUFFER'], self.config['WAIT_TIMEOUT'])
+        self.writer = None
+        self.received = 0
+        if request is not None:
+            request.rejected_uploads = []
+
+    def reject(self, message):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        if self.request is not None:
+            self.request.rejected_uploads.append({'field': self.field_name, 'name': self.file_name,
+                                                  'error': message})
+        raise SkipFile(message)
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.received = 0
+        if content_length is not None and content_length > self.config['MAX_FILE_SIZE']:
+            self.reject('File is too large')
+        uploaded = StreamedUploadedFile(file_name, content_type, 0, charset, content_type_extra,
+                                        wait_timeout=self.config['WAIT_TIMEOUT'])
+        self.writer = FileWriter(uploaded, self.budget, self.config['MAX_PIXELS'], self.config['IDLE_TIMEOUT'])
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and sniff_format(raw_data[:16]) is None:
+            self.reject('Unsupported image format')
+        self.received += len(raw_data)
+        if self.received > self.config['MAX_FILE_SIZE']:
+            self.reject('File is too large')
+        if not self.writer.write(raw_data):
+            self.reject('Upload timed out')
+        return None
+
+    def file_complete(self, file_size):
+        # не ждем записи: следующий файл парсится, пока этот дописывается
+        writer, self.writer = self.writer, None
+        writer.finish(file_size)
+        return writer.uploaded
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
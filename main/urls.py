@@ -1,6 +1,6 @@
 from django.urls import path, include
 
-from . import views
+from . import async_views, views
 
 # №3 способ CRUD
 from rest_framework.routers import DefaultRouter
@@ -16,4 +16,10 @@ urlpatterns = [
     path('categories/', views.CategoryListView.as_view()),
     path('comments/', views.CommentListCreateView.as_view()),
     path('comments/<int:pk>/', views.CommentDetailView.as_view()),
+    path('db-pool-stats/', views.DatabasePoolStatsView.as_view()),
+    # async чтение под ASGI (main/async_views.py)
+    path('async/posts/', async_views.post_list),
+    path('async/posts/<int:pk>/', async_views.post_detail),
+    path('async/posts/<int:pk>/comments/', async_views.post_comments),
+    path('async/categories/', async_views.category_list),
 ]
\ No newline at end of file
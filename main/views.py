@@ -1,23 +1,30 @@
-from django.db import connection
-from django.contrib.auth.models import User
+from django.db.models import Exists, OuterRef
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import generics, permissions
+from rest_framework.exceptions import APIException, NotFound, ValidationError
 from rest_framework.status import HTTP_404_NOT_FOUND
 from rest_framework.viewsets import ModelViewSet
-from . import serializers
+from . import conditional, exporter, reactions, serializers, trending
 from .models import Category, Favorites, Post, Comment, Like
-from .permissions import IsAuthor, IsAccountOwner
+from .permissions import IsAuthor, IsAccountOwner, IsOwnAccount
 from rest_framework.decorators import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter
-from rest_framework.pagination import PageNumberPagination
-
-class StandartResultPagination(PageNumberPagination):
-    page_size = 5
-    page_query_param = 'page'
-    max_page_size = 1000
-
+from .fastserializers import FastListMixin
+from .fieldsets import requested_fields
+from .filters import PostFilter, PostSearchFilter
+from .importer import Importer
+from .pagination import (CommentPagination, FavoritesPagination, PostCommentPagination, PostPagination,
+                         StandartResultPagination, UserPagination)
+from .search import get_search_backend
+from .cache import post_cache
+from .uploads import StreamingImageUploadHandler
+from .writebehind import BufferBusy, reaction_buffer
+from blogApi.backends.postgresql_pool.pool import pool_stats
 
 
 class UserRegistrationView(generics.CreateAPIView):
@@ -26,12 +33,13 @@ class UserRegistrationView(generics.CreateAPIView):
     serializer_class = serializers.RegisterSerializer
 
 
-class UserListView(generics.ListAPIView):
+class UserListView(FastListMixin, generics.ListAPIView):
     queryset = User.objects.all()
     permission_classes = (permissions.AllowAny,)
     serializer_class = serializers.UserListSerializer
     filter_backends = (SearchFilter,)
     search_fields = ('username',)
+    pagination_class = UserPagination
 
 
 class UserDetailView(generics.RetrieveAPIView):
@@ -39,17 +47,55 @@ class UserDetailView(generics.RetrieveAPIView):
     permission_classes = (permissions.IsAuthenticated, IsAccountOwner)
     serializer_class = serializers.UserSerializer
 
+    def get_queryset(self):
+        return self.get_serializer_class().narrow(super().get_queryset(), self.request)
+
+
+class UserFavoritesView(generics.ListAPIView):
+    permission_classes = (permissions.IsAuthenticated, IsOwnAccount)
+    serializer_class = serializers.FavoritesSerializer
+    pagination_class = FavoritesPagination
+
+    def get_queryset(self):
+        return serializers.FavoritesSerializer.queryset(Favorites.objects.filter(owner_id=self.kwargs['pk']))
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if reaction_buffer.enabled:
+            # избранное, которое еще в буфере (main/writebehind.py); новые - на первой странице
+            first_page = self.paginator.cursor_query_param not in request.query_params
+            response.data['results'] = reaction_buffer.overlay_favorites(
+                response.data['results'], int(self.kwargs['pk']), serializers.FavoritesSerializer.posts, first_page)
+        return response
+
+
+# api/v1/db-pool-stats/ - пулы соединений этого процесса (blogApi/backends/postgresql_pool)
+class DatabasePoolStatsView(APIView):
+    permission_classes = (permissions.IsAdminUser, )
+
+    def get(self, request):
+        return Response(pool_stats())
+
 
-class CategoryListView(generics.ListAPIView):
+class CategoryListView(FastListMixin, generics.ListAPIView):
     queryset = Category.objects.all()
     serializer_class = serializers.CategorySerializer
 
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('tree') not in ('1', 'true'):
+            return self.fast_list(self.filter_queryset(self.get_queryset()))
+        # ?tree=true - все дерево одним запросом, вложенность собирается в памяти
+        categories = list(self.filter_queryset(self.get_queryset()).order_by('depth', 'name', 'id'))
+        roots = serializers.CategoryTreeSerializer.nest(categories)
+        return Response(serializers.CategoryTreeSerializer(roots, many=True).data)
+
 
 class CommentListCreateView(generics.ListCreateAPIView):
-    queryset = Comment.objects.all()
+    queryset = Comment.objects.select_related('owner')
 
     serializer_class = serializers.CommentSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    pagination_class = CommentPagination
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -67,71 +113,242 @@ class CommentDetailView(generics.RetrieveUpdateDestroyAPIView):
 '''
 
 
-class PostViewSet(ModelViewSet):
+class ReactionsUnavailable(APIException):
+    status_code = 503
+    default_detail = 'Реакции временно не принимаются, повторите запрос.'
+    default_code = 'reactions_unavailable'
+
+
+class PostViewSet(FastListMixin, ModelViewSet):
     queryset = Post.objects.select_related('owner', 'category')
-    filter_backends = (DjangoFilterBackend, SearchFilter)
-    filterset_fields = ('category', 'owner')
-    search_fields = ('title',)
-    pagination_class = StandartResultPagination
+    filter_backends = (DjangoFilterBackend, PostSearchFilter)
+    filterset_class = PostFilter
+    pagination_class = PostPagination
+
+    def initialize_request(self, request, *args, **kwargs):
+        drf_request = super().initialize_request(request, *args, **kwargs)
+        if self.action in ('create', 'update', 'partial_update'):
+            # картинки пишутся на диск по чанкам, а не буферизуются целиком (main/uploads.py)
+            request.upload_handlers = [StreamingImageUploadHandler(request)]
+        return drf_request
 
     def dispatch(self, request, *args, **kwargs):
-        response = super().dispatch(request, *args, **kwargs)
-        print(f'Запросов в базу данных: {len(connection.queries)}')
-        return response
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            # парсер мог оборваться на середине файла (обрыв соединения, MultiPartParserError,
+            # RequestDataTooBig) - тогда Django не останавливает писателя сам
+            for handler in request.upload_handlers:
+                if isinstance(handler, StreamingImageUploadHandler):
+                    handler.upload_interrupted()
+
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # фиксированное число запросов независимо от размера страницы;
+            # при включенном кэше флаги юзера досчитываются в list()
+            queryset = queryset.feed(AnonymousUser() if self.list_cacheable() else self.request.user)
+        elif self.action in ('search', 'trending'):
+            queryset = queryset.feed(self.request.user)
+        if self.action in ('list', 'retrieve', 'search', 'trending'):
+            # ?fields= / ?expand= (main/fieldsets.py): читаются только нужные колонки и связи
+            queryset = self.get_serializer_class().narrow(queryset, self.request)
+        return queryset
+
+    # =======================================================================================================
+    # кэш (main/cache.py): общая часть ответа кэшируется, флаги юзера - нет
+
+    # ETag / Last-Modified (main/conditional.py): 304 отдается до сериализаторов,
+    # валидаторы тоже кэшируются и сбрасываются вместе с ответами. Валидатор ленты
+    # (COUNT, changed_at) живет до смены ее состава, поэтому ETag страницы включает
+    # версии ее постов - лайк сдвигает версию, а не все кэшированные страницы
+
+    def list(self, request, *args, **kwargs):
+        cacheable = self.list_cacheable()
+        validator = lambda: conditional.list_validator(self.filter_queryset(Post.objects.all()))
+        count, changed_at = post_cache.get_list_validator(request, validator) if cacheable else validator()
+        # COUNT(*) для пагинации уже есть в валидаторе
+        self.paginator.known_count = count
+        def build():
+            # строки values() без моделей и ModelSerializer (main/fastserializers.py)
+            return self.fast_list(self.filter_queryset(self.get_queryset())).data
+
+        data, hit, versions = post_cache.get_list(request, build) if cacheable else (None, False, ())
+        changed_at = max(filter(None, (changed_at, post_cache.version_time(versions))), default=None)
+        # реакции в буфере write-behind (main/writebehind.py) еще не сдвинули changed_at
+        pending = reaction_buffer.version() if reaction_buffer.enabled else None
+        etag = conditional.make_etag('list', count, changed_at, versions, pending, *conditional.variant(request))
+        not_modified = conditional.not_modified(request, etag, changed_at)
+        if not_modified:
+            return not_modified
+        if data is None:
+            data = build()
+        fields = requested_fields(request)
+        if cacheable and request.user.is_authenticated and (fields is None or fields & set(self.USER_FLAGS)):
+            data = self.with_user_state(data, request.user)
+        if pending is not None:
+            data = reaction_buffer.overlay(data, request.user)
+        response = Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+        return conditional.set_validators(response, etag, changed_at)
+
+    def retrieve(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            # за is_liked юзера все равно нужен запрос - changed_at берется в нем же
+            validator = conditional.post_validator(kwargs['pk'], request.user)
+        else:
+            validator = post_cache.get_post_validator(
+                kwargs['pk'], lambda: conditional.post_validator(kwargs['pk'], request.user))
+        if validator is None:
+            raise NotFound()
+        changed_at, is_liked = validator
+        pending = reaction_buffer.pending_for(request.user, [int(kwargs['pk'])]).get(int(kwargs['pk'])) \
+            if reaction_buffer.enabled else None
+        etag = conditional.make_etag('detail', changed_at, is_liked, pending, *conditional.variant(request))
+        not_modified = conditional.not_modified(request, etag, changed_at)
+        if not_modified:
+            return not_modified
+        data, hit = post_cache.get_post(kwargs['pk'], request,
+                                        lambda: super(PostViewSet, self).retrieve(request, *args, **kwargs).data)
+        fields = requested_fields(request)
+        if request.user.is_authenticated and (fields is None or 'is_liked' in fields):
+            data = {**data, 'is_liked': is_liked}
+        data = reaction_buffer.apply_change(data, pending)
+        response = Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+        return conditional.set_validators(response, etag, changed_at)
+
+    USER_FLAGS = ('is_liked', 'is_favorited')
+
+    def list_cacheable(self):
+        if not post_cache.enabled:
+            return False
+        # флаги юзера накладываются на кэш по id, по нему же сверяются версии постов
+        # (main/cache.py): ?fields= без id идет мимо кэша
+        fields = requested_fields(self.request)
+        return fields is None or 'id' in fields
+
+    @classmethod
+    def with_user_state(cls, data, user):
+        items = data['results'] if isinstance(data, dict) else data
+        flags = {
+            pk: (is_liked, is_favorited)
+            for pk, is_liked, is_favorited in Post.objects.filter(pk__in=[item['id'] for item in items]).annotate(
+                is_liked=Exists(Like.objects.filter(post=OuterRef('pk'), owner=user)),
+                is_favorited=Exists(Favorites.objects.filter(post=OuterRef('pk'), owner=user)),
+            ).values_list('pk', 'is_liked', 'is_favorited')
+        }
+        items = [{**item, **{name: value for name, value in zip(cls.USER_FLAGS, flags[item['id']]) if name in item}}
+                 for item in items if item['id'] in flags]
+        return {**data, 'results': items} if isinstance(data, dict) else items
+
+    # api/v1/posts/cache_stats/
+    @action(['GET'], detail=False)
+    def cache_stats(self, request):
+        return Response(post_cache.stats())
+
     def get_serializer_class(self):
         if self.action in ('retrieve',):
             return serializers.PostSerializer
         elif self.action in ('create', 'update', 'partial_update'):
             return serializers.PostCreateSerializer
+        elif self.action in ('list', 'trending'):
+            return serializers.PostFeedSerializer
+        elif self.action == 'search':
+            return serializers.PostSearchSerializer
         else:
             return serializers.PostListSerializer
 
     def get_permissions(self):
 
         # Создавать посты может зарегистрированный юзер
-        if self.action in ('create', 'add_like', 'remove_like', 'favorite_posts'):
+        if self.action in ('create', 'add_like', 'remove_like', 'favorite_posts', 'bulk_reactions'):
             return [permissions.IsAuthenticated()]
 
         # Изменять и удалять может только автор поста
         elif self.action in ('update', 'partial_update', 'destroy', 'get_likes'):
             return [permissions.IsAuthenticated(), IsAuthor()]
+        elif self.action in ('cache_stats', 'bulk_import', 'export'):
+            return [permissions.IsAdminUser()]
         # Просматривать могут все
         else:
             return [permissions.AllowAny()]
 
+    # =======================================================================================================
+    # api/v1/posts/search/?q=spider man
+    @action(['GET'], detail=False)
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'q': 'Введите строку поиска!'}, status=400)
+        queryset = get_search_backend().search(self.filter_queryset(self.get_queryset()), query)
+        # сортировка по релевантности, поэтому keyset по created_at тут не подходит
+        paginator = StandartResultPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     # =======================================================================================================
     # api/v1/posts/<id>/comments
-    @action(['GET'], detail=True)
+    @action(['GET'], detail=True, pagination_class=PostCommentPagination)
     def comments(self, request, pk):
         post = self.get_object()
-        comments = post.comments.all()
-        serializer = serializers.CommentSerializer(comments, many=True)
-        return Response(serializer.data, status=200)
+        # новые, удаленные и исправленные комментарии сдвигают changed_at поста
+        etag = conditional.make_etag('comments', post.pk, post.changed_at, *conditional.variant(request))
+        not_modified = conditional.not_modified(request, etag, post.changed_at)
+        if not_modified:
+            return not_modified
+        page = self.paginate_queryset(post.comments.select_related('owner'))
+        if self.paginator.count is None:
+            # вместо COUNT(*) по всем комментариям - денормализованный счетчик
+            self.paginator.count = post.comments_count
+        serializer = serializers.CommentSerializer(page, many=True)
+        return conditional.set_validators(self.get_paginated_response(serializer.data), etag, post.changed_at)
 
     # ========================================================================================================
     # api/v1/posts/<id>/add_like/
+    # лайки и избранное - одним INSERT/DELETE без загрузки поста (main/reactions.py)
+    # или в буфер write-behind, если он включен (main/writebehind.py)
+    @staticmethod
+    def reaction_writer():
+        return reaction_buffer if reaction_buffer.enabled else reactions
+
+    def handle_exception(self, exc):
+        if isinstance(exc, BufferBusy):
+            # буфер занят дольше BUSY_TIMEOUT - ничего не записано, клиент может повторить
+            exc = ReactionsUnavailable()
+        return super().handle_exception(exc)
+
+    def reaction_post_id(self):
+        try:
+            return int(self.kwargs['pk'])
+        except ValueError:
+            raise NotFound()
+
+    def post_not_found(self, post_id):
+        # сюда попадаем только если ничего не изменилось - редкий путь, можно лишний запрос
+        return not Post.objects.filter(pk=post_id).exists()
+
     @action(['POST'], detail=True)
     def add_like(self, request, pk):
-        post = self.get_object()
-        if request.user.liked.filter(post=post).exists():
-            # request.user.liked.filter(post=post).delete()   # также запросом(пост) удаляет лайк при повторном запросе
-            # return Response('Вы удалили свой лайк!', status=204)
-            return Response('Вы уже лайкали этот пост!', status=400)
-        Like.objects.create(post=post, owner=request.user)
-        return Response('Вы поставили лайк!', status=201)
+        post_id = self.reaction_post_id()
+        if self.reaction_writer().add(Like, request.user.pk, post_id):
+            return Response('Вы поставили лайк!', status=201)
+        if self.post_not_found(post_id):
+            raise NotFound()
+        return Response('Вы уже лайкали этот пост!', status=400)
 
     # №2 способ удаления лайка(безопаснее)
     # api/v1/posts/<id>/remove_like/
     @action(["POST"], detail=True)
     def remove_like(self, request, pk):
-        post = self.get_object()
-        if not request.user.liked.filter(post=post).exists():
-            return Response('Вы еще не лайкали этот пост!', status=400)
-        request.user.liked.filter(post=post).delete()
-        return Response('Ваш лайк удален!', status=204)
+        post_id = self.reaction_post_id()
+        if self.reaction_writer().remove(Like, request.user.pk, post_id):
+            return Response('Ваш лайк удален!', status=204)
+        if self.post_not_found(post_id):
+            raise NotFound()
+        return Response('Вы еще не лайкали этот пост!', status=400)
 
     # api/v1/posts/<id>/get_likes/
     @action(['GET'], detail=True)
@@ -145,13 +362,75 @@ class PostViewSet(ModelViewSet):
     # api/v1/posts/<id>/favorite_posts
     @action(['POST'], detail=True)  # если не указывать "detail=True", "pk" не нужен
     def favorite_posts(self, request, pk):
-        post = self.get_object()
-        if request.user.favorites.filter(post=post).exists():
-            request.user.favorites.filter(post=post).delete()
+        post_id = self.reaction_post_id()
+        favorited = self.reaction_writer().toggle(Favorites, request.user.pk, post_id)
+        if favorited is None and self.post_not_found(post_id):
+            raise NotFound()
+        if favorited is False:
             return Response('Убрали пост из избранных!', status=204)
-        Favorites.objects.create(post=post, owner=request.user)
         return Response('Пост добавлен в избранные!', status=201)
 
+    # =========================================================================================================
+    # api/v1/posts/reactions/
+    # {"reactions": [{"post": 1, "type": "like", "value": true}, {"post": 2, "type": "favorite", "value": false}]}
+    @action(['POST'], detail=False, url_path='reactions')
+    def bulk_reactions(self, request):
+        serializer = serializers.ReactionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        changes = {name: {'add': [], 'remove': []} for name in reactions.REACTIONS}
+        for item in serializer.validated_data['reactions']:
+            changes[item['type']]['add' if item['value'] else 'remove'].append(item['post'])
+        # все виды одной транзакцией - и в базе, и в буфере write-behind
+        applied = self.reaction_writer().apply_many(
+            request.user.pk, {model: changes[name] for name, model in reactions.REACTIONS.items()})
+        result = {name: dict(zip(('added', 'removed'), applied[model])) for name, model in reactions.REACTIONS.items()}
+        return Response(result)
+
+    # api/v1/posts/trending/?limit=20 - готовый рейтинг из PostRank (main/trending.py)
+    @action(['GET'], detail=False)
+    def trending(self, request):
+        config = trending.get_config()
+        try:
+            limit = min(max(int(request.query_params.get('limit', config['TOP_K'])), 1), config['MAX_TOP_K'])
+        except ValueError:
+            limit = config['TOP_K']
+        posts = trending.top(self.filter_queryset(self.get_queryset()), limit)
+        return Response(self.get_serializer(posts, many=True).data)
+
+    # api/v1/posts/export/?output=ndjson|csv&comments=true&since=2022-08-01T00:00:00Z
+    @action(['GET'], detail=False)
+    def export(self, request):
+        params = request.query_params
+        output = params.get('output', 'ndjson')
+        if output not in exporter.FORMATS:
+            raise ValidationError({'output': [f'Expected one of: {", ".join(exporter.FORMATS)}.']})
+        since = None
+        if params.get('since'):
+            since = exporter.parse_since(params['since'])
+            if since is None:
+                raise ValidationError({'since': ['Expected an ISO 8601 datetime.']})
+        exported_at = timezone.now()
+        rows = exporter.export_rows(since, params.get('comments') in ('1', 'true'))
+        content_type = 'application/x-ndjson' if output == 'ndjson' else 'text/csv'
+        response = StreamingHttpResponse(exporter.buffered(exporter.render(rows, output)),
+                                         content_type=f'{content_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="posts.{output}"'
+        # since для следующей инкрементальной выгрузки
+        response['X-Exported-At'] = exported_at.isoformat()
+        return response
+
+    # api/v1/posts/import/?batch_size=1000
+    # тело - NDJSON (Content-Type: application/x-ndjson), формат строк - в main/importer.py
+    @action(['POST'], detail=False, url_path='import')
+    def bulk_import(self, request):
+        try:
+            batch_size = min(max(int(request.query_params.get('batch_size', 1000)), 1), 5000)
+        except ValueError:
+            batch_size = 1000
+        # request.data не трогаем: тело читается построчно, а не целиком в память
+        report = Importer(default_owner=request.user, batch_size=batch_size).run(request.stream or [])
+        return Response(report.as_dict())
+
 
 '''Одно и тоже с PostListView только на функции
 Нужные импорты:
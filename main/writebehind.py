@@ -0,0 +1,389 @@
+"""
+Write-behind для лайков и избранного (REACTION_BUFFER['ENABLED']).
+
+Когда пост "взлетает", тысячи add_like/favorite_posts вставляют строки и обновляют
+счетчики одного и того же поста - и ждут друг друга на блокировке его строки.
+В режиме write-behind запрос только читает текущее состояние (SELECT без блокировок)
+и дописывает новое в локальный буфер - SQLite в WAL-режиме (REACTION_BUFFER['PATH']),
+который переживает рестарт процесса. Фоновый поток (или команда flush_reactions) пачками
+переносит буфер в main_like/main_favorites: на пачку - одна транзакция, bulk_create,
+DELETE по постам и пересчет счетчиков и рейтинга затронутых постов, как в main/importer.py.
+Из буфера строки удаляются только после коммита; повтор пачки ничего не ломает -
+у реакции два состояния, побеждает последнее записанное.
+
+Пока реакция в буфере, PostViewSet (пост и лента) накладывает ее поверх данных из базы:
+флаги юзера и счетчики (overlay), ETag тоже учитывает буфер; списки избранного юзера
+(UserFavoritesView, UserSerializer) - добавленные и снятые посты (overlay_favorites). Буфер локальный:
+на другом сервере до сброса (FLUSH_INTERVAL) видно прежнее состояние.
+Сбрасывает один процесс на файл - аренда в таблице flusher.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import Exists, OuterRef
+
+from . import trending
+from .cache import post_cache
+from .counters import COUNTER_FIELDS, rebuild_counters
+from .models import Favorites, Post
+from .reactions import REACTIONS
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'PATH': os.path.join(settings.BASE_DIR, 'var/reactions.sqlite3'),
+    'SYNCHRONOUS': 'FULL',  # NORMAL - быстрее, но при отключении питания теряются последние реакции
+    'FLUSH_INTERVAL': 1.0,  # секунды; 0 - без фонового потока, только flush_reactions
+    'BATCH_SIZE': 5000,
+    'LEASE_SECONDS': 60,
+    'BUSY_TIMEOUT': 5.0,
+}
+
+KINDS = {model: kind for kind, model in REACTIONS.items()}
+FLAGS = {'like': 'is_liked', 'favorite': 'is_favorited'}
+COUNTERS = {kind: COUNTER_FIELDS[model] for kind, model in REACTIONS.items()}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    post_id INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    delta INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_user ON pending (user_id, kind, post_id);
+CREATE INDEX IF NOT EXISTS pending_post ON pending (post_id);
+CREATE TABLE IF NOT EXISTS flusher (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT,
+    expires REAL NOT NULL
+);
+"""
+
+# DELETE ... IN (...) кусками: у SQLite ограничено число параметров
+DELETE_CHUNK = 500
+
+
+class BufferBusy(Exception):
+    """Буфер занят другим процессом дольше BUSY_TIMEOUT; реакции не записаны."""
+
+
+def _placeholders(values):
+    return ', '.join(['?'] * len(values))
+
+
+class ReactionBuffer:
+
+    def __init__(self, config=None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self.enabled = self.config['ENABLED']
+        self.path = self.config['PATH']
+        self.local = threading.local()
+        self.flusher = None
+        self.flusher_lock = threading.Lock()
+
+    def db(self):
+        """Соединение с буфером - свое на поток: sqlite3 не делит соединения между потоками."""
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.path != self.path:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # isolation_level=None - автокоммит, транзакции только явные (BEGIN IMMEDIATE)
+            db = sqlite3.connect(self.path, timeout=self.config['BUSY_TIMEOUT'], isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(f'PRAGMA synchronous={self.config["SYNCHRONOUS"]}')
+            db.executescript(SCHEMA)
+            self.local.db, self.local.path = db, self.path
+        return db
+
+    # =============================================================================================
+    # запись: то же API, что у main/reactions.py
+
+    def apply(self, model, user_id, add=(), remove=()):
+        """
+        Ставит реакции на посты add и снимает с постов remove - в буфер.
+        Возвращает (добавлено, удалено), как reactions.apply; несуществующие посты пропускаются.
+        """
+        return self.apply_many(user_id, {model: {'add': add, 'remove': remove}})[model]
+
+    def apply_many(self, user_id, changes):
+        """
+        Реакции нескольких видов одной транзакцией буфера: {model: {'add': [...], 'remove': [...]}}
+        -> {model: (добавлено, удалено)}. Буфер занят дольше BUSY_TIMEOUT - BufferBusy, и тогда
+        не записано ничего.
+        """
+        changes = {model: (set(change.get('add', ())), set(change.get('remove', ())))
+                   for model, change in changes.items()}
+        result = {model: ([], []) for model in changes}
+        post_ids = sorted(set().union(*(add | remove for add, remove in changes.values())))
+        if not post_ids:
+            return result
+        # состояние в базе - один SELECT без блокировок; несуществующих постов в нем нет
+        stored = {}
+        for pk, *flags in Post.objects.filter(pk__in=post_ids).annotate(**{
+            KINDS[model]: Exists(model.objects.filter(post=OuterRef('pk'), owner_id=user_id)) for model in changes
+        }).values_list('pk', *(KINDS[model] for model in changes)):
+            for model, on in zip(changes, flags):
+                stored.setdefault(model, {})[pk] = on
+        rows, now = [], time.time()
+        db = self.db()
+        try:
+            # под блокировкой записи буфера: параллельный запрос того же юзера увидит эти реакции
+            db.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as exc:
+            raise BufferBusy(str(exc)) from exc
+        try:
+            for model, (add, remove) in changes.items():
+                kind, (added, removed) = KINDS[model], result[model]
+                known = stored.get(model, {})
+                state = {**known, **self.pending_state(db, kind, user_id, list(known))}
+                for post_id in sorted(add):
+                    if post_id in state and not state[post_id]:
+                        state[post_id] = True
+                        added.append(post_id)
+                        rows.append((kind, user_id, post_id, 1, 1, now))
+                for post_id in sorted(remove):
+                    if state.get(post_id):
+                        state[post_id] = False
+                        removed.append(post_id)
+                        rows.append((kind, user_id, post_id, 0, -1, now))
+            db.executemany(
+                'INSERT INTO pending (kind, user_id, post_id, value, delta, created) VALUES (?, ?, ?, ?, ?, ?)', rows,
+            )
+            db.execute('COMMIT')
+        except BaseException as exc:
+            db.execute('ROLLBACK')
+            if isinstance(exc, sqlite3.OperationalError):
+                raise BufferBusy(str(exc)) from exc
+            raise
+        if rows:
+            self.start_flusher()
+        return result
+
+    def add(self, model, user_id, post_id):
+        return bool(self.apply(model, user_id, add=[post_id])[0])
+
+    def remove(self, model, user_id, post_id):
+        return bool(self.apply(model, user_id, remove=[post_id])[1])
+
+    def toggle(self, model, user_id, post_id):
+        """True - реакция поставлена, False - снята, None - поста нет."""
+        if self.remove(model, user_id, post_id):
+            return False
+        return True if self.add(model, user_id, post_id) else None
+
+    # =============================================================================================
+    # чтение: отложенные реакции поверх ответа
+
+    @staticmethod
+    def pending_state(db, kind, user_id, post_ids):
+        """{post_id: последнее записанное состояние} реакций юзера в буфере."""
+        if not post_ids:
+            return {}
+        rows = db.execute(
+            f'SELECT post_id, value FROM pending WHERE kind = ? AND user_id = ? '
+            f'AND post_id IN ({_placeholders(post_ids)}) ORDER BY id',
+            [kind, user_id, *post_ids],
+        )
+        return {post_id: bool(value) for post_id, value in rows}
+
+    def pending_for(self, user, post_ids):
+        """{post_id: {'likes_count': +n, 'is_liked': True, ...}} - что поменять в ответе."""
+        post_ids = sorted(set(post_ids))
+        if not post_ids:
+            return {}
+        db, changes = self.db(), defaultdict(dict)
+        rows = db.execute(
+            f'SELECT kind, post_id, SUM(delta) FROM pending WHERE post_id IN ({_placeholders(post_ids)}) '
+            f'GROUP BY kind, post_id',
+            post_ids,
+        )
+        for kind, post_id, delta in rows:
+            if delta:
+                changes[post_id][COUNTERS[kind]] = delta
+        if user.is_authenticated:
+            rows = db.execute(
+                f'SELECT kind, post_id, value FROM pending WHERE user_id = ? '
+                f'AND post_id IN ({_placeholders(post_ids)}) ORDER BY id',
+                [user.pk, *post_ids],
+            )
+            for kind, post_id, value in rows:
+                changes[post_id][FLAGS[kind]] = bool(value)
+        return dict(changes)
+
+    @staticmethod
+    def apply_change(item, change):
+        """Накладывает изменение из pending_for на сериализованный пост (только на его поля)."""
+        if not change:
+            return item
+        item = dict(item)
+        for name, value in change.items():
+            if name not in item:
+                continue  # ?fields= без этого поля
+            item[name] = max(item[name] + value, 0) if name in COUNTERS.values() else value
+        return item
+
+    def overlay(self, data, user):
+        """То же для страницы ленты (dict с results или список)."""
+        items = data['results'] if isinstance(data, dict) else data
+        changes = self.pending_for(user, [item['id'] for item in items if 'id' in item])
+        if changes:
+            items = [self.apply_change(item, changes.get(item.get('id'))) for item in items]
+        return {**data, 'results': items} if isinstance(data, dict) else items
+
+    def pending_favorites(self, user_id):
+        """{post_id: в избранном ли} по буферу, от старых изменений к новым."""
+        state = {}
+        rows = self.db().execute(
+            "SELECT post_id, value FROM pending WHERE kind = 'favorite' AND user_id = ? ORDER BY id", (user_id,),
+        )
+        for post_id, value in rows:
+            state.pop(post_id, None)
+            state[post_id] = bool(value)
+        return state
+
+    def overlay_favorites(self, items, user_id, serialize_posts, first_page=True, limit=None):
+        """
+        Список избранного ([{'post': {...}}], новые сверху) с учетом буфера: снятые убираются,
+        новые (serialize_posts(ids) -> [данные поста]) встают в начало первой страницы.
+        """
+        state = self.pending_favorites(user_id)
+        if not state:
+            return items
+        items = [item for item in items if state.get(item['post']['id'], True)]
+        if first_page:
+            added = [post_id for post_id, value in reversed(state.items()) if value]
+            # уже в базе (снято и поставлено снова) - на своем месте в списке
+            stored = set(Favorites.objects.filter(owner_id=user_id, post_id__in=added)
+                         .values_list('post_id', flat=True))
+            new = [post_id for post_id in added if post_id not in stored]
+            if new:
+                items = [{'post': post} for post in serialize_posts(new)] + items
+        return items[:limit] if limit is not None else items
+
+    def version(self):
+        """Последняя запись буфера - для ETag ленты. None - буфер пуст."""
+        return self.db().execute('SELECT MAX(id) FROM pending').fetchone()[0]
+
+    def stats(self):
+        count, oldest = self.db().execute('SELECT COUNT(*), MIN(created) FROM pending').fetchone()
+        return {'pending': count, 'oldest_seconds': round(time.time() - oldest, 3) if oldest else None}
+
+    # =============================================================================================
+    # сброс в базу
+
+    def flush(self):
+        """Переносит буфер в базу. Возвращает число строк буфера (0 - пуст или сбрасывает другой)."""
+        db = self.db()
+        if db.execute('SELECT 1 FROM pending LIMIT 1').fetchone() is None or not self.acquire(db):
+            return 0
+        total, batch_size = 0, self.config['BATCH_SIZE']
+        try:
+            while True:
+                rows = db.execute(
+                    'SELECT id, kind, user_id, post_id, value FROM pending ORDER BY id LIMIT ?', (batch_size,),
+                ).fetchall()
+                if not rows:
+                    return total
+                self.write(rows)
+                # id растут монотонно, а писатель у SQLite один - все строки до rows[-1] уже прочитаны
+                db.execute('DELETE FROM pending WHERE id <= ?', (rows[-1][0],))
+                total += len(rows)
+                if len(rows) < batch_size or not self.acquire(db):
+                    return total
+        finally:
+            self.release(db)
+
+    def write(self, rows):
+        """Одна пачка буфера - одной транзакцией. Возвращает затронутые посты."""
+        latest = {}
+        for _, kind, user_id, post_id, value in rows:
+            latest[kind, user_id, post_id] = value
+        with transaction.atomic():
+            posts = set(Post.objects.filter(
+                pk__in={post_id for _, _, post_id in latest},
+            ).values_list('pk', flat=True))
+            users = set(User.objects.filter(
+                pk__in={user_id for _, user_id, _ in latest},
+            ).values_list('pk', flat=True))
+            touched = set()
+            for kind, model in REACTIONS.items():
+                adds, removes = [], defaultdict(list)
+                for (row_kind, user_id, post_id), value in latest.items():
+                    if row_kind != kind or post_id not in posts or user_id not in users:
+                        continue  # пост или юзер удалены, пока реакция ждала в буфере
+                    touched.add(post_id)
+                    if value:
+                        adds.append(model(post_id=post_id, owner_id=user_id))
+                    else:
+                        removes[post_id].append(user_id)
+                self.delete(model, removes)
+                # bulk_create не шлет post_save - счетчики пересчитываются ниже одним UPDATE
+                model.objects.bulk_create(adds, batch_size=self.config['BATCH_SIZE'], ignore_conflicts=True)
+            if touched:
+                rebuild_counters(Post.objects.filter(pk__in=touched))
+                trending.rebuild(touched)
+        post_cache.invalidate_posts(touched)
+        return touched
+
+    @staticmethod
+    def delete(model, removes):
+        # сырой DELETE, как в main/reactions.py: post_delete на каждую строку = UPDATE счетчика на каждую
+        with connection.cursor() as cursor:
+            for post_id, user_ids in removes.items():
+                for start in range(0, len(user_ids), DELETE_CHUNK):
+                    chunk = user_ids[start:start + DELETE_CHUNK]
+                    cursor.execute(
+                        f'DELETE FROM {model._meta.db_table} WHERE post_id = %s '
+                        f'AND owner_id IN ({", ".join(["%s"] * len(chunk))})',
+                        [post_id, *chunk],
+                    )
+
+    @staticmethod
+    def owner():
+        return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+    def acquire(self, db):
+        """Берет или продлевает аренду сброса. False - сбрасывает другой процесс/поток."""
+        now, owner = time.time(), self.owner()
+        db.execute('INSERT OR IGNORE INTO flusher (id, owner, expires) VALUES (1, NULL, 0)')
+        cursor = db.execute(
+            'UPDATE flusher SET owner = ?, expires = ? WHERE id = 1 AND (expires < ? OR owner = ?)',
+            (owner, now + self.config['LEASE_SECONDS'], now, owner),
+        )
+        return cursor.rowcount == 1
+
+    def release(self, db):
+        db.execute('UPDATE flusher SET expires = 0 WHERE id = 1 AND owner = ?', (self.owner(),))
+
+    def start_flusher(self):
+        if self.config['FLUSH_INTERVAL'] <= 0:
+            return
+        with self.flusher_lock:
+            # после fork потока в дочернем процессе нет - запускаем заново
+            if self.flusher is None or not self.flusher.is_alive():
+                self.flusher = threading.Thread(target=self.run_flusher, name='reaction-flusher', daemon=True)
+                self.flusher.start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(self.config['FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Reaction buffer flush failed')
+            finally:
+                connections.close_all()
+
+
+reaction_buffer = ReactionBuffer(getattr(settings, 'REACTION_BUFFER', None))